@@ -0,0 +1,56 @@
+"""
+Micro-benchmark of the per-call cost of game evaluation
+
+Run with python -m benchmarks.evaluate_game_benchmark
+"""
+import itertools
+import math
+import random
+import timeit
+
+import numpy as np
+import trueskill
+
+from inhouse_bot.matchmaking_logic.evaluate_game import evaluate_ratings, evaluate_ratings_array
+
+CALLS = 100_000
+
+
+def trueskill_evaluation(blue_ratings, red_ratings) -> float:
+    """
+    The previous evaluate_game logic, creating 10 trueskill.Rating objects per call
+    """
+    blue_team_ratings = [trueskill.Rating(mu=mu, sigma=sigma) for mu, sigma in blue_ratings]
+    red_team_ratings = [trueskill.Rating(mu=mu, sigma=sigma) for mu, sigma in red_ratings]
+
+    delta_mu = sum(r.mu for r in blue_team_ratings) - sum(r.mu for r in red_team_ratings)
+    sum_sigma = sum(r.sigma ** 2 for r in itertools.chain(blue_team_ratings, red_team_ratings))
+    denominator = math.sqrt(10 * (trueskill.BETA * trueskill.BETA) + sum_sigma)
+
+    return trueskill.global_env().cdf(delta_mu / denominator)
+
+
+def main():
+    rng = random.Random(0)
+    blue, red = [[(rng.gauss(25, 5), rng.uniform(1, 25 / 3)) for _ in range(5)] for _ in range(2)]
+
+    ratings = np.array(
+        [[[(rng.gauss(25, 5), rng.uniform(1, 25 / 3)) for _ in range(5)] for _ in range(2)]] * CALLS
+    )
+    blue_mu, blue_sigma = ratings[:, 0, :, 0], ratings[:, 0, :, 1]
+    red_mu, red_sigma = ratings[:, 1, :, 0], ratings[:, 1, :, 1]
+
+    timings = {
+        "trueskill.Rating objects": timeit.timeit(lambda: trueskill_evaluation(blue, red), number=CALLS),
+        "evaluate_ratings": timeit.timeit(lambda: evaluate_ratings(blue, red), number=CALLS),
+        "evaluate_ratings_array": timeit.timeit(
+            lambda: evaluate_ratings_array(blue_mu, blue_sigma, red_mu, red_sigma), number=1
+        ),
+    }
+
+    for name, timing in timings.items():
+        print(f"{name:<30}{timing / CALLS * 1e9:>10.0f} ns per game")
+
+
+if __name__ == "__main__":
+    main()
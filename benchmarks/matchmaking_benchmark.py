@@ -0,0 +1,204 @@
+"""
+Matchmaking benchmark on synthetic queues, which does not need a database
+
+Run with python -m benchmarks.matchmaking_benchmark --output results.json
+Results of two commits can then be compared with python -m benchmarks.matchmaking_benchmark --compare a.json b.json
+"""
+import argparse
+import itertools
+import json
+import platform
+import subprocess
+import time
+import tracemalloc
+from typing import Optional
+
+from benchmarks.synthetic_queues import make_synthetic_queue, ROLE_DISTRIBUTIONS
+from inhouse_bot.matchmaking_logic.find_best_game import find_best_queue_composition, matchmaking_engines
+from inhouse_bot.matchmaking_logic.search_deadline import SearchDeadline
+
+PLAYERS_COUNTS = [10, 15, 20, 30, 50, 100, 200]
+DUO_DENSITIES = [0.0, 0.3]
+RATING_SPREADS = [2.0, 8.0]
+
+# Fields identifying the same scenario in two result files
+SCENARIO_KEYS = (
+    "engine",
+    "players_count",
+    "role_distribution",
+    "duo_density",
+    "rating_spread",
+    "multi_role_ratio",
+    "seed",
+)
+
+
+def get_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def run_scenario(engine: str, scenario: dict, game_quality_threshold: float, time_budget: float) -> dict:
+    packed_queue = make_synthetic_queue(**scenario)
+
+    def search():
+        return find_best_queue_composition(
+            packed_queue,
+            game_quality_threshold,
+            engine=engine if engine != "auto" else None,
+            deadline=SearchDeadline(time_budget),
+        )
+
+    start = time.perf_counter()
+    result = search()
+    wall_time = time.perf_counter() - start
+
+    # tracemalloc slows allocations down a lot, so memory is measured in a second search that is not timed
+    tracemalloc.start()
+    search()
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        **scenario,
+        "engine": engine,
+        "queue_rows": len(packed_queue),
+        "wall_time": wall_time,
+        "peak_memory": peak_memory,
+        "compositions_evaluated": result.compositions_evaluated,
+        "players_considered": result.players_considered,
+        "exhaustive": result.exhaustive,
+        "matchmaking_score": result.composition.matchmaking_score if result.composition else None,
+    }
+
+
+def run_benchmark(engines: list, game_quality_threshold: float, time_budget: float, seeds: int) -> dict:
+    results = []
+
+    for players_count, role_distribution, duo_density, rating_spread, seed in itertools.product(
+        PLAYERS_COUNTS, ROLE_DISTRIBUTIONS, DUO_DENSITIES, RATING_SPREADS, range(seeds)
+    ):
+        scenario = {
+            "players_count": players_count,
+            "role_distribution": role_distribution,
+            "duo_density": duo_density,
+            "rating_spread": rating_spread,
+            "multi_role_ratio": 0.1,
+            "seed": seed,
+        }
+
+        for engine in engines:
+            results.append(run_scenario(engine, scenario, game_quality_threshold, time_budget))
+
+            print(
+                f"{engine:<18}{players_count:>4} players {role_distribution:<8} duos {duo_density:.1f} "
+                f"spread {rating_spread:>4.1f}  {results[-1]['wall_time'] * 1000:>9.1f} ms  "
+                f"{results[-1]['compositions_evaluated']:>10} compositions"
+            )
+
+    return {
+        "commit": get_commit(),
+        "python": platform.python_version(),
+        "game_quality_threshold": game_quality_threshold,
+        "time_budget": time_budget,
+        "results": results,
+    }
+
+
+def scenario_key(result: dict) -> tuple:
+    return tuple(result[key] for key in SCENARIO_KEYS)
+
+
+def format_value(value: Optional[float], width: int) -> str:
+    return f"{'-':>{width}}" if value is None else f"{value:>{width}.2f}"
+
+
+def format_delta(before: Optional[float], after: Optional[float]) -> str:
+    if before is None or after is None:
+        return f"{'-':>9}"
+    if not before:
+        return f"{'+0.0%' if not after else 'new':>9}"
+
+    return f"{(after - before) / before:>+9.1%}"
+
+
+def compare(before_path: str, after_path: str):
+    """
+    Prints the wall time and peak memory of every scenario in two result files side by side, with their deltas
+
+    Scenarios only present in one of the files are shown with dashes
+    """
+    benchmarks = []
+    for path in (before_path, after_path):
+        with open(path) as file:
+            benchmarks.append(json.load(file))
+
+    before, after = ({scenario_key(r): r for r in benchmark["results"]} for benchmark in benchmarks)
+
+    print(f"Comparing {benchmarks[0]['commit']} (before) to {benchmarks[1]['commit']} (after)\n")
+    print(
+        f"{'engine':<18}{'players':>8} {'roles':<8}{'duos':>5}{'spread':>7}{'seed':>5}"
+        f"{'before ms':>12}{'after ms':>12}{'delta':>9}{'before MiB':>12}{'after MiB':>12}{'delta':>9}"
+    )
+
+    for key in sorted(before.keys() | after.keys()):
+        scenario = dict(zip(SCENARIO_KEYS, key))
+        results = before.get(key), after.get(key)
+
+        times = [result["wall_time"] * 1000 if result else None for result in results]
+        memories = [result["peak_memory"] / 2 ** 20 if result else None for result in results]
+
+        print(
+            f"{scenario['engine']:<18}{scenario['players_count']:>8} {scenario['role_distribution']:<8}"
+            f"{scenario['duo_density']:>5.1f}{scenario['rating_spread']:>7.1f}{scenario['seed']:>5}"
+            f"{format_value(times[0], 12)}{format_value(times[1], 12)}{format_delta(*times)}"
+            f"{format_value(memories[0], 12)}{format_value(memories[1], 12)}{format_delta(*memories)}"
+        )
+
+    # Totals only use scenarios present in both files, so they can be compared
+    shared_keys = before.keys() & after.keys()
+    print()
+
+    for engine in sorted({dict(zip(SCENARIO_KEYS, key))["engine"] for key in shared_keys}):
+        engine_keys = [key for key in shared_keys if dict(zip(SCENARIO_KEYS, key))["engine"] == engine]
+
+        times = [sum(results[key]["wall_time"] for key in engine_keys) * 1000 for results in (before, after)]
+        memories = [
+            max(results[key]["peak_memory"] for key in engine_keys) / 2 ** 20 for results in (before, after)
+        ]
+
+        print(
+            f"{engine:<18}{len(engine_keys):>4} scenarios   "
+            f"total time {times[0]:>10.2f} ms -> {times[1]:>10.2f} ms"
+            f"{format_delta(*times)}   max peak {memories[0]:>8.2f} MiB -> {memories[1]:>8.2f} MiB"
+            f"{format_delta(*memories)}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--engines", nargs="+", default=["auto", *matchmaking_engines])
+    parser.add_argument("--game-quality-threshold", type=float, default=0.1)
+    parser.add_argument("--time-budget", type=float, default=10, help="Maximum search time per queue")
+    parser.add_argument("--seeds", type=int, default=1, help="Number of queues generated per scenario")
+    parser.add_argument("--output", help="JSON file to write the results to")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"), help="Compares two result files")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    benchmark = run_benchmark(args.engines, args.game_quality_threshold, args.time_budget, args.seeds)
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(benchmark, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+import random
+from typing import Dict, List
+
+from inhouse_bot.common_utils.fields import roles_list
+from inhouse_bot.matchmaking_logic.packed_queue import PackedQueue, NO_DUO
+
+# Relative number of players queuing for each role, in roles_list order
+ROLE_DISTRIBUTIONS: Dict[str, List[float]] = {
+    "uniform": [1, 1, 1, 1, 1],
+    # What we usually see at peak hours, with a lot of mid and bot players and few supports
+    "skewed": [1, 0.8, 1.6, 1.4, 0.5],
+}
+
+
+def make_synthetic_queue(
+    players_count: int,
+    role_distribution: str = "uniform",
+    duo_density: float = 0.0,
+    rating_spread: float = 5.0,
+    multi_role_ratio: float = 0.0,
+    seed: int = 0,
+) -> PackedQueue:
+    """
+    Creates a random queue fully in memory
+
+    Args:
+        players_count: number of different players in queue
+        role_distribution: key of ROLE_DISTRIBUTIONS
+        duo_density: share of players queuing in a duo
+        rating_spread: standard deviation of the players’ mu
+        multi_role_ratio: share of players also queuing for a second role
+        seed: random seed, the same arguments always give the same queue
+    """
+    rng = random.Random(seed)
+
+    rows = []  # [player_id, role_idx, duo_id, mu, sigma]
+
+    for player_id in range(players_count):
+        role_idx = rng.choices(range(len(roles_list)), ROLE_DISTRIBUTIONS[role_distribution])[0]
+        rows.append([player_id, role_idx, NO_DUO, rng.gauss(25, rating_spread), rng.uniform(1, 25 / 3)])
+
+    for row in rng.sample(list(rows), int(players_count * multi_role_ratio)):
+        other_role = rng.choice([r for r in range(len(roles_list)) if r != row[1]])
+        rows.append([row[0], other_role, NO_DUO, rng.gauss(25, rating_spread), rng.uniform(1, 25 / 3)])
+
+    # Duos are made of two single-role players in different roles
+    solo_rows = [row for row in rows if sum(r[0] == row[0] for r in rows) == 1]
+    for _ in range(int(players_count * duo_density / 2)):
+        first = rng.choice(solo_rows)
+        partners = [r for r in solo_rows if r[1] != first[1] and r is not first]
+
+        if not partners:
+            break
+
+        second = rng.choice(partners)
+        first[2], second[2] = second[0], first[0]
+        solo_rows = [r for r in solo_rows if r is not first and r is not second]
+
+    # Rows order is the seniority order in queue
+    rng.shuffle(rows)
+
+    return PackedQueue(
+        player_ids=[r[0] for r in rows],
+        roles=[r[1] for r in rows],
+        duo_ids=[r[2] for r in rows],
+        mu=[r[3] for r in rows],
+        sigma=[r[4] for r in rows],
+    )
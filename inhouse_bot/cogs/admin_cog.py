@@ -1,3 +1,4 @@
+import asyncio
 from typing import Union
 
 import discord
@@ -5,11 +6,13 @@ from discord.ext import commands
 from discord.ext.commands import guild_only
 
 from inhouse_bot import game_queue, matchmaking_logic
-from inhouse_bot.database_orm import session_scope
+from inhouse_bot.database_orm import run_in_session
 from inhouse_bot.common_utils.constants import CONFIG_OPTIONS, PREFIX
 from inhouse_bot.common_utils.docstring import doc
-from inhouse_bot.common_utils.get_last_game import get_last_game
-from inhouse_bot.common_utils.get_server_config import get_server_config
+from inhouse_bot.common_utils.get_last_game import load_last_game
+from inhouse_bot.common_utils.get_server_config import get_server_config, invalidate_server_config
+from inhouse_bot.game_queue.player_cache import player_cache
+from inhouse_bot.game_queue.rating_cache import rating_cache
 from inhouse_bot.inhouse_bot import InhouseBot
 from inhouse_bot.queue_channel_handler import queue_channel_handler
 from inhouse_bot.ranking_channel_handler.ranking_channel_handler import ranking_channel_handler
@@ -55,6 +58,10 @@ class AdminCog(commands.Cog, name="Admin"):
             game_queue.remove_player(member_or_channel.id)
             await ctx.send(f"{member_or_channel.name} has been removed from all queues")
 
+        # Ratings and players are reloaded from the database, which also picks up edits made outside of the bot
+        rating_cache.invalidate(ctx.guild.id)
+        player_cache.invalidate(ctx.guild.id)
+
         await queue_channel_handler.update_queue_channels(bot=self.bot, server_id=ctx.guild.id)
 
     @admin.command()
@@ -62,9 +69,10 @@ class AdminCog(commands.Cog, name="Admin"):
         """
         Scores the user’s last game as a win and recomputes ratings based on it
         """
-        # TODO LOW PRIO Make a function that recomputes *all* ratings to allow to re-score/delete/cancel any game
-
-        matchmaking_logic.score_game_from_winning_player(player_id=member.id, server_id=ctx.guild.id)
+        # TODO LOW PRIO Allow to re-score/delete any game, ratings can then be fixed with !admin recompute
+        await matchmaking_logic.score_game_from_winning_player_async(
+            player_id=member.id, server_id=ctx.guild.id
+        )
         await ranking_channel_handler.update_ranking_channels(self.bot, ctx.guild.id)
 
         await ctx.send(
@@ -72,6 +80,123 @@ class AdminCog(commands.Cog, name="Admin"):
             f"and ratings have been recalculated"
         )
 
+    @admin.command()
+    @guild_only()
+    @doc(f"""
+        Scores multiple games at once, given as game ids followed by the winning side
+
+        Games are scored in chronological order, which is useful to score games that were played during an outage
+
+        Example:
+            {PREFIX}admin score 1234 BLUE 1235 RED
+    """)
+    async def score(self, ctx: commands.Context, *games_and_winners: str):
+        game_ids, sides = games_and_winners[::2], [side.upper() for side in games_and_winners[1::2]]
+
+        if not game_ids or len(game_ids) != len(sides) or not all(game_id.isdigit() for game_id in game_ids):
+            await ctx.send(f"Games should be given as {PREFIX}admin score game_id side game_id side ...")
+            return
+
+        if any(side not in ("BLUE", "RED") for side in sides):
+            await ctx.send("Accepted sides are BLUE and RED")
+            return
+
+        # Ratings of all games are written at once, so it runs in a thread to not block the bot
+        scored_game_ids = await asyncio.get_event_loop().run_in_executor(
+            None,
+            matchmaking_logic.score_games,
+            ctx.guild.id,
+            {int(game_id): side for game_id, side in zip(game_ids, sides)},
+        )
+
+        # Ranking channels are only refreshed once for all games
+        await ranking_channel_handler.update_ranking_channels(self.bot, ctx.guild.id)
+
+        await ctx.send(f"{len(scored_game_ids)} games have been scored and ratings have been updated")
+
+        skipped_game_ids = [game_id for game_id in game_ids if int(game_id) not in scored_game_ids]
+
+        if skipped_game_ids:
+            await ctx.send(f"Games {', '.join(skipped_game_ids)} were not found or already scored")
+
+    @admin.command()
+    @guild_only()
+    async def recompute(self, ctx: commands.Context, scope: str = "server"):
+        """
+        Recomputes all ratings in the server by replaying every scored game
+
+        Used after fixing a game that was scored wrong
+        The bot owner can use "all" to recompute ratings in every server at once
+        """
+        if scope.lower() == "all":
+            if not await self.bot.is_owner(ctx.author):
+                await ctx.send("Only the bot owner can recompute ratings in all servers")
+                return
+
+            # Servers are replayed in parallel in worker processes, which we wait for in a thread
+            games_counts = await asyncio.get_event_loop().run_in_executor(
+                None, matchmaking_logic.recompute_all_ratings
+            )
+
+            # Without a server id, ranking channels of all servers are updated
+            await ranking_channel_handler.update_ranking_channels(self.bot, None)
+
+            await ctx.send(
+                f"Ratings have been recomputed from {sum(games_counts.values())} scored games "
+                f"in {len(games_counts)} servers"
+            )
+            return
+
+        # The replay can take a few seconds on big servers, so it runs in a thread to not block the bot
+        games_count = await asyncio.get_event_loop().run_in_executor(
+            None, matchmaking_logic.recompute_ratings, ctx.guild.id
+        )
+
+        await ranking_channel_handler.update_ranking_channels(self.bot, ctx.guild.id)
+
+        await ctx.send(f"Ratings have been recomputed from {games_count} scored games")
+
+    @admin.command()
+    @guild_only()
+    @doc(f"""
+        Shows or changes the rating engine of the server
+
+        Example:
+            `{PREFIX}admin rating` shows the current engine and its parameters
+            `{PREFIX}admin rating trueskill beta=5 tau=0.1` uses TrueSkill with custom parameters
+            `{PREFIX}admin rating elo k_factor=3` uses Elo, which is simpler and faster
+            `{PREFIX}admin rating default` goes back to the default TrueSkill engine
+
+        New games are rated with the new engine, use `{PREFIX}admin recompute` to re-rate past games with it
+    """)
+    async def rating(self, ctx: commands.Context, engine_name: str = "", *parameters: str):
+        if not engine_name:
+            await matchmaking_logic.preload_rating_engine(ctx.guild.id)
+            await ctx.send(f"Current rating engine: {matchmaking_logic.get_rating_engine(ctx.guild.id)}")
+            return
+
+        try:
+            if engine_name.lower() == "default":
+                settings = None
+            else:
+                settings = {"name": engine_name.lower()}
+
+                for parameter in parameters:
+                    key, value = parameter.split("=")
+                    settings[key.lower()] = float(value)
+
+            # Unknown engines raise a ValueError and unknown parameters a TypeError
+            engine = await matchmaking_logic.set_rating_engine_async(ctx.guild.id, settings)
+
+        except (ValueError, TypeError):
+            await ctx.send(
+                f"Invalid rating engine or parameters, accepted engines are "
+                f"{', '.join(matchmaking_logic.rating_engine_classes)} with key=value parameters"
+            )
+            return
+
+        await ctx.send(f"Rating engine set to {engine}")
+
     @admin.command()
     async def cancel(self, ctx: commands.Context, member: discord.Member):
         """
@@ -79,14 +204,11 @@ class AdminCog(commands.Cog, name="Admin"):
 
         Only works if the game has not been scored yet
         """
-        with session_scope() as session:
-            game, participant = get_last_game(player_id=member.id, server_id=ctx.guild.id, session=session)
+        game = await run_in_session(delete_last_game, member.id, ctx.guild.id)
 
-            if game and game.winner:
-                await ctx.send("The game has already been scored and cannot be canceled anymore")
-                return
-
-            session.delete(game)
+        if game and game.winner:
+            await ctx.send("The game has already been scored and cannot be canceled anymore")
+            return
 
         await ctx.send(f"{member.display_name}’s ongoing game was cancelled and deleted from the database")
         await queue_channel_handler.update_queue_channels(bot=self.bot, server_id=ctx.guild.id)
@@ -158,12 +280,37 @@ class AdminCog(commands.Cog, name="Admin"):
             await ctx.send(f"Accepted options for {PREFIX}admin config config_key option are: {', '.join(options.keys())}")
             return
 
-        with session_scope() as session:
-            server_config = get_server_config(server_id=ctx.guild.id, session=session)
+        value = await run_in_session(
+            set_config_value, ctx.guild.id, config_key, options[option] if option != "STATUS" else None
+        )
+
+        # The change is committed, so the next read gets it from the database
+        if option != "STATUS":
+            invalidate_server_config(ctx.guild.id)
+
+        value = 'ON' if value else 'OFF'
+        await ctx.send(f"{config_key} is: {value}")
+
+
+def delete_last_game(session, player_id: int, server_id: int):
+    """
+    Deletes the player’s last game if it was not scored yet, and returns it
+    """
+    game, participant = load_last_game(session, player_id, server_id)
+
+    if not (game and game.winner):
+        session.delete(game)
+
+    return game
+
+
+def set_config_value(session, server_id: int, config_key: str, value):
+    """
+    Sets the config key to the value if it is not None, and returns its current value
+    """
+    server_config = get_server_config(server_id=server_id, session=session)
 
-            if option != "STATUS":
-                server_config.config[config_key] = options[option]
-                session.commit()
+    if value is not None:
+        server_config.config[config_key] = value
 
-            value = 'ON' if server_config.config.get(config_key) else 'OFF'
-            await ctx.send(f"{config_key} is: {value}")
+    return server_config.config.get(config_key)
@@ -1,3 +1,4 @@
+import asyncio
 from datetime import datetime, timedelta
 
 import discord
@@ -10,10 +11,11 @@ from inhouse_bot.common_utils.constants import PREFIX
 from inhouse_bot.common_utils.docstring import doc
 from inhouse_bot.common_utils.emoji_and_thumbnails import get_role_emoji
 from inhouse_bot.common_utils.fields import RoleConverter
-from inhouse_bot.common_utils.get_last_game import get_last_game
+from inhouse_bot.common_utils.get_last_game import load_last_game
+from inhouse_bot.common_utils.get_server_config import get_server_config_by_key_async
 from inhouse_bot.common_utils.validation_dialog import checkmark_validation
 
-from inhouse_bot.database_orm import session_scope
+from inhouse_bot.database_orm import Game, run_in_session
 from inhouse_bot.inhouse_bot import InhouseBot
 from inhouse_bot.queue_channel_handler import queue_channel_handler
 from inhouse_bot.queue_channel_handler.queue_channel_handler import queue_channel_only
@@ -35,22 +37,80 @@ class QueueCog(commands.Cog, name="Queue"):
 
         self.games_getting_scored_ids = set()
 
-    async def run_matchmaking_logic(
-        self, ctx: commands.Context,
-    ):
+        # Queues whose next matchmaking run should first offer the next best game of their previous search
+        self.queues_offering_alternative = set()
+
+        # Ready checks waiting for players, referenced here so their tasks are not garbage collected
+        self.ready_check_tasks = set()
+
+    async def schedule_matchmaking(self, ctx: commands.Context, offer_alternative: bool = False):
         """
-        Runs the matchmaking logic in the channel defined by the context
+        Schedules the matchmaking logic in the queue of the context
+
+        Runs of the same queue never overlap, and changes made while one is pending or running are coalesced into
+        a single rerun, so a rush of players does not start one search per player
+
+        If offer_alternative is True, the next best game of the previous search is offered if it is still possible
 
         Should only be called inside guilds
         """
-        queue = game_queue.GameQueue(ctx.channel.id)
+        # Servers using a server-wide pool run a single search over all their queue channels
+        server_pool = await get_server_config_by_key_async(server_id=ctx.guild.id, key="server_pool")
+        queue_id = ctx.guild.id if server_pool else ctx.channel.id
 
-        game = matchmaking_logic.find_best_game(queue)
+        if offer_alternative:
+            self.queues_offering_alternative.add(queue_id)
 
-        if not game:
-            return
+        matchmaking_logic.matchmaking_scheduler.trigger(
+            queue_id, lambda: self.run_matchmaking_logic(ctx, server_pool=server_pool)
+        )
+
+    async def run_matchmaking_logic(self, ctx: commands.Context, server_pool: bool = False):
+        """
+        Runs the matchmaking logic in the channel defined by the context, or in its server if server_pool is True
+
+        Only called by the matchmaking scheduler, and returns once the ready checks of the games found are started
+        """
+        # Queues and games are then built from memory only
+        await game_queue.preload_server(ctx.guild.id)
+
+        if server_pool:
+            queue = game_queue.GameQueue(None, server_id=ctx.guild.id)
+        else:
+            queue = game_queue.GameQueue(ctx.channel.id)
+
+        games = []
+        if queue.queue_id in self.queues_offering_alternative:
+            self.queues_offering_alternative.discard(queue.queue_id)
 
-        elif game and game.matchmaking_score < 0.2:
+            game = await matchmaking_logic.matchmaking_executor.find_alternative_game(queue)
+            games = [game] if game else []
+
+        if not games:
+            # With enough players, servers can start multiple games at once instead of one every ready check
+            enough_players = len({qp.player_id for qp in queue.queue_players}) >= 20
+
+            if enough_players and await get_server_config_by_key_async(
+                server_id=ctx.guild.id, key="multi_game"
+            ):
+                games = await matchmaking_logic.matchmaking_executor.find_best_games(queue)
+
+            else:
+                # The search runs in a separate process to not block the bot while it is running
+                game = await matchmaking_logic.matchmaking_executor.find_best_game(queue)
+                games = [game] if game else []
+
+        # Games have no player in common, so all their ready checks can run at the same time
+        await asyncio.gather(*(self.run_ready_check(ctx, game, queue) for game in games))
+
+    async def run_ready_check(self, ctx: commands.Context, game: Game, queue: game_queue.GameQueue):
+        """
+        Starts the ready check of the game found in the queue
+
+        Its players are marked as in a ready check before returning, so the next matchmaking run of the queue
+        does not include them, and the validation is handled in the background
+        """
+        if game.matchmaking_score < 0.2:
             embed = game.get_embed(embed_type="GAME_FOUND", validated_players=[], bot=self.bot)
 
             # We notify the players and send the message
@@ -59,94 +119,111 @@ class QueueCog(commands.Cog, name="Queue"):
             # We mark the ready check as ongoing (which will be used to the queue)
             game_queue.start_ready_check(
                 player_ids=game.player_ids_list,
-                channel_id=ctx.channel.id,
+                channel_id=queue.channel_id,
                 ready_check_message_id=ready_check_message.id,
+                server_id=ctx.guild.id,
             )
 
             # We update the queue in all channels
             await queue_channel_handler.update_queue_channels(bot=self.bot, server_id=ctx.guild.id)
 
-            # And then we wait for the validation
-            try:
-                ready, players_to_drop = await checkmark_validation(
-                    bot=self.bot,
-                    message=ready_check_message,
-                    validating_players_ids=game.player_ids_list,
-                    validation_threshold=10,
-                    game=game,
-                )
-
-            # We catch every error here to make sure it does not become blocking
-            except Exception as e:
-                self.bot.logger.error(e)
-                game_queue.cancel_ready_check(
-                    ready_check_id=ready_check_message.id,
-                    ids_to_drop=game.player_ids_list,
-                    server_id=ctx.guild.id,
-                )
-                await ctx.send(
-                    "There was a bug with the ready-check message, all players have been dropped from queue\n"
-                    "Please queue again to restart the process"
-                )
-
-                await queue_channel_handler.update_queue_channels(bot=self.bot, server_id=ctx.guild.id)
-
-                return
+            # Validation can take minutes, and the queue’s next matchmaking run does not need to wait for it
+            task = asyncio.get_event_loop().create_task(
+                self.handle_ready_check(ctx, game, queue, ready_check_message)
+            )
+            self.ready_check_tasks.add(task)
+            task.add_done_callback(self.ready_check_tasks.discard)
 
-            if ready is True:
-                # We drop all 10 players from the queue
-                game_queue.validate_ready_check(ready_check_message.id)
-
-                # We commit the game to the database (without a winner)
-                with session_scope() as session:
-                    session.expire_on_commit = False
-                    game = session.merge(game)  # This gets us the game ID
-
-                queue_channel_handler.mark_queue_related_message(
-                    await ctx.send(embed=game.get_embed("GAME_ACCEPTED"),)
-                )
-
-                # We create voice channels for each team in this game
-                await create_voice_channels(ctx, game)
-
-            elif ready is False:
-                # We remove the player who cancelled
-                game_queue.cancel_ready_check(
-                    ready_check_id=ready_check_message.id,
-                    ids_to_drop=players_to_drop,
-                    channel_id=ctx.channel.id,
-                )
-
-                await ctx.send(
-                    f"A player cancelled the game and was removed from the queue\n"
-                    f"All other players have been put back in the queue",
-                )
-
-                # We restart the matchmaking logic
-                await self.run_matchmaking_logic(ctx)
-
-            elif ready is None:
-                # We remove the timed out players from *all* channels (hence giving server id)
-                game_queue.cancel_ready_check(
-                    ready_check_id=ready_check_message.id,
-                    ids_to_drop=players_to_drop,
-                    server_id=ctx.guild.id,
-                )
-
-                await ctx.send(
-                    "The check timed out and players who did not answer have been dropped from all queues",
-                )
-
-                # We restart the matchmaking logic
-                await self.run_matchmaking_logic(ctx)
-
-        elif game and game.matchmaking_score >= 0.2:
+        else:
             # One side has over 70% predicted winrate, we do not start anything
             await ctx.send(
                 f"The best match found had a side with a {(.5 + game.matchmaking_score)*100:.1f}%"
                 f" predicted winrate and was not started"
             )
 
+    async def handle_ready_check(
+        self,
+        ctx: commands.Context,
+        game: Game,
+        queue: game_queue.GameQueue,
+        ready_check_message: discord.Message,
+    ):
+        """
+        Waits for the players to validate the ready check and handles its result
+        """
+        # We wait for the validation
+        try:
+            ready, players_to_drop = await checkmark_validation(
+                bot=self.bot,
+                message=ready_check_message,
+                validating_players_ids=game.player_ids_list,
+                validation_threshold=10,
+                game=game,
+            )
+
+        # We catch every error here to make sure it does not become blocking
+        except Exception as e:
+            self.bot.logger.error(e)
+            game_queue.cancel_ready_check(
+                ready_check_id=ready_check_message.id,
+                ids_to_drop=game.player_ids_list,
+                server_id=ctx.guild.id,
+            )
+            await ctx.send(
+                "There was a bug with the ready-check message, all players have been dropped from queue\n"
+                "Please queue again to restart the process"
+            )
+
+            await queue_channel_handler.update_queue_channels(bot=self.bot, server_id=ctx.guild.id)
+
+            return
+
+        if ready is True:
+            # We drop all 10 players from the queue
+            game_queue.validate_ready_check(ready_check_message.id)
+
+            # We commit the game to the database (without a winner)
+            game = await run_in_session(merge_game, game)  # This gets us the game ID
+
+            queue_channel_handler.mark_queue_related_message(
+                await ctx.send(embed=game.get_embed("GAME_ACCEPTED"),)
+            )
+
+            # We create voice channels for each team in this game
+            await create_voice_channels(ctx, game)
+
+        elif ready is False:
+            # We remove the player who cancelled, from all channels if the game comes from a server-wide pool
+            game_queue.cancel_ready_check(
+                ready_check_id=ready_check_message.id,
+                ids_to_drop=players_to_drop,
+                channel_id=queue.channel_id,
+                server_id=ctx.guild.id if queue.channel_id is None else None,
+            )
+
+            await ctx.send(
+                f"A player cancelled the game and was removed from the queue\n"
+                f"All other players have been put back in the queue",
+            )
+
+            # We restart the matchmaking logic, directly offering another game found by the last search if possible
+            await self.schedule_matchmaking(ctx, offer_alternative=True)
+
+        elif ready is None:
+            # We remove the timed out players from *all* channels (hence giving server id)
+            game_queue.cancel_ready_check(
+                ready_check_id=ready_check_message.id,
+                ids_to_drop=players_to_drop,
+                server_id=ctx.guild.id,
+            )
+
+            await ctx.send(
+                "The check timed out and players who did not answer have been dropped from all queues",
+            )
+
+            # We restart the matchmaking logic, directly offering another game found by the last search if possible
+            await self.schedule_matchmaking(ctx, offer_alternative=True)
+
     @commands.command(aliases=["view_queue", "refresh"])
     @queue_channel_only()
     async def view(
@@ -194,7 +271,7 @@ class QueueCog(commands.Cog, name="Queue"):
         if not duo:
 
             # Simply queuing the player
-            game_queue.add_player(
+            await game_queue.add_player_async(
                 player_id=ctx.author.id,
                 name=ctx.author.display_name,
                 role=role,
@@ -226,7 +303,7 @@ class QueueCog(commands.Cog, name="Queue"):
                 return
 
             # Here, we have a working duo queue
-            game_queue.add_duo(
+            await game_queue.add_duo_async(
                 first_player_id=ctx.author.id,
                 first_player_role=role,
                 first_player_name=ctx.author.display_name,
@@ -238,7 +315,7 @@ class QueueCog(commands.Cog, name="Queue"):
                 jump_ahead=jump_ahead,
             )
 
-        await self.run_matchmaking_logic(ctx=ctx)
+        await self.schedule_matchmaking(ctx=ctx)
 
         await queue_channel_handler.update_queue_channels(bot=self.bot, server_id=ctx.guild.id)
 
@@ -256,6 +333,14 @@ class QueueCog(commands.Cog, name="Queue"):
     ):
         game_queue.remove_player(player_id=ctx.author.id, channel_id=ctx.channel.id)
 
+        # If a game was being searched in this channel, it could include the player
+        # Searches of a server-wide pool run under the server id
+        matchmaking_logic.matchmaking_executor.cancel(ctx.channel.id)
+        matchmaking_logic.matchmaking_executor.cancel(ctx.guild.id)
+
+        # Players still in queue could have been part of the cancelled search, so we search again without them
+        await self.schedule_matchmaking(ctx=ctx)
+
         await queue_channel_handler.update_queue_channels(bot=self.bot, server_id=ctx.guild.id)
 
     @commands.command(aliases=["win", "wins", "victory"])
@@ -271,58 +356,57 @@ class QueueCog(commands.Cog, name="Queue"):
     async def won(
         self, ctx: commands.Context,
     ):
-        with session_scope() as session:
-            # Get the latest game
-            game, participant = get_last_game(
-                player_id=ctx.author.id, server_id=ctx.guild.id, session=session
-            )
+        # Get the latest game, without keeping a session open while players validate
+        game, participant = await run_in_session(load_last_game, ctx.author.id, ctx.guild.id)
 
-            if not game:
-                await ctx.send("You have not played a game on this server yet")
-                return
-
-            elif game and game.winner:
-                await ctx.send(
-                    "Your last game seem to have already been scored\n"
-                    "If there was an issue, please contact an admin"
-                )
-                return
-
-            elif game.id in self.games_getting_scored_ids:
-                await ctx.send("There is already a scoring or cancellation message active for this game")
-                return
-
-            else:
-                self.games_getting_scored_ids.add(game.id)
-
-            win_validation_message = await ctx.send(
-                f"{game.players_ping}"
-                f"{ctx.author.display_name} wants to score game {game.id} as a win for {participant.side}\n"
-                f"Result will be validated once 6 players from the game press ✅"
-            )
+        if not game:
+            await ctx.send("You have not played a game on this server yet")
+            return
 
-            validated, players_who_refused = await checkmark_validation(
-                bot=self.bot,
-                message=win_validation_message,
-                validating_players_ids=game.player_ids_list,
-                validation_threshold=6,
+        elif game and game.winner:
+            await ctx.send(
+                "Your last game seem to have already been scored\n"
+                "If there was an issue, please contact an admin"
             )
+            return
 
-            # Whatever happens, we’re not scoring it anymore if we get here
-            self.games_getting_scored_ids.remove(game.id)
+        elif game.id in self.games_getting_scored_ids:
+            await ctx.send("There is already a scoring or cancellation message active for this game")
+            return
 
-            if not validated:
-                await ctx.send("Score input was either cancelled or timed out")
-                return
+        else:
+            self.games_getting_scored_ids.add(game.id)
+
+        win_validation_message = await ctx.send(
+            f"{game.players_ping}"
+            f"{ctx.author.display_name} wants to score game {game.id} as a win for {participant.side}\n"
+            f"Result will be validated once 6 players from the game press ✅"
+        )
+
+        validated, players_who_refused = await checkmark_validation(
+            bot=self.bot,
+            message=win_validation_message,
+            validating_players_ids=game.player_ids_list,
+            validation_threshold=6,
+        )
+
+        # Whatever happens, we’re not scoring it anymore if we get here
+        self.games_getting_scored_ids.remove(game.id)
+
+        if not validated:
+            await ctx.send("Score input was either cancelled or timed out")
+            return
 
-            # If we get there, the score was validated and we can simply update the game and the ratings
-            queue_channel_handler.mark_queue_related_message(
-                await ctx.send(
-                    f"Game {game.id} has been scored as a win for {participant.side} and ratings have been updated"
-                )
+        # If we get there, the score was validated and we can simply update the game and the ratings
+        queue_channel_handler.mark_queue_related_message(
+            await ctx.send(
+                f"Game {game.id} has been scored as a win for {participant.side} and ratings have been updated"
             )
+        )
 
-        matchmaking_logic.score_game_from_winning_player(player_id=ctx.author.id, server_id=ctx.guild.id)
+        await matchmaking_logic.score_game_from_winning_player_async(
+            player_id=ctx.author.id, server_id=ctx.guild.id
+        )
         await ranking_channel_handler.update_ranking_channels(self.bot, ctx.guild.id)
 
         # If we're here, the game has been scored and the voice channels for this game can be removed
@@ -341,49 +425,59 @@ class QueueCog(commands.Cog, name="Queue"):
     async def cancel(
         self, ctx: commands.Context,
     ):
-        with session_scope() as session:
-            # Get the latest game
-            game, participant = get_last_game(
-                player_id=ctx.author.id, server_id=ctx.guild.id, session=session
-            )
+        # Get the latest game, without keeping a session open while players validate
+        game, participant = await run_in_session(load_last_game, ctx.author.id, ctx.guild.id)
 
-            if game and game.winner:
-                await ctx.send("It does not look like you are part of an ongoing game")
-                return
+        if game and game.winner:
+            await ctx.send("It does not look like you are part of an ongoing game")
+            return
 
-            elif game.id in self.games_getting_scored_ids:
-                await ctx.send("There is already a scoring or cancellation message active for this game")
-                return
+        elif game.id in self.games_getting_scored_ids:
+            await ctx.send("There is already a scoring or cancellation message active for this game")
+            return
 
-            else:
-                self.games_getting_scored_ids.add(game.id)
+        else:
+            self.games_getting_scored_ids.add(game.id)
 
-            cancel_validation_message = await ctx.send(
-                f"{game.players_ping}"
-                f"{ctx.author.display_name} wants to cancel game {game.id}\n"
-                f"Game will be canceled once 6 players from the game press ✅"
-            )
+        cancel_validation_message = await ctx.send(
+            f"{game.players_ping}"
+            f"{ctx.author.display_name} wants to cancel game {game.id}\n"
+            f"Game will be canceled once 6 players from the game press ✅"
+        )
 
-            validated, players_who_refused = await checkmark_validation(
-                bot=self.bot,
-                message=cancel_validation_message,
-                validating_players_ids=game.player_ids_list,
-                validation_threshold=6,
-            )
+        validated, players_who_refused = await checkmark_validation(
+            bot=self.bot,
+            message=cancel_validation_message,
+            validating_players_ids=game.player_ids_list,
+            validation_threshold=6,
+        )
 
-            self.games_getting_scored_ids.remove(game.id)
+        self.games_getting_scored_ids.remove(game.id)
 
-            if not validated:
-                await ctx.send(f"Game {game.id} was not cancelled")
+        if not validated:
+            await ctx.send(f"Game {game.id} was not cancelled")
 
-            else:
+        else:
+
+            for participant in game.participants.values():
+                self.players_whose_last_game_got_cancelled[participant.player_id] = datetime.now()
+
+            await remove_voice_channels(ctx, game)
+            await run_in_session(delete_game, game.id)
+
+            queue_channel_handler.mark_queue_related_message(await ctx.send(f"Game {game.id} was cancelled"))
+
+
+def merge_game(session, game: Game) -> Game:
+    """
+    Writes the game and returns the merged copy, which has its id
+    """
+    game = session.merge(game)
+    session.flush()
 
-                for participant in game.participants.values():
-                    self.players_whose_last_game_got_cancelled[participant.player_id] = datetime.now()
+    return game
 
-                await remove_voice_channels(ctx, game)
-                session.delete(game)
 
-                queue_channel_handler.mark_queue_related_message(
-                    await ctx.send(f"Game {game.id} was cancelled")
-                )
+def delete_game(session, game_id: int):
+    # Deleting through the ORM deletes participants too, and lets the player cache see the game is gone
+    session.delete(session.query(Game).get(game_id))
@@ -18,7 +18,7 @@ import matplotlib.pyplot as plt
 from inhouse_bot.common_utils.constants import PREFIX
 from inhouse_bot.common_utils.docstring import doc
 from inhouse_bot.common_utils.emoji_and_thumbnails import get_role_emoji, get_rank_emoji
-from inhouse_bot.database_orm import session_scope, GameParticipant, Game, PlayerRating, Player
+from inhouse_bot.database_orm import run_in_session, GameParticipant, Game, PlayerRating, Player
 from inhouse_bot.common_utils.fields import ChampionNameConverter, RoleConverter
 from inhouse_bot.common_utils.get_last_game import get_last_game
 
@@ -55,24 +55,7 @@ class StatsCog(commands.Cog, name="Stats"):
     async def champion(
         self, ctx: commands.Context, champion_name: ChampionNameConverter(), game_id: int = None
     ):
-        with session_scope() as session:
-            if not game_id:
-                game, participant = get_last_game(
-                    player_id=ctx.author.id, server_id=ctx.guild.id, session=session
-                )
-            else:
-                game, participant = (
-                    session.query(Game, GameParticipant)
-                    .select_from(Game)
-                    .join(GameParticipant)
-                    .filter(Game.id == game_id)
-                    .filter(GameParticipant.player_id == ctx.author.id)
-                ).one_or_none()
-
-            # We write down the champion
-            participant.champion_id = champion_name
-
-            game_id = game.id
+        game_id = await run_in_session(set_champion, ctx.author.id, ctx.guild.id, champion_name, game_id)
 
         await ctx.send(
             f"Champion for game {game_id} was set to "
@@ -89,22 +72,9 @@ class StatsCog(commands.Cog, name="Stats"):
     async def history(self, ctx: commands.Context):
         # TODO LOW PRIO Add an @ user for admins
 
-        with session_scope() as session:
-            session.expire_on_commit = False
-
-            game_participant_query = (
-                session.query(Game, GameParticipant)
-                .select_from(Game)
-                .join(GameParticipant)
-                .filter(GameParticipant.player_id == ctx.author.id)
-                .order_by(Game.start.desc())
-            )
-
-            # If we’re on a server, we only show games played on that server
-            if ctx.guild:
-                game_participant_query = game_participant_query.filter(Game.server_id == ctx.guild.id)
-
-            game_participant_list = game_participant_query.limit(100).all()
+        game_participant_list = await run_in_session(
+            query_history, ctx.author.id, ctx.guild.id if ctx.guild else None
+        )
 
         if not game_participant_list:
             await ctx.send("No games found")
@@ -129,52 +99,26 @@ class StatsCog(commands.Cog, name="Stats"):
             {PREFIX}rank
     """)
     async def stats(self, ctx: commands.Context):
-        with session_scope() as session:
-            rating_objects = (
-                session.query(
-                    PlayerRating,
-                    sqlalchemy.func.count().label("count"),
-                    (
-                        sqlalchemy.func.sum((Game.winner == GameParticipant.side).cast(sqlalchemy.Integer))
-                    ).label("wins"),
-                )
-                .select_from(PlayerRating)
-                .join(GameParticipant)
-                .join(Game)
-                .filter(PlayerRating.player_id == ctx.author.id)
-                .group_by(PlayerRating)
-            )
-
-            if ctx.guild:
-                rating_objects = rating_objects.filter(PlayerRating.player_server_id == ctx.guild.id)
-
-            rows = []
+        player_ranks = await run_in_session(query_ranks, ctx.author.id, ctx.guild.id if ctx.guild else None)
 
-            for row in sorted(rating_objects.all(), key=lambda r: -r.count):
-                # TODO LOW PRIO Make that a subquery
-                rank = (
-                    session.query(sqlalchemy.func.count())
-                    .select_from(PlayerRating)
-                    .filter(PlayerRating.player_server_id == row.PlayerRating.player_server_id)
-                    .filter(PlayerRating.role == row.PlayerRating.role)
-                    .filter(PlayerRating.mmr > row.PlayerRating.mmr)
-                ).first()[0]
+        rows = []
 
-                rank_str = get_rank_emoji(rank)
+        for server_id, role, rank, mmr, wins, count in player_ranks:
+            rank_str = get_rank_emoji(rank)
 
-                row_string = (
-                    f"{f'{self.bot.get_guild(row.PlayerRating.player_server_id).name} ' if not ctx.guild else ''}"
-                    f"{get_role_emoji(row.PlayerRating.role)} "
-                    f"{rank_str} "
-                    f"`{int(row.PlayerRating.mmr)} MMR  "
-                    f"{row.wins}W {row.count-row.wins}L`"
-                )
+            row_string = (
+                f"{f'{self.bot.get_guild(server_id).name} ' if not ctx.guild else ''}"
+                f"{get_role_emoji(role)} "
+                f"{rank_str} "
+                f"`{int(mmr)} MMR  "
+                f"{wins}W {count-wins}L`"
+            )
 
-                rows.append(row_string)
+            rows.append(row_string)
 
-            embed = Embed(title=f"Ranks for {ctx.author.display_name}", description="\n".join(rows))
+        embed = Embed(title=f"Ranks for {ctx.author.display_name}", description="\n".join(rows))
 
-            await ctx.send(embed=embed)
+        await ctx.send(embed=embed)
 
     @commands.command(aliases=["rankings"])
     @guild_only()
@@ -188,7 +132,7 @@ class StatsCog(commands.Cog, name="Stats"):
             {PREFIX}ranking mid
     """)
     async def ranking(self, ctx: commands.Context, role: RoleConverter() = None):
-        ratings = ranking_channel_handler.get_server_ratings(ctx.guild.id, role=role)
+        ratings = await ranking_channel_handler.get_server_ratings(ctx.guild.id, role=role)
 
         if not ratings:
             await ctx.send("No games played yet")
@@ -210,23 +154,7 @@ class StatsCog(commands.Cog, name="Stats"):
         """
         date_start = datetime.now() - timedelta(hours=24 * 30)
 
-        with session_scope() as session:
-
-            participants = (
-                session.query(
-                    Game.start,
-                    GameParticipant.role,
-                    GameParticipant.mmr,
-                    PlayerRating.mmr.label("latest_mmr"),
-                )
-                .select_from(Game)
-                .join(GameParticipant)
-                .join(PlayerRating)  # Join on rating first to select the right role
-                .join(Player)
-                .filter(GameParticipant.player_id == ctx.author.id)
-                .filter(Game.start > date_start)
-                .order_by(Game.start.asc())
-            )
+        participants = await run_in_session(query_mmr_history, ctx.author.id, date_start)
 
         mmr_history = defaultdict(lambda: {"dates": [], "mmr": []})
 
@@ -260,3 +188,103 @@ class StatsCog(commands.Cog, name="Stats"):
             temp.close()
 
     # TODO MEDIUM PRIO (simple) Add !champions_stats once again!!!
+
+
+def set_champion(session, player_id: int, server_id: int, champion_id: int, game_id: int = None) -> int:
+    """
+    Writes down the champion the player used in the game, or in his last game if no game_id is given
+    """
+    if not game_id:
+        game, participant = get_last_game(player_id=player_id, server_id=server_id, session=session)
+    else:
+        game, participant = (
+            session.query(Game, GameParticipant)
+            .select_from(Game)
+            .join(GameParticipant)
+            .filter(Game.id == game_id)
+            .filter(GameParticipant.player_id == player_id)
+        ).one_or_none()
+
+    # We write down the champion
+    participant.champion_id = champion_id
+
+    return game.id
+
+
+def query_history(session, player_id: int, server_id: int = None):
+    game_participant_query = (
+        session.query(Game, GameParticipant)
+        .select_from(Game)
+        .join(GameParticipant)
+        .filter(GameParticipant.player_id == player_id)
+        .order_by(Game.start.desc())
+    )
+
+    # If we’re on a server, we only show games played on that server
+    if server_id:
+        game_participant_query = game_participant_query.filter(Game.server_id == server_id)
+
+    return game_participant_query.limit(100).all()
+
+
+def query_ranks(session, player_id: int, server_id: int = None):
+    """
+    Returns the (server_id, role, rank, mmr, wins, games count) of the player’s ratings, most played first
+    """
+    rating_objects = (
+        session.query(
+            PlayerRating,
+            sqlalchemy.func.count().label("count"),
+            (
+                sqlalchemy.func.sum((Game.winner == GameParticipant.side).cast(sqlalchemy.Integer))
+            ).label("wins"),
+        )
+        .select_from(PlayerRating)
+        .join(GameParticipant)
+        .join(Game)
+        .filter(PlayerRating.player_id == player_id)
+        .group_by(PlayerRating)
+    )
+
+    if server_id:
+        rating_objects = rating_objects.filter(PlayerRating.player_server_id == server_id)
+
+    ranks = []
+
+    for row in sorted(rating_objects.all(), key=lambda r: -r.count):
+        # TODO LOW PRIO Make that a subquery
+        rank = (
+            session.query(sqlalchemy.func.count())
+            .select_from(PlayerRating)
+            .filter(PlayerRating.player_server_id == row.PlayerRating.player_server_id)
+            .filter(PlayerRating.role == row.PlayerRating.role)
+            .filter(PlayerRating.mmr > row.PlayerRating.mmr)
+        ).first()[0]
+
+        ranks.append(
+            (
+                row.PlayerRating.player_server_id,
+                row.PlayerRating.role,
+                rank,
+                row.PlayerRating.mmr,
+                row.wins,
+                row.count,
+            )
+        )
+
+    return ranks
+
+
+def query_mmr_history(session, player_id: int, date_start: datetime):
+    return (
+        session.query(
+            Game.start, GameParticipant.role, GameParticipant.mmr, PlayerRating.mmr.label("latest_mmr"),
+        )
+        .select_from(Game)
+        .join(GameParticipant)
+        .join(PlayerRating)  # Join on rating first to select the right role
+        .join(Player)
+        .filter(GameParticipant.player_id == player_id)
+        .filter(Game.start > date_start)
+        .order_by(Game.start.asc())
+    ).all()
@@ -4,7 +4,27 @@ PREFIX = os.environ.get("INHOUSE_BOT_COMMAND_PREFIX") or "!"
 # 12pm UTC is 5am PT
 QUEUE_RESET_TIME = os.environ.get("QUEUE_RESET_TIME") or "12:00"
 
+# Number of processes running matchmaking searches, defaults to the number of CPUs
+MATCHMAKING_WORKERS = int(os.environ.get("INHOUSE_BOT_MATCHMAKING_WORKERS") or 0) or None
+# Seconds after which a matchmaking search is abandoned
+MATCHMAKING_TIMEOUT = float(os.environ.get("INHOUSE_BOT_MATCHMAKING_TIMEOUT") or 30)
+# Seconds after which a matchmaking search returns the best game found so far
+MATCHMAKING_TIME_BUDGET = float(os.environ.get("INHOUSE_BOT_MATCHMAKING_TIME_BUDGET") or 5)
+# Seconds matchmaking waits for after a queue change, so changes made in a burst are handled by a single run
+MATCHMAKING_DEBOUNCE = float(os.environ.get("INHOUSE_BOT_MATCHMAKING_DEBOUNCE") or 0.5)
+# Number of queues whose matchmaking can run at the same time, defaults to the number of matchmaking processes
+MATCHMAKING_CONCURRENCY = (
+    int(os.environ.get("INHOUSE_BOT_MATCHMAKING_CONCURRENCY") or 0)
+    or MATCHMAKING_WORKERS
+    or os.cpu_count()
+    or 1
+)
+# Seconds queue changes are grouped for before being written to the database
+QUEUE_WRITE_DELAY = float(os.environ.get("INHOUSE_BOT_QUEUE_WRITE_DELAY") or 0.5)
+
 CONFIG_OPTIONS = [
     ("queue_reset", f"Resets the queues daily at {QUEUE_RESET_TIME} UTC"),
-    ("voice", "Allows the bot to create private voice channels for each team when a game is started.")
+    ("voice", "Allows the bot to create private voice channels for each team when a game is started."),
+    ("multi_game", "Starts multiple games at once when at least 20 players are in a queue."),
+    ("server_pool", "Matches players from all the queue channels of the server together."),
 ]
@@ -17,3 +17,18 @@ def get_last_game(
         None,
         None,
     )  # To not have unpacking errors
+
+
+def load_last_game(
+    session, player_id: int, server_id: int
+) -> Tuple[Optional[Game], Optional[GameParticipant]]:
+    """
+    Same as get_last_game, with the game’s participants loaded so it can be used after the session is closed
+    """
+    game, participant = get_last_game(player_id, server_id, session)
+
+    if game is not None:
+        # Accessing the relationship loads it
+        game.participants
+
+    return game, participant
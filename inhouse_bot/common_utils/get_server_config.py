@@ -1,6 +1,11 @@
+from typing import Dict
+
 from inhouse_bot.common_utils.constants import CONFIG_OPTIONS
 from inhouse_bot.database_orm import ServerConfig
-from inhouse_bot.database_orm.session.session_handler import session_scope
+from inhouse_bot.database_orm.session.session_handler import session_scope, run_in_session
+
+# server_id -> config, as some options are read every time matchmaking runs
+_server_configs: Dict[int, dict] = {}
 
 
 def get_server_config(server_id: int, session) -> ServerConfig:
@@ -30,8 +35,33 @@ def get_server_config_by_key(server_id: int, key: str) -> bool:
     """
     By utilizing this function, we ensure that keys that don't yet exist in the config
     will return False.
+
+    Configs are cached, so the database is only queried the first time a server's config is needed
+    """
+    if server_id not in _server_configs:
+        with session_scope() as session:
+            _server_configs[server_id] = _load_config(session, server_id)
+
+    return _server_configs[server_id].get(key, False)
+
+
+async def get_server_config_by_key_async(server_id: int, key: str) -> bool:
     """
+    Same as get_server_config_by_key, through the async engine
+    """
+    if server_id not in _server_configs:
+        _server_configs[server_id] = await run_in_session(_load_config, server_id)
+
+    return _server_configs[server_id].get(key, False)
+
+
+def invalidate_server_config(server_id: int):
+    """
+    Drops the cached config of the server, which needs to be called once a change to it is committed
+    """
+    _server_configs.pop(server_id, None)
+
 
-    with session_scope() as session:
-        server_config = get_server_config(server_id=server_id, session=session)
-        return server_config.config.get(key, False)
+def _load_config(session, server_id: int) -> dict:
+    # A copy, so changes made to the session's object do not reach the cache before they are committed
+    return dict(get_server_config(server_id=server_id, session=session).config)
@@ -1,9 +1,16 @@
+import asyncio
 import os
-from contextlib import contextmanager
+import weakref
+from contextlib import contextmanager, asynccontextmanager
+from typing import Callable, TypeVar
 
 import sqlalchemy.orm
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 
+T = TypeVar("T")
+
 # The declarative base that we use for all our SQL alchemy classes
 bot_declarative_base = declarative_base()
 
@@ -15,6 +22,8 @@ class GhostSessionMaker:
 
     _session_maker = None
 
+    # asyncpg connections belong to the event loop that opened them, so each loop gets its own engine
+    _async_session_makers = weakref.WeakKeyDictionary()
 
     @property
     def session_maker(self):
@@ -31,9 +40,35 @@ class GhostSessionMaker:
         # We create all the tables and columns as required by the classes in the other parts of the program
         bot_declarative_base.metadata.create_all(bind=engine)
 
+        # Migrations run here and not on import so matchmaking can be used without a database
+        from inhouse_bot.database_orm import mini_migration_tool
+
+        mini_migration_tool.migrate(engine)
+
         # This is the SessionMaker we use to create session to interact with the database
         self._session_maker = sqlalchemy.orm.sessionmaker(bind=engine)
 
+    @property
+    def async_session_maker(self):
+        loop = asyncio.get_running_loop()
+
+        if loop not in self._async_session_makers:
+            # Tables and migrations are handled by the synchronous engine, once at startup
+            if not self._session_maker:
+                self._initialize_sqlalchemy()
+
+            # Same database, but through asyncpg so queries do not block the bot’s event loop
+            engine = create_async_engine(
+                make_url(os.environ["INHOUSE_BOT_CONNECTION_STRING"]).set(drivername="postgresql+asyncpg")
+            )
+
+            # Objects are used after their session is closed, and async sessions cannot refresh them lazily
+            self._async_session_makers[loop] = sqlalchemy.orm.sessionmaker(
+                bind=engine, class_=AsyncSession, expire_on_commit=False
+            )
+
+        return self._async_session_makers[loop]
+
 
 ghost_session_maker = GhostSessionMaker()
 
@@ -54,5 +89,29 @@ def session_scope():
     finally:
         session.close()
 
-##
 
+@asynccontextmanager
+async def async_session_scope():
+    """
+    Provide a transactional scope around a series of operations, on the asyncio engine
+    """
+    session = ghost_session_maker.async_session_maker()
+    try:
+        yield session
+        await session.commit()
+    except Exception as e:
+        await session.rollback()
+        raise e
+    finally:
+        await session.close()
+
+
+async def run_in_session(function: Callable[..., T], *args, **kwargs) -> T:
+    """
+    Awaits function(session, *args, **kwargs) in an async session, then commits
+
+    The function is regular ORM code, so the same query functions serve the synchronous facade through session_scope
+    and coroutines through this function, without blocking the event loop
+    """
+    async with async_session_scope() as session:
+        return await session.run_sync(function, *args, **kwargs)
@@ -50,10 +50,13 @@ class GameParticipant(bot_declarative_base):
         {},
     )
 
-    # Conservative rating for MMR display
+    # Conservative rating for MMR display, the same for every rating engine
     @hybrid_property
     def mmr(self):
-        return 20 * (self.trueskill_mu - 3 * self.trueskill_sigma + 25)
+        # Local import to not have circular imports
+        from inhouse_bot.matchmaking_logic.rating_engines import rating_to_mmr
+
+        return rating_to_mmr(self.trueskill_mu, self.trueskill_sigma)
 
     @hybrid_property
     def short_name(self):
@@ -61,6 +64,9 @@ class GameParticipant(bot_declarative_base):
 
     # Called only from the Game constructor itself
     def __init__(self, side: str, role: str, player: Player):
+        # Local import to not have circular imports
+        from inhouse_bot.game_queue.rating_cache import rating_cache
+
         self.side = side
         self.role = role
 
@@ -68,5 +74,5 @@ class GameParticipant(bot_declarative_base):
         self.name = player.name
         self.player_server_id = player.server_id
 
-        self.trueskill_mu = player.ratings[role].trueskill_mu
-        self.trueskill_sigma = player.ratings[role].trueskill_sigma
+        # Pre-game ratings come from the rating cache, player.ratings only being read if they are missing from it
+        self.trueskill_mu, self.trueskill_sigma = rating_cache.player_rating(player, role)
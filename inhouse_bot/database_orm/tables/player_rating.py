@@ -30,10 +30,13 @@ class PlayerRating(bot_declarative_base):
         {},
     )
 
-    # Conservative rating for MMR display
+    # Conservative rating for MMR display, the same for every rating engine
     @hybrid_property
     def mmr(self):
-        return 20 * (self.trueskill_mu - 3 * self.trueskill_sigma + 25)
+        # Local import to not have circular imports
+        from inhouse_bot.matchmaking_logic.rating_engines import rating_to_mmr
+
+        return rating_to_mmr(self.trueskill_mu, self.trueskill_sigma)
 
     def __repr__(self):
         return f"<PlayerRating: player_id={self.player_id} role={self.role}>"
@@ -43,6 +46,9 @@ class PlayerRating(bot_declarative_base):
         self.player_server_id = player.server_id
         self.role = role
 
+        # Local import to not have circular imports
+        from inhouse_bot.matchmaking_logic.rating_engines import MU, SIGMA
+
         # Initializing TrueSkill to default base values
-        self.trueskill_mu = 25
-        self.trueskill_sigma = 25 / 3
+        self.trueskill_mu = MU
+        self.trueskill_sigma = SIGMA
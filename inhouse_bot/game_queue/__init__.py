@@ -3,6 +3,7 @@ from inhouse_bot.game_queue.queue_handler import (
     PlayerInReadyCheck,
     PlayerInGame,
     add_player,
+    add_player_async,
     remove_player,
     remove_players,
     start_ready_check,
@@ -12,5 +13,7 @@ from inhouse_bot.game_queue.queue_handler import (
     get_active_queues,
     reset_queue,
     add_duo,
+    add_duo_async,
+    preload_server,
     remove_duo,
 )
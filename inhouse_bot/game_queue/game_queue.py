@@ -1,11 +1,9 @@
 from collections import defaultdict
-from typing import Dict, List, Tuple
+from typing import Dict, List, Optional, Tuple
 
-from sqlalchemy import func
-from sqlalchemy.orm import joinedload
-
-from inhouse_bot.database_orm import QueuePlayer, PlayerRating, session_scope
+from inhouse_bot.database_orm import QueuePlayer
 from inhouse_bot.common_utils.fields import roles_list
+from inhouse_bot.game_queue.queue_store import queue_store
 
 
 class GameQueue:
@@ -15,107 +13,132 @@ class GameQueue:
 
     queue_players: List[QueuePlayer]
 
-    def __init__(self, channel_id: int):
-        with session_scope() as session:
-            # This allows use to keep using our objects after the session is closed
-            session.expire_on_commit = False
-
-            # TODO LOW PRIO Optimize the query (ideally, is_in_queue subquery hybrid property)
-            # First, we get all players in queue, which loads Player and PlayerRating objects as well
-            potential_queue_players = (
-                session.query(QueuePlayer)
-                .options(joinedload(QueuePlayer.duo))
-                .filter(QueuePlayer.channel_id == channel_id)
-                .order_by(QueuePlayer.queue_time.asc())
-                .all()
-            )
+    def __init__(
+        self,
+        channel_id: Optional[int],
+        server_id: Optional[int] = None,
+        queue_players: Optional[List[QueuePlayer]] = None,
+    ):
+        """
+        If channel_id is None, the queue is the server-wide pool of all the queue channels of server_id
 
-            # If we have no player in queue, we stop there
-            if not potential_queue_players:
-                self.server_id = None
-                self.queue_players = []
-                return
-
-            # Else, we have our server_id from the players themselves
-            self.server_id = potential_queue_players[0].player_server_id
-
-            # We make sure all our queue players have the right ratings
-            for queue_player in potential_queue_players:
-                try:
-                    assert queue_player.player.ratings[queue_player.role]
-                except KeyError:
-                    # If not, we create a new rating object
-                    queue_player.player.ratings[queue_player.role] = PlayerRating(
-                        queue_player.player, queue_player.role
-                    )
-                    session.commit()
-
-            # Afterwards, we get players currently in a ready check in any other queue in the server
-            queue_query = (
-                session.query(
-                    QueuePlayer.player_id, func.max(QueuePlayer.ready_check_id).label("is_in_ready_check"),
-                )
-                .filter(
-                    QueuePlayer.player_id.in_([p.player_id for p in potential_queue_players])
-                )  # We could remove that and run the query in parallel
-                .filter(QueuePlayer.player_server_id == self.server_id)
-                .group_by(QueuePlayer.player_id)
-            )
+        queue_players is used to create the queue from players already taken from the queue store
+        """
+        self.channel_id = channel_id
+        self.server_id = server_id
 
-            player_ids_in_ready_check = [r.player_id for r in queue_query if r.is_in_ready_check is not None]
+        # The queue store is the source of truth for queues, so building a queue never queries the database
+        if queue_players is None:
+            queue_players = queue_store.queue_players(channel_id=channel_id, server_id=server_id)
 
-            # Finally, we can cleanup the queue_players variable with only the players truly in queue here
-            self.queue_players = [
-                qp for qp in potential_queue_players if qp.player_id not in player_ids_in_ready_check
-            ]
+        # In a server-wide pool, players queuing for the same role in multiple channels are only considered once
+        if channel_id is None:
+            queue_players = pool_queue_players(queue_players)
 
-            # The starting queue is made of the 2 players per role who have been in queue the longest
-            #   We also add any duos *required* for the game to fire
-            starting_queue = defaultdict(list)
+        # If we have no player in queue, we stop there
+        if not queue_players:
+            self.queue_players = []
+            self._build_index()
+            return
 
-            for role in self.queue_players_dict:
-                for qp in self.queue_players_dict[role]:
+        # Else, we have our server_id from the players themselves
+        self.server_id = queue_players[0].player_server_id
+
+        self.queue_players = queue_players
+        self._build_index()
+
+        # The starting queue is made of the 2 players per role who have been in queue the longest
+        #   We also add any duos *required* for the game to fire
+        starting_queue = defaultdict(list)
+
+        # role -> player ids in starting_queue[role], kept in sync with it
+        starting_player_ids = defaultdict(set)
+
+        for role in roles_list:
+            for qp in self.queue_players_dict[role]:
 
-                    # If we already have 2 players in that role, we continue
-                    if len(starting_queue[role]) >= 2:
-                        continue
+                # If we already have 2 players in that role, the younger players are not looked at
+                if len(starting_queue[role]) >= 2:
+                    break
 
-                    # Else we add our current player if he’s not there yet (could have been added by his duo)
-                    # TODO LOW PRIO cleanup that ugly code
-                    if qp.player_id not in [qp.player_id for qp in starting_queue[role]]:
-                        starting_queue[role].append(qp)
+                # Else we add our current player if he’s not there yet (could have been added by his duo)
+                if qp.player_id not in starting_player_ids[role]:
+                    starting_queue[role].append(qp)
+                    starting_player_ids[role].add(qp.player_id)
 
-                    # If he has a duo, we add it if he’s not in queue for his role already
-                    if qp.duo_id is not None:
-                        duo_role = qp.duo.role
+                # If he has a duo, we add it if he’s not in queue for his role already
+                if qp.duo_id is not None:
+                    duo_role = qp.duo.role
 
-                        # If the role queue of the duo is already filled, we pop the youngest player
-                        if len(starting_queue[duo_role]) >= 2:
-                            starting_queue[duo_role].pop()
+                    # The duo’s own row in the queue is used when there is one, as qp.duo can be another object
+                    duo = self.queue_players_index.get((qp.duo_id, duo_role), qp.duo)
 
-                        # We add the duo as part of the queue for his role *if he’s not yet in it*
-                        # TODO LOW PRIO find a more readable syntax, all those list comprehensions are really bad
-                        if qp.duo_id not in [qp.player_id for qp in starting_queue[duo_role]]:
-                            starting_queue[duo_role].append(qp.duo)
+                    # If the role queue of the duo is already filled, we pop the youngest player
+                    if len(starting_queue[duo_role]) >= 2:
+                        starting_player_ids[duo_role].remove(starting_queue[duo_role].pop().player_id)
 
-            # Afterwards we fill the rest of the queue with players in chronological order
+                    # We add the duo as part of the queue for his role *if he’s not yet in it*
+                    if qp.duo_id not in starting_player_ids[duo_role]:
+                        starting_queue[duo_role].append(duo)
+                        starting_player_ids[duo_role].add(qp.duo_id)
 
-            age_sorted_queue_players = sum(
-                list(starting_queue.values()), []
-            )  # Flattening the QueuePlayer objects to a single list
+        # Afterwards we fill the rest of the queue with players in chronological order
+        age_sorted_queue_players = [qp for role_queue in starting_queue.values() for qp in role_queue]
 
-            # This should always be the first game we try
-            assert len(age_sorted_queue_players) <= 10
+        # This should always be the first game we try
+        assert len(age_sorted_queue_players) <= 10
 
-            # We create a (role, id) list to see who is already in queue more easily
-            #   Simple equality does not work because the qp.duo objects are != from the solo qp objects
-            age_sorted_queue_players_ids = [(qp.player_id, qp.role) for qp in age_sorted_queue_players]
+        # Simple equality does not work because the qp.duo objects are != from the solo qp objects
+        starting_keys = {(qp.player_id, qp.role) for qp in age_sorted_queue_players}
 
-            age_sorted_queue_players += [
-                qp for qp in self.queue_players if (qp.player_id, qp.role) not in age_sorted_queue_players_ids
-            ]
+        age_sorted_queue_players += [
+            qp for qp in self.queue_players if (qp.player_id, qp.role) not in starting_keys
+        ]
 
-            self.queue_players = age_sorted_queue_players
+        self.queue_players = age_sorted_queue_players
+
+        # Role lists and duos follow the final order of the queue
+        self._build_index()
+
+    def _build_index(self):
+        """
+        Builds the per-role lists, the (player_id, role) index and the duos list in a single pass over the queue
+        """
+        # This dictionary will always have all roles included
+        self.queue_players_dict: Dict[str, List[QueuePlayer]] = {role: [] for role in roles_list}
+        self.queue_players_index: Dict[Tuple[int, str], QueuePlayer] = {}
+        self.duos: List[Tuple[QueuePlayer, QueuePlayer]] = []
+
+        for qp in self.queue_players:
+            self.queue_players_dict[qp.role].append(qp)
+            self.queue_players_index[qp.player_id, qp.role] = qp
+
+            # Using this inequality to make sure we only have each duo once
+            if qp.duo is not None and qp.duo_id > qp.player_id:
+                self.duos.append((qp, qp.duo))
+
+    @classmethod
+    def server_queues(cls, server_id: int, channel_ids: List[int]) -> Dict[int, "GameQueue"]:
+        """
+        Returns the queue of each channel of the server, loading the players of all of them at once
+        """
+        queue_players = queue_store.queue_players(server_id=server_id)
+
+        return {
+            channel_id: cls(
+                channel_id, server_id, [qp for qp in queue_players if qp.channel_id == channel_id]
+            )
+            for channel_id in channel_ids
+        }
+
+    @property
+    def queue_id(self) -> int:
+        """
+        Identifies the queue in matchmaking searches, which is the server id for a server-wide pool
+
+        Channel and server ids are both Discord snowflakes, so they never collide
+        """
+        return self.channel_id if self.channel_id is not None else self.server_id
 
     def __len__(self):
         return len(self.queue_players)
@@ -133,9 +156,7 @@ class GameQueue:
         rows = []
 
         for role in roles_list:
-            rows.append(
-                f"{role}\t" + " ".join(qp.player.name for qp in self.queue_players if qp.role == role)
-            )
+            rows.append(f"{role}\t" + " ".join(qp.player.name for qp in self.queue_players_dict[role]))
 
         duos_strings = []
         for duo in self.duos:
@@ -145,22 +166,19 @@ class GameQueue:
 
         return "\n".join(rows)
 
-    @property
-    def queue_players_dict(self) -> Dict[str, List[QueuePlayer]]:
-        """
-        This dictionary will always have all roles included
-        """
-        return {role: [player for player in self.queue_players if player.role == role] for role in roles_list}
 
-    @property
-    def duos(self) -> List[Tuple[QueuePlayer, QueuePlayer]]:
-        duos = []
+def pool_queue_players(queue_players: List[QueuePlayer]) -> List[QueuePlayer]:
+    """
+    Keeps a single row per player and role from players queuing in multiple channels
 
-        # TODO This should be an sqlalchemy hybrid property and a single list comprehension
-        for qp in self.queue_players:
-            if (qp.duo is not None) and (
-                qp.duo_id > qp.player_id
-            ):  # Using this inequality to make sure we only have each duo once
-                duos.append((qp, qp.duo))
+    The oldest row is kept, unless a younger one has a duo, in which case we keep it to respect the duo
+    """
+    pool = {}
+
+    for qp in queue_players:
+        key = qp.player_id, qp.role
+
+        if key not in pool or (pool[key].duo_id is None and qp.duo_id is not None):
+            pool[key] = qp
 
-        return duos
+    return [qp for qp in queue_players if pool[qp.player_id, qp.role] is qp]
@@ -0,0 +1,175 @@
+import logging
+import threading
+from typing import Dict, Optional, Set
+
+from sqlalchemy import and_, event, exists
+from sqlalchemy.orm import Session, aliased
+
+from inhouse_bot.database_orm import session_scope, run_in_session, Game, GameParticipant, Player
+
+player_cache_logger = logging.getLogger("player_cache")
+
+
+class PlayerCache:
+    """
+    Names of each server’s players, and which of them are in an unscored game, so queuing does not query the database
+
+    Names are loaded with a single query per server and updated when players are saved. Players in game are loaded
+    with a single query per server too, and reloaded after any game of the server is created, scored or deleted
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+        # server_id -> player_id -> name
+        self._names: Dict[int, Dict[int, Optional[str]]] = {}
+
+        # server_id -> ids of players whose last game on the server has not been scored
+        self._players_in_game: Dict[int, Set[int]] = {}
+
+        # Bumped when the server’s games change, so a load that started before the change is not kept
+        self._games_generation: Dict[int, int] = {}
+
+    def names(self, server_id: int) -> Dict[int, Optional[str]]:
+        """
+        Returns the player_id -> name dictionary of the server, loading it if needed
+        """
+        if server_id not in self._names:
+            with session_scope() as session:
+                self._set_names(server_id, query_player_names(session, server_id))
+
+        return self._names[server_id]
+
+    def _set_names(self, server_id: int, names: Dict[int, Optional[str]]):
+        player_cache_logger.info(f"Loaded {len(names)} player names of server {server_id}")
+
+        self._names.setdefault(server_id, names)
+
+    def name(self, server_id: int, player_id: int) -> str:
+        return self.names(server_id).get(player_id) or str(player_id)
+
+    def changed_names(self, server_id: int, names: Dict[int, Optional[str]]) -> Dict[int, Optional[str]]:
+        """
+        Returns the players that are not saved yet or whose name changed, which are the only ones we need to write
+        """
+        server_names = self.names(server_id)
+
+        return {
+            player_id: name
+            for player_id, name in names.items()
+            if player_id not in server_names or server_names[player_id] != name
+        }
+
+    def update_names(self, server_id: int, names: Dict[int, Optional[str]]):
+        """
+        Writes saved names through, which needs to happen once they are committed to the database
+        """
+        if server_id in self._names:
+            self._names[server_id].update(names)
+
+    def players_in_game(self, server_id: int) -> Set[int]:
+        """
+        Returns the ids of the players whose last game on the server has not been scored yet
+        """
+        players_in_game = self._players_in_game.get(server_id)
+
+        if players_in_game is None:
+            generation = self._games_generation.get(server_id, 0)
+
+            with session_scope() as session:
+                players_in_game = query_players_in_game(session, server_id)
+
+            self._set_players_in_game(server_id, players_in_game, generation)
+
+        return players_in_game
+
+    async def preload(self, server_id: int):
+        """
+        Loads what is missing about the server through the async engine, so coroutines then only read memory
+        """
+        if server_id not in self._names:
+            self._set_names(server_id, await run_in_session(query_player_names, server_id))
+
+        if server_id not in self._players_in_game:
+            generation = self._games_generation.get(server_id, 0)
+
+            self._set_players_in_game(
+                server_id, await run_in_session(query_players_in_game, server_id), generation
+            )
+
+    def _set_players_in_game(self, server_id: int, players_in_game: Set[int], generation: int):
+        with self._lock:
+            if self._games_generation.get(server_id, 0) == generation:
+                self._players_in_game[server_id] = players_in_game
+
+    def invalidate_games(self, server_id: int):
+        """
+        Drops the players in game of the server, which is done automatically when its games change
+        """
+        with self._lock:
+            self._games_generation[server_id] = self._games_generation.get(server_id, 0) + 1
+            self._players_in_game.pop(server_id, None)
+
+    def invalidate(self, server_id: Optional[int] = None):
+        """
+        Drops everything cached about the server, or about every server if server_id is None
+        """
+        with self._lock:
+            servers = {*self._names, *self._players_in_game} if server_id is None else {server_id}
+
+            for server in servers:
+                self._games_generation[server] = self._games_generation.get(server, 0) + 1
+                self._names.pop(server, None)
+                self._players_in_game.pop(server, None)
+
+
+def query_player_names(session, server_id: int) -> Dict[int, Optional[str]]:
+    return dict(session.query(Player.id, Player.name).filter(Player.server_id == server_id))
+
+
+def query_players_in_game(session, server_id: int) -> Set[int]:
+    later_game = aliased(Game)
+    later_participant = aliased(GameParticipant)
+
+    # Unscored games are few, and only matter if the player did not play another game afterwards
+    return {
+        player_id
+        for player_id, in session.query(GameParticipant.player_id)
+        .join(Game)
+        .filter(Game.server_id == server_id)
+        .filter(Game.winner.is_(None))
+        .filter(
+            ~exists().where(
+                and_(
+                    later_participant.player_id == GameParticipant.player_id,
+                    later_participant.game_id == later_game.id,
+                    later_game.server_id == server_id,
+                    later_game.start > Game.start,
+                )
+            )
+        )
+    }
+
+
+player_cache = PlayerCache()
+
+
+# Games are created, scored and deleted from many places, so we follow them through the session instead
+@event.listens_for(Session, "after_flush")
+def _record_changed_games(session, flush_context):
+    changed_servers = session.info.setdefault("changed_game_servers", set())
+
+    for instance in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(instance, Game):
+            changed_servers.add(instance.server_id)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_changed_games(session):
+    for server_id in session.info.pop("changed_game_servers", ()):
+        player_cache.invalidate_games(server_id)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_changed_games(session):
+    session.info.pop("changed_game_servers", None)
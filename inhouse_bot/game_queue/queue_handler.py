@@ -1,13 +1,15 @@
 from datetime import datetime, timedelta
-from typing import List, Optional, Set
+from typing import Collection, Dict, List, Optional, Set
 
-import sqlalchemy
 from discord.ext import commands
+from sqlalchemy.dialects.postgresql import insert
 
 from inhouse_bot.common_utils.fields import roles_list
 
-from inhouse_bot.database_orm import session_scope, QueuePlayer, Player
-from inhouse_bot.common_utils.get_last_game import get_last_game
+from inhouse_bot.database_orm import session_scope, run_in_session, Player
+from inhouse_bot.game_queue.player_cache import player_cache
+from inhouse_bot.game_queue.queue_store import queue_store, QueueRow, insert_default_ratings
+from inhouse_bot.game_queue.rating_cache import rating_cache, default_rating
 
 
 class PlayerInReadyCheck(Exception):
@@ -18,16 +20,9 @@ class SameRolesForDuo(commands.CheckFailure):
     ...
 
 
-def is_in_ready_check(player_id, session) -> bool:
-    return (
-        True
-        if (
-            session.query(QueuePlayer)
-            .filter(QueuePlayer.player_id == player_id)
-            .filter(QueuePlayer.ready_check_id != None)
-        ).first()  # Can’t use one or none here as a player could have been queuing for multiple roles
-        else False
-    )
+def is_in_ready_check(player_id) -> bool:
+    # A player could have been queuing for multiple roles, and any of those rows can be in the ready check
+    return any(row.ready_check_id is not None for row in queue_store.rows(player_id=player_id))
 
 
 def reset_queue(channel_id: Optional[int] = None):
@@ -38,13 +33,108 @@ def reset_queue(channel_id: Optional[int] = None):
     Args:
         channel_id: channel id of the queue to cancel
     """
+    for row in queue_store.rows(channel_id=channel_id):
+        queue_store.discard(row)
+
+
+def check_can_queue(player_ids: Collection[int], server_id: int):
+    """
+    Raises PlayerInGame or PlayerInReadyCheck if any of the players cannot queue
+
+    Both statuses are kept in memory, so this is a lookup per player
+    """
+    players_in_game = player_cache.players_in_game(server_id)
+
+    if any(player_id in players_in_game for player_id in player_ids):
+        raise PlayerInGame
+
+    # Then check if the player is in a ready-check
+    if any(is_in_ready_check(player_id) for player_id in player_ids):
+        raise PlayerInReadyCheck
+
+
+def save_players(names: Dict[int, Optional[str]], roles: Dict[int, str], server_id: int):
+    """
+    Writes new players, name changes, and default ratings of roles players never queued for
+
+    Nothing is written for known players queuing for a known role under the same name, which is the usual case
+    """
+    changed_names, new_ratings = _player_changes(names, roles, server_id)
+
+    if not changed_names and not new_ratings:
+        return
+
     with session_scope() as session:
-        query = session.query(QueuePlayer)
+        _write_players(session, server_id, changed_names, new_ratings)
+
+    _cache_players(server_id, changed_names, new_ratings)
+
+
+async def save_players_async(names: Dict[int, Optional[str]], roles: Dict[int, str], server_id: int):
+    """
+    Same as save_players, through the async engine
+    """
+    changed_names, new_ratings = _player_changes(names, roles, server_id)
+
+    if not changed_names and not new_ratings:
+        return
+
+    await run_in_session(_write_players, server_id, changed_names, new_ratings)
+
+    _cache_players(server_id, changed_names, new_ratings)
+
+
+def _player_changes(names: Dict[int, Optional[str]], roles: Dict[int, str], server_id: int):
+    changed_names = player_cache.changed_names(server_id, names)
+
+    # Players queuing for a role for the first time get a default rating, which games need to reference
+    new_ratings = {
+        (player_id, role): default_rating()
+        for player_id, role in roles.items()
+        if rating_cache.get(server_id, player_id, role) is None
+    }
+
+    return changed_names, new_ratings
+
 
-        if channel_id is not None:
-            query = query.filter(QueuePlayer.channel_id == channel_id)
+def _write_players(session, server_id: int, changed_names: Dict[int, Optional[str]], new_ratings: Dict):
+    # This is where we add new Players to the server
+    #   This is also useful to automatically update name changes
+    if changed_names:
+        statement = insert(Player.__table__).values(
+            [
+                {"id": player_id, "server_id": server_id, "name": name}
+                for player_id, name in changed_names.items()
+            ]
+        )
+        session.execute(
+            statement.on_conflict_do_update(
+                index_elements=["id", "server_id"], set_={"name": statement.excluded.name}
+            )
+        )
+
+    if new_ratings:
+        insert_default_ratings(session, {(player_id, server_id, role) for player_id, role in new_ratings})
+
+
+def _cache_players(server_id: int, changed_names: Dict[int, Optional[str]], new_ratings: Dict):
+    player_cache.update_names(server_id, changed_names)
+    rating_cache.fill(server_id, new_ratings)
+
+
+async def preload_server(server_id: int):
+    """
+    Loads everything queuing needs to know about the server through the async engine
+
+    Queue checks and matchmaking then only read memory, so coroutines can call them without blocking the event loop
+    """
+    # Local import to not have circular imports, as matchmaking_logic needs the game queue
+    from inhouse_bot.matchmaking_logic.rating_engines import preload_rating_engine
 
-        query.delete(synchronize_session=False)
+    await queue_store.preload()
+    await player_cache.preload(server_id)
+    await rating_cache.preload(server_id)
+    await preload_rating_engine(server_id)
 
 
 def add_player(
@@ -53,32 +143,54 @@ def add_player(
     # Just in case
     assert role in roles_list
 
-    with session_scope() as session:
+    check_can_queue([player_id], server_id)
+    save_players({player_id: name}, {player_id: role}, server_id)
+
+    _queue_player(player_id, role, channel_id, server_id, jump_ahead)
+
+
+async def add_player_async(
+    player_id: int, role: str, channel_id: int, server_id: int = None, name: str = None, jump_ahead=False
+):
+    """
+    Same as add_player, awaiting the database instead of blocking on it
+    """
+    assert role in roles_list
+
+    await preload_server(server_id)
 
-        game, participant = get_last_game(player_id, server_id, session)
+    check_can_queue([player_id], server_id)
+    await save_players_async({player_id: name}, {player_id: role}, server_id)
 
-        if game and not game.winner:
-            raise PlayerInGame
+    _queue_player(player_id, role, channel_id, server_id, jump_ahead)
 
-        # Then check if the player is in a ready-check
-        if is_in_ready_check(player_id, session):
-            raise PlayerInReadyCheck
 
-        # This is where we add new Players to the server
-        #   This is also useful to automatically update name changes
-        session.merge(Player(id=player_id, server_id=server_id, name=name))
+def _queue_player(player_id: int, role: str, channel_id: int, server_id: int, jump_ahead: bool):
+    # Finally, we actually add the player to the queue
+    #   Re-queuing for the same role keeps the duo, like merging the row did
+    queue_row = queue_store.get(channel_id, player_id, role)
 
-        # Finally, we actually add the player to the queue
-        queue_player = QueuePlayer(
+    queue_store.put(
+        QueueRow(
             channel_id=channel_id,
             player_id=player_id,
             player_server_id=server_id,
             role=role,
             queue_time=datetime.now() if not jump_ahead else datetime.now() - timedelta(hours=24),
+            duo_id=queue_row.duo_id if queue_row else None,
         )
+    )
 
-        # We merge for simplicity (allows players to re-queue for the same role)
-        session.merge(queue_player)
+
+def clear_duos(
+    player_ids: Collection[int], channel_id: Optional[int] = None, server_id: Optional[int] = None
+):
+    """
+    Removes the duo status of other players with the given players, in the channel or the server if given
+    """
+    for row in queue_store.rows(channel_id=channel_id):
+        if row.duo_id in player_ids and server_id in (None, row.player_server_id):
+            queue_store.put(row._replace(duo_id=None))
 
 
 def remove_player(player_id: int, channel_id: int = None):
@@ -87,69 +199,60 @@ def remove_player(player_id: int, channel_id: int = None):
 
     If no channel id is given, drop him from *all* queues, cross-server
     """
-    with session_scope() as session:
-        # First, check if he’s in a ready-check.
-        if (
-            is_in_ready_check(player_id, session) and channel_id
-        ):  # If we have no channel ID, it’s an !admin reset and we bypass the issue here
-            raise PlayerInReadyCheck
-
-        # We select the player’s rows
-        query_player = session.query(QueuePlayer).filter(QueuePlayer.player_id == player_id)
-        query_duos = session.query(QueuePlayer).filter(QueuePlayer.duo_id == player_id)
+    # First, check if he’s in a ready-check.
+    if (
+        is_in_ready_check(player_id) and channel_id
+    ):  # If we have no channel ID, it’s an !admin reset and we bypass the issue here
+        raise PlayerInReadyCheck
 
-        # If given a channel ID (when the user calls !leave), we filter
-        if channel_id:
-            query_player = query_player.filter(QueuePlayer.channel_id == channel_id)
-            query_duos = query_duos.filter(QueuePlayer.channel_id == channel_id)
+    # If given a channel ID (when the user calls !leave), we filter
+    for row in queue_store.rows(player_id=player_id):
+        if not channel_id or row.channel_id == channel_id:
+            queue_store.discard(row)
 
-        query_player.delete(synchronize_session=False)
-        query_duos.update({"duo_id": None}, synchronize_session=False)
+    clear_duos({player_id}, channel_id=channel_id or None)
 
 
 def remove_players(player_ids: Set[int], channel_id: int):
     """
     Removes all players from the queue in all roles in the channel, without any checks
     """
-    with session_scope() as session:
-        (
-            session.query(QueuePlayer)
-            .filter(QueuePlayer.channel_id == channel_id)
-            .filter(QueuePlayer.player_id.in_(player_ids))
-            .delete(synchronize_session=False)
-        )
+    for row in queue_store.rows(channel_id=channel_id):
+        if row.player_id in player_ids:
+            queue_store.discard(row)
+
 
+def start_ready_check(
+    player_ids: List[int],
+    channel_id: Optional[int],
+    ready_check_message_id: int,
+    server_id: Optional[int] = None,
+):
+    """
+    Marks the players as in a ready check in the channel
 
-def start_ready_check(player_ids: List[int], channel_id: int, ready_check_message_id: int):
+    If channel_id is None, players are marked in all queue channels of the server, for games of a server-wide pool
+    """
     # Checking to make sure everything is fine
     assert len(player_ids) == 10
 
-    with session_scope() as session:
-
-        (
-            session.query(QueuePlayer)
-            .filter(QueuePlayer.channel_id == channel_id)
-            .filter(QueuePlayer.player_id.in_(player_ids))
-            .update({"ready_check_id": ready_check_message_id}, synchronize_session=False)
-        )
+    for player_id in player_ids:
+        for row in queue_store.rows(player_id=player_id):
+            if (channel_id is not None and row.channel_id == channel_id) or (
+                channel_id is None and row.player_server_id == server_id
+            ):
+                queue_store.put(row._replace(ready_check_id=ready_check_message_id))
 
 
 def validate_ready_check(ready_check_id: int):
     """
     When a ready check is validated, we drop all players from all queues
     """
+    player_ids = {row.player_id for row in queue_store.rows(ready_check_id=ready_check_id)}
 
-    with session_scope() as session:
-        player_ids = [
-            r.player_id
-            for r in session.query(QueuePlayer.player_id).filter(QueuePlayer.ready_check_id == ready_check_id)
-        ]
-
-        (
-            session.query(QueuePlayer)
-            .filter(QueuePlayer.player_id.in_(player_ids))
-            .delete(synchronize_session=False)
-        )
+    for player_id in player_ids:
+        for row in queue_store.rows(player_id=player_id):
+            queue_store.discard(row)
 
 
 def cancel_ready_check(
@@ -162,56 +265,46 @@ def cancel_ready_check(
 
     If server_id is not None, drops the player from all queues in the server
     """
-    with session_scope() as session:
-        # First, we cancel the ready check for *all* players, even the ones we don’t drop
-        (
-            session.query(QueuePlayer)
-            .filter(QueuePlayer.ready_check_id == ready_check_id)
-            .update({"ready_check_id": None}, synchronize_session=False)
-        )
+    # First, we cancel the ready check for *all* players, even the ones we don’t drop
+    for row in queue_store.rows(ready_check_id=ready_check_id):
+        queue_store.put(row._replace(ready_check_id=None))
 
-        if ids_to_drop:
-            # TODO This should be shared with remove_player and not duplicated
-            players_query = session.query(QueuePlayer).filter(QueuePlayer.player_id.in_(ids_to_drop))
-            duos_query = session.query(QueuePlayer).filter(QueuePlayer.duo_id.in_(ids_to_drop))
+    if ids_to_drop:
+        if server_id and channel_id:
+            raise Exception("channel_id and server_id should not be used together here")
 
-            if server_id and channel_id:
-                raise Exception("channel_id and server_id should not be used together here")
+        # TODO This should be shared with remove_player and not duplicated
+        for player_id in ids_to_drop:
+            for row in queue_store.rows(player_id=player_id):
+                # This removes the player from *all* queues in the server (timeout)
+                if server_id and row.player_server_id != server_id:
+                    continue
 
-            # This removes the player from *all* queues in the server (timeout)
-            if server_id:
-                players_query = players_query.filter(QueuePlayer.player_server_id == server_id)
-                duos_query = duos_query.filter(QueuePlayer.player_server_id == server_id)
+                # This removes the player only from the given channel (cancellation)
+                if channel_id and row.channel_id != channel_id:
+                    continue
 
-            # This removes the player only from the given channel (cancellation)
-            if channel_id:
-                players_query = players_query.filter(QueuePlayer.channel_id == channel_id)
-                duos_query = duos_query.filter(QueuePlayer.channel_id == channel_id)
+                queue_store.discard(row)
 
-            # Drop the player and remove his duo status with other players
-            players_query.delete(synchronize_session=False)
-            duos_query.update({"duo_id": None}, synchronize_session=False)
+        # Drop the player and remove his duo status with other players
+        clear_duos(set(ids_to_drop), channel_id=channel_id or None, server_id=server_id or None)
 
 
 def cancel_all_ready_checks():
     """
     Cancels all ready checks, used when restarting the bot
     """
-    with session_scope() as session:
-        # We put all ready_check_id to None
-        session.query(QueuePlayer).update({"ready_check_id": None}, synchronize_session=False)
+    # We put all ready_check_id to None
+    for row in queue_store.rows():
+        if row.ready_check_id is not None:
+            queue_store.put(row._replace(ready_check_id=None))
 
 
 def get_active_queues() -> List[int]:
     """
     Returns a list of channel IDs where there is a queue ongoing
     """
-    with session_scope() as session:
-        output = [
-            r.channel_id for r in session.query(QueuePlayer.channel_id).group_by(QueuePlayer.channel_id)
-        ]
-
-    return output
+    return queue_store.channel_ids()
 
 
 class PlayerInGame(Exception):
@@ -229,56 +322,110 @@ def add_duo(
     second_player_name: str = None,
     jump_ahead=False,
 ):
-    # Marks this group of players and roles as a duo
+    """
+    Marks this group of players and roles as a duo
+
+    Both players are checked and saved in a single transaction, and their queue rows are replaced at once, so the
+    duo is never half-applied
+    """
+    names, roles = _duo_players(
+        first_player_id,
+        first_player_role,
+        second_player_id,
+        second_player_role,
+        first_player_name,
+        second_player_name,
+    )
+
+    check_can_queue(list(names), server_id)
+    save_players(names, roles, server_id)
+
+    _queue_duo(roles, channel_id, server_id, jump_ahead)
+
+
+async def add_duo_async(
+    first_player_id: int,
+    first_player_role: str,
+    second_player_id: int,
+    second_player_role: str,
+    channel_id: int,
+    server_id: int = None,
+    first_player_name: str = None,
+    second_player_name: str = None,
+    jump_ahead=False,
+):
+    """
+    Same as add_duo, awaiting the database instead of blocking on it
+    """
+    names, roles = _duo_players(
+        first_player_id,
+        first_player_role,
+        second_player_id,
+        second_player_role,
+        first_player_name,
+        second_player_name,
+    )
+
+    await preload_server(server_id)
+
+    check_can_queue(list(names), server_id)
+    await save_players_async(names, roles, server_id)
+
+    _queue_duo(roles, channel_id, server_id, jump_ahead)
 
+
+def _duo_players(
+    first_player_id: int,
+    first_player_role: str,
+    second_player_id: int,
+    second_player_role: str,
+    first_player_name: Optional[str],
+    second_player_name: Optional[str],
+):
     if first_player_role == second_player_role:
         raise SameRolesForDuo
 
-    # Just in case, we drop the players from the queue first
-    remove_player(first_player_id, channel_id)
-    remove_player(second_player_id, channel_id)
-
-    add_player(
-        player_id=first_player_id,
-        role=first_player_role,
-        channel_id=channel_id,
-        server_id=server_id,
-        name=first_player_name,
-        jump_ahead=jump_ahead,
-    )
+    assert first_player_role in roles_list and second_player_role in roles_list
 
-    add_player(
-        player_id=second_player_id,
-        role=second_player_role,
-        channel_id=channel_id,
-        server_id=server_id,
-        name=second_player_name,
-        jump_ahead=jump_ahead,
-    )
+    names = {first_player_id: first_player_name, second_player_id: second_player_name}
+    roles = {first_player_id: first_player_role, second_player_id: second_player_role}
 
-    with session_scope() as session:
-        # Finally, we add the duos by merging only the newer data (empty fields shouldn’t get merged)
-        first_queue_player = QueuePlayer(
-            player_id=first_player_id, role=first_player_role, channel_id=channel_id, duo_id=second_player_id
-        )
+    return names, roles
 
-        second_queue_player = QueuePlayer(
-            player_id=second_player_id, role=second_player_role, channel_id=channel_id, duo_id=first_player_id
-        )
 
-        # We merge the new information
-        session.merge(first_queue_player)
-        session.merge(second_queue_player)
+def _queue_duo(roles: Dict[int, str], channel_id: int, server_id: int, jump_ahead: bool):
+    first_player_id, second_player_id = roles
+    duo_ids = {first_player_id: second_player_id, second_player_id: first_player_id}
+
+    queue_time = datetime.now() if not jump_ahead else datetime.now() - timedelta(hours=24)
+
+    with queue_store.transaction():
+        # Just in case, we drop the players from the queue first
+        for player_id in roles:
+            for row in queue_store.rows(player_id=player_id):
+                if row.channel_id == channel_id:
+                    queue_store.discard(row)
+
+        clear_duos(set(roles), channel_id=channel_id)
+
+        # Rows are added with their duo, so they are written with a single upsert
+        for player_id in roles:
+            queue_store.put(
+                QueueRow(
+                    channel_id=channel_id,
+                    player_id=player_id,
+                    player_server_id=server_id,
+                    role=roles[player_id],
+                    queue_time=queue_time,
+                    duo_id=duo_ids[player_id],
+                ),
+            )
 
 
 def remove_duo(player_id: int, channel_id: int):
     # Removes duos for all roles for this player in this channel
     # This could be called during a ready-check but it shouldn’t be too much of an issue
 
-    with session_scope() as session:
-        (
-            session.query(QueuePlayer)
-            .filter(QueuePlayer.channel_id == channel_id)
-            .filter(sqlalchemy.or_(QueuePlayer.duo_id == player_id, QueuePlayer.player_id == player_id))
-            .update({"duo_id": None}, synchronize_session=False)
-        )
+    for row in queue_store.rows(channel_id=channel_id):
+        if player_id in (row.player_id, row.duo_id):
+            queue_store.put(row._replace(duo_id=None))
@@ -0,0 +1,511 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
+
+from sqlalchemy import and_, tuple_
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import InterfaceError, OperationalError
+
+from inhouse_bot.common_utils.constants import QUEUE_WRITE_DELAY
+from inhouse_bot.database_orm import session_scope, run_in_session, QueuePlayer, Player, PlayerRating
+from inhouse_bot.game_queue.player_cache import player_cache
+from inhouse_bot.game_queue.rating_cache import default_rating
+
+queue_store_logger = logging.getLogger("queue_store")
+
+# Seconds the writer waits before trying again when the database could not be reached
+RETRY_DELAY = 5
+
+# Flushes a change can fail in by itself before it is dropped, so it does not block the writer forever
+MAX_WRITE_ATTEMPTS = 3
+
+# (channel_id, player_id, role), the primary key of the queue_player table
+QueueKey = Tuple[int, int, str]
+
+
+class QueueRow(NamedTuple):
+    """
+    Immutable copy of a queue_player row, replaced as a whole when it changes
+    """
+
+    channel_id: int
+    player_id: int
+    player_server_id: int
+    role: str
+    queue_time: datetime
+    duo_id: Optional[int] = None
+    ready_check_id: Optional[int] = None
+
+    @property
+    def key(self) -> QueueKey:
+        return self.channel_id, self.player_id, self.role
+
+
+class QueueStore:
+    """
+    Queue state of every channel, held in memory and used for all queue reads
+
+    Rows are indexed by channel, player, ready check and server, so queue commands never wait for the database.
+    Changes are written to the queue_player table in batches by a background thread, and the table is only read
+    once, when the store is first used after a restart
+    """
+
+    def __init__(self, write_delay: float = QUEUE_WRITE_DELAY):
+        self.write_delay = write_delay
+
+        # Held for every read and write of the rows and indexes, as the writer thread reads them too
+        self._lock = threading.RLock()
+
+        # Makes sure only one flush writes to the database at a time
+        self._flush_lock = threading.Lock()
+
+        self._loaded = False
+
+        self._rows: Dict[QueueKey, QueueRow] = {}
+        self._rows_by_channel: Dict[int, Dict[QueueKey, QueueRow]] = {}
+        self._rows_by_player: Dict[int, Dict[QueueKey, QueueRow]] = {}
+        self._rows_by_ready_check: Dict[int, Dict[QueueKey, QueueRow]] = {}
+        self._rows_by_server: Dict[int, Dict[QueueKey, QueueRow]] = {}
+
+        # server_id -> player_id -> number of the player’s rows in a ready check
+        self._ready_check_players: Dict[int, Dict[int, int]] = {}
+
+        # Keys changed since the last flush, written as an upsert if the row still exists and a delete otherwise
+        self._dirty: Set[QueueKey] = set()
+
+        # Key -> number of flushes its change failed in when written alone
+        self._write_failures: Dict[QueueKey, int] = {}
+
+        self._changed = threading.Event()
+        self._writer: Optional[threading.Thread] = None
+
+    def load(self):
+        """
+        Rebuilds the store from the queue_player table, which is done automatically on first use
+        """
+        with session_scope() as session:
+            self._set_rows(query_queue_rows(session))
+
+    async def preload(self):
+        """
+        Loads the store through the async engine if it was not loaded yet, so coroutines then only read memory
+        """
+        if not self._loaded:
+            queue_rows = await run_in_session(query_queue_rows)
+
+            with self._lock:
+                if not self._loaded:
+                    self._set_rows(queue_rows)
+
+    def _set_rows(self, queue_rows: List[QueueRow]):
+        with self._lock:
+            self._rows.clear()
+            self._rows_by_channel.clear()
+            self._rows_by_player.clear()
+            self._rows_by_ready_check.clear()
+            self._rows_by_server.clear()
+            self._ready_check_players.clear()
+            self._dirty.clear()
+
+            for row in queue_rows:
+                self._index(row)
+
+            self._loaded = True
+
+        queue_store_logger.info(f"Loaded {len(queue_rows)} queue rows")
+
+    def _ensure_loaded(self):
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    self.load()
+
+    def _index(self, row: QueueRow):
+        self._rows[row.key] = row
+        self._rows_by_channel.setdefault(row.channel_id, {})[row.key] = row
+        self._rows_by_player.setdefault(row.player_id, {})[row.key] = row
+        self._rows_by_server.setdefault(row.player_server_id, {})[row.key] = row
+
+        if row.ready_check_id is not None:
+            self._rows_by_ready_check.setdefault(row.ready_check_id, {})[row.key] = row
+
+            server_players = self._ready_check_players.setdefault(row.player_server_id, {})
+            server_players[row.player_id] = server_players.get(row.player_id, 0) + 1
+
+    def _unindex(self, row: QueueRow):
+        del self._rows[row.key]
+
+        for index, index_key in (
+            (self._rows_by_channel, row.channel_id),
+            (self._rows_by_player, row.player_id),
+            (self._rows_by_ready_check, row.ready_check_id),
+            (self._rows_by_server, row.player_server_id),
+        ):
+            if index_key in index:
+                index[index_key].pop(row.key, None)
+
+                # Empty entries are dropped so channels without players are not considered active
+                if not index[index_key]:
+                    del index[index_key]
+
+        if row.ready_check_id is not None:
+            server_players = self._ready_check_players[row.player_server_id]
+            server_players[row.player_id] -= 1
+
+            if not server_players[row.player_id]:
+                del server_players[row.player_id]
+
+                if not server_players:
+                    del self._ready_check_players[row.player_server_id]
+
+    @contextmanager
+    def transaction(self):
+        """
+        Changes made in the block are never seen half-applied, by readers or by the writer thread
+
+        They are all written in the same batch
+        """
+        self._ensure_loaded()
+
+        with self._lock:
+            yield
+
+    def rows(
+        self,
+        channel_id: Optional[int] = None,
+        player_id: Optional[int] = None,
+        ready_check_id: Optional[int] = None,
+    ) -> List[QueueRow]:
+        """
+        Returns the rows of the channel, the player or the ready check, or all rows if nothing is given
+        """
+        self._ensure_loaded()
+
+        with self._lock:
+            if channel_id is not None:
+                return list(self._rows_by_channel.get(channel_id, {}).values())
+            if player_id is not None:
+                return list(self._rows_by_player.get(player_id, {}).values())
+            if ready_check_id is not None:
+                return list(self._rows_by_ready_check.get(ready_check_id, {}).values())
+
+            return list(self._rows.values())
+
+    def get(self, channel_id: int, player_id: int, role: str) -> Optional[QueueRow]:
+        self._ensure_loaded()
+
+        with self._lock:
+            return self._rows.get((channel_id, player_id, role))
+
+    def channel_ids(self) -> List[int]:
+        """
+        Returns the ids of the channels with at least one player in queue
+        """
+        self._ensure_loaded()
+
+        with self._lock:
+            return list(self._rows_by_channel)
+
+    def put(self, row: QueueRow):
+        """
+        Adds the row, or replaces the row with the same key
+        """
+        self._ensure_loaded()
+
+        with self._lock:
+            if row.key in self._rows:
+                self._unindex(self._rows[row.key])
+
+            self._index(row)
+            self._mark_dirty(row.key)
+
+    def discard(self, row: QueueRow):
+        """
+        Removes the row if it is still in the store
+        """
+        self._ensure_loaded()
+
+        with self._lock:
+            if row.key in self._rows:
+                self._unindex(self._rows[row.key])
+                self._mark_dirty(row.key)
+
+    def queue_players(
+        self, channel_id: Optional[int] = None, server_id: Optional[int] = None
+    ) -> List[QueuePlayer]:
+        """
+        Returns the players in queue in the channel, or in all channels of the server, ordered by queue time
+
+        Players currently in a ready check in any channel of the server are left out
+        QueuePlayer objects are created for each call and never added to a session, so they can be used freely
+        """
+        self._ensure_loaded()
+
+        with self._lock:
+            if channel_id is not None:
+                rows = self._rows_by_channel.get(channel_id, {}).values()
+            else:
+                rows = self._rows_by_server.get(server_id, {}).values()
+
+            rows = sorted(
+                (
+                    row
+                    for row in rows
+                    if row.player_id not in self._ready_check_players.get(row.player_server_id, {})
+                ),
+                key=lambda row: row.queue_time,
+            )
+
+        # Names are loaded outside of the lock, as the first call for a server reads them from the database
+        players = {
+            (row.player_id, row.player_server_id): Player(
+                id=row.player_id,
+                server_id=row.player_server_id,
+                name=player_cache.name(row.player_server_id, row.player_id),
+            )
+            for row in rows
+        }
+
+        queue_players = {}
+        for row in rows:
+            queue_player = QueuePlayer(
+                channel_id=row.channel_id,
+                player_id=row.player_id,
+                player_server_id=row.player_server_id,
+                role=row.role,
+                queue_time=row.queue_time,
+                duo_id=row.duo_id,
+                ready_check_id=row.ready_check_id,
+            )
+            queue_player.player = players[row.player_id, row.player_server_id]
+            queue_players[row.key] = queue_player
+
+        # Duos are always in the same channel, and we link them like the duo relationship does
+        duo_rows = {
+            (qp.channel_id, qp.player_id, qp.duo_id): qp
+            for qp in queue_players.values()
+            if qp.duo_id is not None
+        }
+
+        for queue_player in queue_players.values():
+            if queue_player.duo_id is not None:
+                queue_player.duo = duo_rows.get(
+                    (queue_player.channel_id, queue_player.duo_id, queue_player.player_id)
+                )
+
+        return list(queue_players.values())
+
+    def _mark_dirty(self, key: QueueKey):
+        self._dirty.add(key)
+
+        if not self._writer or not self._writer.is_alive():
+            self._writer = threading.Thread(target=self._write_loop, name="queue_store_writer", daemon=True)
+            self._writer.start()
+
+        self._changed.set()
+
+    def _write_loop(self):
+        while True:
+            self._changed.wait()
+
+            # Changes made during the delay are written in the same batch
+            time.sleep(self.write_delay)
+            self._changed.clear()
+
+            if not self.flush():
+                time.sleep(RETRY_DELAY)
+                self._changed.set()
+
+    def flush(self) -> bool:
+        """
+        Writes all pending changes to the database in a single transaction, returning False if some were not written
+
+        If the batch fails without the database being unreachable, changes are written one by one so a single bad row
+        does not hold back the others. Changes that keep failing by themselves are dropped after MAX_WRITE_ATTEMPTS
+
+        Called by the writer thread, and directly when the bot stops so no change is lost
+        """
+        with self._flush_lock:
+            with self._lock:
+                keys, self._dirty = self._dirty, set()
+
+                # None means the row has to be deleted
+                changes = {key: self._rows[key]._asdict() if key in self._rows else None for key in keys}
+
+            if not changes:
+                return True
+
+            try:
+                write_queue_changes(changes)
+
+            except Exception as error:
+                if is_connection_error(error):
+                    queue_store_logger.exception(f"Could not write {len(keys)} queue changes, retrying later")
+                    self._retry_later(keys)
+                    return False
+
+                queue_store_logger.exception(
+                    f"Could not write {len(keys)} queue changes, writing them one by one"
+                )
+
+                return self._flush_one_by_one(changes)
+
+            with self._lock:
+                for key in keys:
+                    self._write_failures.pop(key, None)
+
+            queue_store_logger.debug(f"Wrote {len(changes)} queue changes")
+
+            return True
+
+    def _flush_one_by_one(self, changes: Dict[QueueKey, Optional[dict]]) -> bool:
+        failed_keys = set()
+        items = list(changes.items())
+
+        for index, (key, row) in enumerate(items):
+            try:
+                write_queue_changes({key: row})
+
+            except Exception as error:
+                # Changes that were not tried yet are not counted as failed
+                if is_connection_error(error):
+                    queue_store_logger.exception(
+                        "Lost the database while writing queue changes, retrying later"
+                    )
+                    self._retry_later(failed_keys | {key for key, row in items[index:]})
+                    return False
+
+                failed_keys.add(key)
+
+                with self._lock:
+                    self._write_failures[key] = self._write_failures.get(key, 0) + 1
+
+                    if self._write_failures[key] >= MAX_WRITE_ATTEMPTS:
+                        del self._write_failures[key]
+                        failed_keys.discard(key)
+
+                        queue_store_logger.exception(
+                            f"Dropping the queue change of {key} after {MAX_WRITE_ATTEMPTS} failed writes: "
+                            f"{row}"
+                        )
+                        continue
+
+                queue_store_logger.warning(f"Could not write the queue change of {key}, retrying later")
+
+            else:
+                with self._lock:
+                    self._write_failures.pop(key, None)
+
+        self._retry_later(failed_keys)
+
+        return not failed_keys
+
+    def _retry_later(self, keys: Set[QueueKey]):
+        # Keys changed since then are dirty already, and will be written with their latest values anyway
+        with self._lock:
+            self._dirty |= keys
+
+
+def write_queue_changes(changes: Dict[QueueKey, Optional[dict]]):
+    """
+    Writes the changes in a single transaction, rows being upserted and keys mapped to None deleted
+    """
+    upserts = [row for row in changes.values() if row is not None]
+    deletes = [key for key, row in changes.items() if row is None]
+
+    with session_scope() as session:
+        if deletes:
+            session.execute(
+                QueuePlayer.__table__.delete().where(
+                    tuple_(QueuePlayer.channel_id, QueuePlayer.player_id, QueuePlayer.role).in_(deletes)
+                )
+            )
+
+        if upserts:
+            statement = insert(QueuePlayer.__table__).values(upserts)
+            updated_columns = ("player_server_id", "queue_time", "duo_id", "ready_check_id")
+
+            session.execute(
+                statement.on_conflict_do_update(
+                    index_elements=["channel_id", "player_id", "role"],
+                    set_={column: statement.excluded[column] for column in updated_columns},
+                )
+            )
+
+
+def is_connection_error(error: Exception) -> bool:
+    """
+    True if the error comes from the database being unreachable rather than from the data that was written
+    """
+    if isinstance(error, (OperationalError, InterfaceError)):
+        return True
+
+    # Errors raised when a connection got closed under us
+    return getattr(error, "connection_invalidated", False)
+
+
+def query_queue_rows(session) -> List[QueueRow]:
+    """
+    Returns all rows of the queue_player table, inserting the ratings they are missing
+    """
+    rows = (
+        session.query(QueuePlayer, PlayerRating.trueskill_mu)
+        .outerjoin(
+            PlayerRating,
+            and_(
+                PlayerRating.player_id == QueuePlayer.player_id,
+                PlayerRating.player_server_id == QueuePlayer.player_server_id,
+                PlayerRating.role == QueuePlayer.role,
+            ),
+        )
+        .all()
+    )
+
+    # Rows written by older versions of the bot can miss their rating, which matchmaking needs
+    missing_ratings = {(qp.player_id, qp.player_server_id, qp.role) for qp, mu in rows if mu is None}
+
+    if missing_ratings:
+        insert_default_ratings(session, missing_ratings)
+
+    return [
+        QueueRow(
+            channel_id=qp.channel_id,
+            player_id=qp.player_id,
+            player_server_id=qp.player_server_id,
+            role=qp.role,
+            queue_time=qp.queue_time,
+            duo_id=qp.duo_id,
+            ready_check_id=qp.ready_check_id,
+        )
+        for qp, mu in rows
+    ]
+
+
+def insert_default_ratings(session, ratings: Set[Tuple[int, int, str]]):
+    """
+    Inserts default ratings for the given (player_id, server_id, role) with a single statement
+    """
+    mu, sigma = default_rating()
+
+    session.execute(
+        insert(PlayerRating.__table__)
+        .values(
+            [
+                {
+                    "player_id": player_id,
+                    "player_server_id": server_id,
+                    "role": role,
+                    "trueskill_mu": mu,
+                    "trueskill_sigma": sigma,
+                }
+                for player_id, server_id, role in ratings
+            ]
+        )
+        .on_conflict_do_nothing()
+    )
+
+
+queue_store = QueueStore()
@@ -0,0 +1,125 @@
+import logging
+from typing import Dict, Optional, Tuple
+
+from inhouse_bot.database_orm import session_scope, run_in_session, PlayerRating
+
+rating_cache_logger = logging.getLogger("rating_cache")
+
+
+def default_rating() -> Tuple[float, float]:
+    """
+    (mu, sigma) of players who never played a role, which are the PlayerRating defaults
+    """
+    # Local import to not have circular imports, as matchmaking_logic needs the game queue
+    from inhouse_bot.matchmaking_logic.rating_engines import MU, SIGMA
+
+    return MU, SIGMA
+
+
+class RatingCache:
+    """
+    (player_id, role) -> (mu, sigma) of each server, so queues and matchmaking do not query ratings
+
+    A server’s ratings are loaded with a single query the first time they are needed, then kept up to date by the
+    functions writing ratings. Dictionaries are replaced or updated in a single operation, so reading from the bot’s
+    thread while a scoring thread writes is safe
+    """
+
+    def __init__(self):
+        self._servers: Dict[int, Dict[Tuple[int, str], Tuple[float, float]]] = {}
+
+    def server_ratings(self, server_id: int) -> Dict[Tuple[int, str], Tuple[float, float]]:
+        """
+        Returns all ratings of the server, loading them if needed
+        """
+        if server_id not in self._servers:
+            with session_scope() as session:
+                self._set_server_ratings(server_id, query_server_ratings(session, server_id))
+
+        return self._servers[server_id]
+
+    async def preload(self, server_id: int):
+        """
+        Loads the server’s ratings through the async engine if needed, so coroutines then only read memory
+        """
+        if server_id not in self._servers:
+            self._set_server_ratings(server_id, await run_in_session(query_server_ratings, server_id))
+
+    def _set_server_ratings(self, server_id: int, ratings: Dict[Tuple[int, str], Tuple[float, float]]):
+        rating_cache_logger.info(f"Loaded {len(ratings)} ratings of server {server_id}")
+
+        # Another load could have finished first, and its ratings could already have been updated
+        self._servers.setdefault(server_id, ratings)
+
+    def get(self, server_id: int, player_id: int, role: str) -> Optional[Tuple[float, float]]:
+        """
+        Returns the (mu, sigma) of the player for the role, or None if the player never got a rating for it
+        """
+        return self.server_ratings(server_id).get((player_id, role))
+
+    def player_rating(self, player, role: str) -> Tuple[float, float]:
+        """
+        Returns the (mu, sigma) of the Player object for the role, even if it is missing from the cache
+
+        Ratings are cached when they are created, so a missing one was created without going through the cache. It
+        is then read from player.ratings and added to the cache, which raises a KeyError like PackedQueue does if
+        the player never got a rating for the role
+        """
+        rating = self.get(player.server_id, player.id, role)
+
+        if rating is None:
+            player_rating = player.ratings[role]
+            rating = player_rating.trueskill_mu, player_rating.trueskill_sigma
+
+            rating_cache_logger.warning(
+                f"No cached {role} rating for player {player.id} in server {player.server_id}, "
+                f"reading it from the database"
+            )
+            self.fill(player.server_id, {(player.id, role): rating})
+
+        return rating
+
+    def update(self, server_id: int, ratings: Dict[Tuple[int, str], Tuple[float, float]]):
+        """
+        Writes new ratings through, which needs to happen once they are committed to the database
+
+        Servers that were not loaded yet are left alone, as they will get the new ratings from the database
+        """
+        if server_id in self._servers:
+            self._servers[server_id].update(ratings)
+
+    def fill(self, server_id: int, ratings: Dict[Tuple[int, str], Tuple[float, float]]):
+        """
+        Adds ratings read from the database that the cache does not have yet
+
+        Known ratings are never overwritten, as they could have been written by a scoring thread after the read
+        """
+        if server_id in self._servers:
+            server_ratings = self._servers[server_id]
+
+            for key, rating in ratings.items():
+                server_ratings.setdefault(key, rating)
+
+    def invalidate(self, server_id: Optional[int] = None):
+        """
+        Drops the ratings of the server, or of every server if server_id is None
+        """
+        if server_id is None:
+            self._servers.clear()
+        else:
+            self._servers.pop(server_id, None)
+
+
+def query_server_ratings(session, server_id: int) -> Dict[Tuple[int, str], Tuple[float, float]]:
+    return {
+        (player_id, role): (mu, sigma)
+        for player_id, role, mu, sigma in session.query(
+            PlayerRating.player_id,
+            PlayerRating.role,
+            PlayerRating.trueskill_mu,
+            PlayerRating.trueskill_sigma,
+        ).filter(PlayerRating.player_server_id == server_id)
+    }
+
+
+rating_cache = RatingCache()
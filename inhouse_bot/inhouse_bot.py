@@ -14,6 +14,8 @@ from inhouse_bot.common_utils.constants import PREFIX, QUEUE_RESET_TIME
 from inhouse_bot.common_utils.get_server_config import get_server_config
 from inhouse_bot.database_orm import session_scope
 from inhouse_bot.game_queue.queue_handler import SameRolesForDuo
+from inhouse_bot.game_queue.queue_store import queue_store
+from inhouse_bot.matchmaking_logic import matchmaking_executor
 from inhouse_bot.queue_channel_handler.queue_channel_handler import (
     QueueChannelsOnly,
     queue_channel_handler,
@@ -60,6 +62,15 @@ class InhouseBot(commands.Bot):
     def run(self, *args, **kwargs):
         super().run(os.environ["INHOUSE_BOT_TOKEN"], *args, **kwargs)
 
+    async def close(self):
+        # Matchmaking worker processes need to be stopped with the bot
+        matchmaking_executor.shutdown()
+
+        # Queue changes not written by the background writer yet would be lost otherwise
+        queue_store.flush()
+
+        await super().close()
+
     async def command_logging(self, ctx: discord.ext.commands.Context):
         """
         Listener called on command-trigger messages to add some logging
@@ -86,6 +97,9 @@ class InhouseBot(commands.Bot):
         # Starts the scheduler
         self.daily_jobs()
 
+        # Queues are read from the database once, without blocking the event loop
+        await queue_store.preload()
+
         # We cancel all ready-checks, and queue_channel_handler will handle rewriting the queues
         game_queue.cancel_all_ready_checks()
 
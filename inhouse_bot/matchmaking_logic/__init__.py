@@ -1,6 +1,17 @@
 from inhouse_bot.matchmaking_logic.find_best_game import find_best_game
 from inhouse_bot.matchmaking_logic.evaluate_game import evaluate_game
-from inhouse_bot.matchmaking_logic.score_game import score_game_from_winning_player
-import trueskill
-
-trueskill.DRAW_PROBABILITY = 0.
+from inhouse_bot.matchmaking_logic.score_game import (
+    score_game_from_winning_player,
+    score_game_from_winning_player_async,
+    score_games,
+)
+from inhouse_bot.matchmaking_logic.rating_replay import recompute_ratings, recompute_all_ratings
+from inhouse_bot.matchmaking_logic.matchmaking_executor import matchmaking_executor
+from inhouse_bot.matchmaking_logic.matchmaking_scheduler import matchmaking_scheduler
+from inhouse_bot.matchmaking_logic.rating_engines import (
+    rating_engine_classes,
+    get_rating_engine,
+    preload_rating_engine,
+    set_rating_engine,
+    set_rating_engine_async,
+)
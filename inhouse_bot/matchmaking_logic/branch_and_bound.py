@@ -0,0 +1,234 @@
+import itertools
+import math
+from typing import List, Optional, Tuple
+
+from inhouse_bot.common_utils.fields import roles_list
+from inhouse_bot.matchmaking_logic.candidate_game import CandidateGame, CandidateHeap
+from inhouse_bot.matchmaking_logic.packed_queue import PackedQueue, NO_DUO
+from inhouse_bot.matchmaking_logic.search_deadline import SearchDeadline
+from inhouse_bot.matchmaking_logic.vectorized_search import GOOD_ENOUGH_SCORE
+
+BLUE, RED = 1, -1
+
+
+class _SearchState:
+    """
+    Players already placed in the partial composition, and duos that still need to be placed on a given side
+    """
+
+    def __init__(self, packed_queue: PackedQueue, role_order: List[int]):
+        self.player_ids = packed_queue.player_ids.tolist()
+        self.duo_ids = packed_queue.duo_ids.tolist()
+
+        # player_id -> last depth (in role_order) at which the player can be placed
+        self.last_depth = {}
+        for row, role in enumerate(packed_queue.roles.tolist()):
+            depth = role_order.index(role)
+            self.last_depth[self.player_ids[row]] = max(
+                depth, self.last_depth.get(self.player_ids[row], depth)
+            )
+
+        # player_id -> side
+        self.placed = {}
+
+        # player_id -> [side, number of placed duos requiring it]
+        self.required = {}
+
+    def place(self, row: int, side: int) -> bool:
+        """
+        Places the row on the given side if it does not break unicity or duo constraints
+        """
+        player_id, duo_id = self.player_ids[row], self.duo_ids[row]
+
+        if player_id in self.placed:
+            return False
+
+        if player_id in self.required and self.required[player_id][0] != side:
+            return False
+
+        if duo_id != NO_DUO:
+            if self.placed.get(duo_id, side) != side:
+                return False
+
+            if duo_id in self.required and self.required[duo_id][0] != side:
+                return False
+
+            self.required.setdefault(duo_id, [side, 0])[1] += 1
+
+        self.placed[player_id] = side
+        return True
+
+    def remove(self, row: int):
+        player_id, duo_id = self.player_ids[row], self.duo_ids[row]
+
+        del self.placed[player_id]
+
+        if duo_id != NO_DUO:
+            self.required[duo_id][1] -= 1
+            if not self.required[duo_id][1]:
+                del self.required[duo_id]
+
+    def duos_can_be_placed(self, next_depth: int) -> bool:
+        """
+        Checks that every duo still waiting to be placed queues for a role that is not filled yet
+        """
+        return all(
+            self.last_depth.get(player_id, -1) >= next_depth
+            for player_id in self.required
+            if player_id not in self.placed
+        )
+
+    def forced_placement(self, depth: int) -> Optional[Tuple[int, int]]:
+        """
+        Returns a (player_id, side) that has to be placed at this depth because it is his last chance
+        """
+        for player_id, (side, _) in self.required.items():
+            if player_id not in self.placed and self.last_depth.get(player_id) == depth:
+                return player_id, side
+
+        return None
+
+
+def find_best_composition(
+    packed_queue: PackedQueue,
+    required_row: Optional[int] = None,
+    candidates: Optional[CandidateHeap] = None,
+    deadline: Optional[SearchDeadline] = None,
+) -> Optional[CandidateGame]:
+    """
+    Depth-first search on roles, pruning branches that cannot beat the worst of the best compositions found so far
+
+        - Mirrored compositions are never generated, as blue is always the oldest player in the first role
+        - Duo constraints are propagated role by role instead of being checked on full compositions
+        - The partial mu difference gives a lower bound on the final balance of the subtree
+
+    The best compositions are pushed to candidates, and the best one is returned
+    If required_row is given, only compositions including this row are considered
+    If deadline is given, the search stops with the best compositions found so far once it expired
+    """
+    if candidates is None:
+        candidates = CandidateHeap()
+
+    rows_by_role = [packed_queue.role_rows(role_idx).tolist() for role_idx in range(len(roles_list))]
+
+    if any(len(rows) < 2 for rows in rows_by_role):
+        return candidates.best()
+
+    required_role = int(packed_queue.roles[required_row]) if required_row is not None else None
+
+    # Roles with the least players go first to keep the top of the tree narrow, and the required row is first
+    role_order = sorted(
+        range(len(roles_list)),
+        key=lambda role_idx: (role_idx != required_role, len(rows_by_role[role_idx])),
+    )
+
+    mu = packed_queue.mu.tolist()
+    sigma_squared = (packed_queue.sigma ** 2).tolist()
+    game_base_variance = packed_queue.game_base_variance
+
+    # (blue row, red row, delta mu, sum of sigma²) per depth, with combinations for the first role to skip mirrors
+    depth_pairs = [
+        [
+            (blue, red, mu[blue] - mu[red], sigma_squared[blue] + sigma_squared[red])
+            for blue, red in (itertools.combinations if depth == 0 else itertools.permutations)(
+                rows_by_role[role_idx], 2
+            )
+        ]
+        for depth, role_idx in enumerate(role_order)
+    ]
+
+    if required_row is not None:
+        depth_pairs[0] = [pair for pair in depth_pairs[0] if required_row in pair[:2]]
+
+    # Maximum |delta mu| and sum of sigma² that the roles from a given depth onwards can still add
+    remaining_delta = [0.0] * (len(roles_list) + 1)
+    remaining_sigma_squared = [0.0] * (len(roles_list) + 1)
+    for depth in reversed(range(len(roles_list))):
+        remaining_delta[depth] = remaining_delta[depth + 1] + max(abs(p[2]) for p in depth_pairs[depth])
+        remaining_sigma_squared[depth] = remaining_sigma_squared[depth + 1] + max(
+            p[3] for p in depth_pairs[depth]
+        )
+
+    # (player_id, side) -> pairs at each depth, used when a duo has to be placed in a specific role
+    depth_pairs_by_player = [{} for _ in role_order]
+    for depth, pairs in enumerate(depth_pairs):
+        for pair in pairs:
+            for row, side in ((pair[0], BLUE), (pair[1], RED)):
+                key = (int(packed_queue.player_ids[row]), side)
+                depth_pairs_by_player[depth].setdefault(key, []).append(pair)
+
+    state = _SearchState(packed_queue, role_order)
+    composition = [None] * len(roles_list)
+
+    # role_idx -> depth, to go back from role_order to roles_list order
+    role_depth = [role_order.index(role_idx) for role_idx in range(len(roles_list))]
+
+    def search(depth: int, delta: float, sum_sigma_squared: float) -> bool:
+        """
+        Returns True once a good enough game has been found or the deadline expired, which stops the whole search
+        """
+        if deadline and deadline.expired():
+            return True
+
+        if depth == len(roles_list):
+            candidates.compositions_evaluated += 1
+            balance = abs(delta) / math.sqrt(game_base_variance + sum_sigma_squared)
+
+            if balance < candidates.balance_to_beat:
+                candidates.push(
+                    CandidateGame(
+                        blue_rows=[composition[depth][0] for depth in role_depth],
+                        red_rows=[composition[depth][1] for depth in role_depth],
+                        balance=balance,
+                    )
+                )
+
+                return candidates.is_good_enough(GOOD_ENOUGH_SCORE)
+
+            return False
+
+        balance_to_beat = candidates.balance_to_beat
+
+        # Upper bound of the final denominator for every composition in this subtree
+        max_denominator = math.sqrt(game_base_variance + sum_sigma_squared + remaining_sigma_squared[depth])
+
+        # If a duo can only be placed in this role, we only look at pairs placing him on the right side
+        pairs = depth_pairs[depth]
+        if state.required and (forced := state.forced_placement(depth)):
+            pairs = depth_pairs_by_player[depth].get(forced, [])
+
+        # We try pairs that bring delta mu the closest to 0 first, which finds good games early
+        for blue, red, pair_delta, pair_sigma_squared in sorted(pairs, key=lambda p: abs(delta + p[2])):
+            new_delta = delta + pair_delta
+
+            # Pairs are sorted by |new_delta| so if this one cannot beat the best game, the next ones cannot either
+            if max(0.0, abs(new_delta) - remaining_delta[depth + 1]) / max_denominator >= balance_to_beat:
+                break
+
+            new_sum_sigma_squared = sum_sigma_squared + pair_sigma_squared
+
+            lower_bound = max(0.0, abs(new_delta) - remaining_delta[depth + 1]) / math.sqrt(
+                game_base_variance + new_sum_sigma_squared + remaining_sigma_squared[depth + 1]
+            )
+            if lower_bound >= candidates.balance_to_beat:
+                continue
+
+            if not state.place(blue, BLUE):
+                continue
+
+            if state.place(red, RED):
+                if not state.required or state.duos_can_be_placed(depth + 1):
+                    composition[depth] = (blue, red)
+
+                    if search(depth + 1, new_delta, new_sum_sigma_squared):
+                        return True
+
+                state.remove(red)
+
+            state.remove(blue)
+
+        return False
+
+    search(0, 0.0, 0.0)
+
+    return candidates.best()
@@ -0,0 +1,162 @@
+import heapq
+import itertools
+import math
+import random
+from typing import List, Optional, Sequence
+
+from inhouse_bot.common_utils.fields import roles_list
+from inhouse_bot.database_orm import Game, QueuePlayer
+from inhouse_bot.inhouse_logger import inhouse_logger
+from inhouse_bot.matchmaking_logic.evaluate_game import balance_to_score
+
+
+class CandidateGame:
+    """
+    Team composition considered by the matchmaking engines, as rows of the PackedQueue it was found in
+
+    It is a lot cheaper to create than a Game and its 10 GameParticipant, so only the chosen candidate gets promoted
+    to a Game with to_game()
+    """
+
+    __slots__ = ("blue_rows", "red_rows", "balance")
+
+    def __init__(self, blue_rows: Sequence[int], red_rows: Sequence[int], balance: float):
+        # Rows are in roles_list order
+        self.blue_rows = tuple(blue_rows)
+        self.red_rows = tuple(red_rows)
+
+        # |delta mu| / denominator, which is what engines minimize
+        self.balance = balance
+
+    @property
+    def matchmaking_score(self) -> float:
+        return balance_to_score(self.balance)
+
+    @property
+    def rows(self) -> tuple:
+        return self.blue_rows + self.red_rows
+
+    @property
+    def key(self) -> tuple:
+        """
+        Identifies the composition regardless of sides, as mirrored compositions are the same game
+        """
+        return min((self.blue_rows, self.red_rows), (self.red_rows, self.blue_rows))
+
+    def __eq__(self, other):
+        return isinstance(other, CandidateGame) and self.key == other.key
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def __repr__(self):
+        return f"CandidateGame({self.blue_rows}, {self.red_rows}, balance={self.balance:.4f})"
+
+    def moved_to(self, from_queue, to_queue) -> Optional["CandidateGame"]:
+        """
+        Returns the same composition with rows of to_queue, or None if one of its players left or changed duo
+
+        Both arguments are PackedQueue objects, from_queue being the one the candidate was found in
+        """
+        to_rows = {
+            key: row for row, key in enumerate(zip(to_queue.player_ids.tolist(), to_queue.roles.tolist()))
+        }
+
+        moved_rows = []
+        for row in self.rows:
+            moved_row = to_rows.get((int(from_queue.player_ids[row]), int(from_queue.roles[row])))
+
+            if moved_row is None or to_queue.duo_ids[moved_row] != from_queue.duo_ids[row]:
+                return None
+
+            moved_rows.append(moved_row)
+
+        blue_rows, red_rows = moved_rows[: len(self.blue_rows)], moved_rows[len(self.blue_rows) :]
+
+        # Ratings could have changed in the meantime
+        return CandidateGame(blue_rows, red_rows, to_queue.balance(blue_rows, red_rows))
+
+    def to_game(self, queue_players: List[QueuePlayer]) -> Game:
+        """
+        Creates the Game object of the candidate, queue_players being the list the PackedQueue was created from
+        """
+        blue_rows, red_rows = self.blue_rows, self.red_rows
+
+        # Mirrored compositions have the exact same score, so we shuffle sides to not always favor the oldest players
+        if random.getrandbits(1):
+            blue_rows, red_rows = red_rows, blue_rows
+
+        players = {}
+        for role, blue_row, red_row in zip(roles_list, blue_rows, red_rows):
+            players["BLUE", role] = queue_players[blue_row].player
+            players["RED", role] = queue_players[red_row].player
+
+        # We create a Game object for easier handling, and it will compute the matchmaking score
+        #   Importantly, we do *not* add the game to the session, as that will be handled by the bot logic itself
+        game = Game(players)
+
+        inhouse_logger.info(
+            f"Best game found with {game.blue_expected_winrate*100:.2f} blue side expected winrate"
+        )
+
+        return game
+
+
+class CandidateHeap:
+    """
+    Bounded collection of the best distinct candidates found by the matchmaking engines
+
+    Engines push every composition that beats balance_to_beat, which is the balance of the worst kept candidate
+    once the heap is full
+    """
+
+    def __init__(self, size: int = 1):
+        self.size = size
+
+        # (-balance, -insertion order, candidate), so the root is the worst candidate and the newest one on ties
+        self._heap = []
+        self._candidates = set()
+        self._insertion_order = itertools.count()
+
+        # Incremented by engines, used to compare their efficiency
+        self.compositions_evaluated = 0
+
+    def __len__(self):
+        return len(self._heap)
+
+    @property
+    def balance_to_beat(self) -> float:
+        return -self._heap[0][0] if len(self._heap) >= self.size else math.inf
+
+    def push(self, candidate: CandidateGame) -> bool:
+        """
+        Adds the candidate if it beats the worst one, returning True if it was added
+        """
+        if candidate.balance >= self.balance_to_beat or candidate in self._candidates:
+            return False
+
+        entry = (-candidate.balance, -next(self._insertion_order), candidate)
+
+        if len(self._heap) >= self.size:
+            self._candidates.remove(heapq.heapreplace(self._heap, entry)[2])
+        else:
+            heapq.heappush(self._heap, entry)
+
+        self._candidates.add(candidate)
+
+        return True
+
+    def is_good_enough(self, good_enough_score: float) -> bool:
+        """
+        True once the heap is full of candidates below good_enough_score, at which point engines can stop
+        """
+        return len(self._heap) >= self.size and balance_to_score(self.balance_to_beat) < good_enough_score
+
+    def best(self) -> Optional[CandidateGame]:
+        return max(self._heap)[2] if self._heap else None
+
+    def sorted(self) -> List[CandidateGame]:
+        """
+        Candidates from best to worst, older compositions first on ties
+        """
+        return [entry[2] for entry in sorted(self._heap, reverse=True)]
@@ -1,29 +1,118 @@
-import itertools
 import math
+from typing import Sequence, Tuple
 
+import numpy as np
 import trueskill
 
+from inhouse_bot.common_utils.fields import roles_list
 from inhouse_bot.database_orm import Game
 
+# Precomputed once as those are used for every single candidate game
+#   Those are the default values, servers using a rating engine with another beta get theirs from the engine
+BETA_SQUARED = trueskill.BETA * trueskill.BETA
 
-def evaluate_game(game: Game) -> float:
+# Part of the denominator coming from the performance variance of the 10 players of a game
+GAME_BASE_VARIANCE = 2 * len(roles_list) * BETA_SQUARED
+
+# The CDF of the default backend does not depend on the environment’s parameters, so we only get it once
+cdf = trueskill.global_env().cdf
+
+
+# Coefficients of the erfc approximation used by TrueSkill, from the innermost to the outermost term
+_ERFC_COEFFICIENTS = (
+    0.17087277,
+    -0.82215223,
+    1.48851587,
+    -1.13520398,
+    0.27886807,
+    -0.18628806,
+    0.09678418,
+    0.37409196,
+    1.00002368,
+)
+
+
+def cdf_array(x: np.ndarray) -> np.ndarray:
+    """
+    NumPy version of the TrueSkill CDF, using the same erfc approximation to give the same numbers
+    """
+    # cdf(x) = erfc(-x / sqrt(2)) / 2
+    z = np.abs(x) / math.sqrt(2)
+    t = 1.0 / (1.0 + z / 2.0)
+
+    polynomial = _ERFC_COEFFICIENTS[0]
+    for coefficient in _ERFC_COEFFICIENTS[1:]:
+        polynomial = coefficient + t * polynomial
+
+    r = t * np.exp(-z * z - 1.26551223 + t * polynomial)
+
+    return 0.5 * np.where(x > 0, 2.0 - r, r)
+
+
+def evaluate_ratings(
+    blue_ratings: Sequence[Tuple[float, float]],
+    red_ratings: Sequence[Tuple[float, float]],
+    beta_squared: float = BETA_SQUARED,
+) -> float:
     """
-    Returns the expected win probability of the blue team over the red team
+    Returns the expected win probability of the blue team from the (mu, sigma) of each player
     """
+    blue_mu = red_mu = sum_sigma_squared = 0.0
 
-    blue_team_ratings = [
-        trueskill.Rating(mu=p.trueskill_mu, sigma=p.trueskill_sigma) for p in game.teams.BLUE
-    ]
-    red_team_ratings = [trueskill.Rating(mu=p.trueskill_mu, sigma=p.trueskill_sigma) for p in game.teams.RED]
+    for mu, sigma in blue_ratings:
+        blue_mu += mu
+        sum_sigma_squared += sigma * sigma
 
-    delta_mu = sum(r.mu for r in blue_team_ratings) - sum(r.mu for r in red_team_ratings)
+    for mu, sigma in red_ratings:
+        red_mu += mu
+        sum_sigma_squared += sigma * sigma
 
-    sum_sigma = sum(r.sigma ** 2 for r in itertools.chain(blue_team_ratings, red_team_ratings))
+    size = len(blue_ratings) + len(red_ratings)
 
-    size = len(blue_team_ratings) + len(red_team_ratings)
+    return cdf((blue_mu - red_mu) / math.sqrt(size * beta_squared + sum_sigma_squared))
 
-    denominator = math.sqrt(size * (trueskill.BETA * trueskill.BETA) + sum_sigma)
 
-    ts = trueskill.global_env()
+def evaluate_ratings_array(
+    blue_mu: np.ndarray,
+    blue_sigma: np.ndarray,
+    red_mu: np.ndarray,
+    red_sigma: np.ndarray,
+    beta_squared: float = BETA_SQUARED,
+) -> np.ndarray:
+    """
+    Same as evaluate_ratings for many games at once, with one game per row and one player per column
+    """
+    delta_mu = blue_mu.sum(axis=-1) - red_mu.sum(axis=-1)
+    sum_sigma_squared = (blue_sigma ** 2).sum(axis=-1) + (red_sigma ** 2).sum(axis=-1)
+
+    size = blue_mu.shape[-1] + red_mu.shape[-1]
+
+    return cdf_array(delta_mu / np.sqrt(size * beta_squared + sum_sigma_squared))
+
+
+def balance_to_score(balance: float) -> float:
+    """
+    Goes from a composition balance to its matchmaking score, abs(0.5 - blue_expected_winrate)
+    """
+    return cdf(balance) - 0.5
+
+
+def evaluate_game(game: Game) -> float:
+    """
+    Returns the expected win probability of the blue team over the red team, with the rating engine of its server
+    """
+    # Local import as rating engines need the functions of this module
+    from inhouse_bot.matchmaking_logic.rating_engines import get_rating_engine
 
-    return ts.cdf(delta_mu / denominator)
+    # We read participants directly instead of using game.teams, which is rebuilt on every access
+    return evaluate_ratings(
+        [
+            (game.participants["BLUE", role].trueskill_mu, game.participants["BLUE", role].trueskill_sigma)
+            for role in roles_list
+        ],
+        [
+            (game.participants["RED", role].trueskill_mu, game.participants["RED", role].trueskill_sigma)
+            for role in roles_list
+        ],
+        get_rating_engine(game.server_id).beta_squared,
+    )
@@ -1,127 +1,273 @@
 import itertools
-import random
-from typing import Optional, List
+from dataclasses import dataclass
+from typing import List, Optional
 
-from inhouse_bot.database_orm import Game, QueuePlayer
+from inhouse_bot.database_orm import Game
 from inhouse_bot.common_utils.fields import roles_list
 from inhouse_bot.game_queue import GameQueue
 from inhouse_bot.inhouse_logger import inhouse_logger
+from inhouse_bot.matchmaking_logic import branch_and_bound, local_search, vectorized_search
+from inhouse_bot.matchmaking_logic.candidate_game import CandidateGame, CandidateHeap
+from inhouse_bot.matchmaking_logic.packed_queue import PackedQueue, NO_DUO
+from inhouse_bot.matchmaking_logic.rating_engines import get_rating_engine
+from inhouse_bot.matchmaking_logic.search_deadline import SearchDeadline
 
+# Search engines, which all take a PackedQueue and return the CandidateGame of the best composition
+matchmaking_engines = {
+    "vectorized": vectorized_search.find_best_composition,
+    "branch_and_bound": branch_and_bound.find_best_composition,
+    "local_search": local_search.find_best_composition,
+}
 
-def find_best_game(queue: GameQueue, game_quality_threshold=0.1) -> Optional[Game]:
-    # Do not do anything if there’s not at least 2 players in queue per role
+# Engines that do not score every composition and can miss the best one
+HEURISTIC_ENGINES = {"local_search"}
 
-    for role_queue in queue.queue_players_dict.values():
-        if len(role_queue) < 2:
-            return None
+# Above this number of compositions, enumerating all of them gets too slow and we switch to branch and bound
+VECTORIZED_SEARCH_LIMIT = 10 ** 7
+
+# Once every role has this many players, even branch and bound gets too slow and we switch to local search
+#   Branch and bound stays exact within a few seconds up to there, which covers queues of 30 to 50 players
+LOCAL_SEARCH_ROLE_SIZE = 16
+
+
+@dataclass
+class MatchmakingResult:
+    """
+    Outcome of a matchmaking search on a PackedQueue
+    """
+
+    # Best composition found, or None if there was none
+    composition: Optional[CandidateGame]
+
+    # Best distinct compositions found, from best to worst, starting with composition
+    candidates: List[CandidateGame]
+
+    # Number of oldest players in queue that were considered by the search
+    players_considered: int
+
+    # False if the search was stopped by its deadline or used a heuristic engine, and could have missed a better one
+    exhaustive: bool
+
+    # Number of compositions scored by the engines
+    compositions_evaluated: int = 0
+
+
+def choose_engine(packed_queue: PackedQueue, required_row: Optional[int] = None) -> str:
+    """
+    Picks the matchmaking engine based on the number of team compositions to consider
+    """
+    required_role = packed_queue.roles[required_row] if required_row is not None else None
+
+    role_counts = [len(packed_queue.role_rows(role_idx)) for role_idx in range(len(roles_list))]
+
+    if min(role_counts) >= LOCAL_SEARCH_ROLE_SIZE:
+        return "local_search"
+
+    compositions_count = 1
+    for role_idx, role_count in enumerate(role_counts):
+
+        # If a row is required, its role only has the pairs including it
+        compositions_count *= (
+            role_count * (role_count - 1) if role_idx != required_role else 2 * (role_count - 1)
+        )
+
+    return "vectorized" if compositions_count <= VECTORIZED_SEARCH_LIMIT else "branch_and_bound"
+
+
+def has_enough_players(queue: GameQueue) -> bool:
+    """
+    We do not do anything if there’s not at least 2 players in queue per role
+    """
+    return all(len(role_queue) >= 2 for role_queue in queue.queue_players_dict.values())
+
+
+def find_best_game(
+    queue: GameQueue,
+    game_quality_threshold=0.1,
+    engine: Optional[str] = None,
+    time_budget: Optional[float] = None,
+) -> Optional[Game]:
+    """
+    Returns the best game for the queue, or None if there is none
+
+    If time_budget is given, the best game found after this many seconds is returned
+    """
+    if not has_enough_players(queue):
+        return None
 
     # If we get there, we know there are at least 10 players in the queue
     # We start with the 10 players who have been in queue for the longest time
 
     inhouse_logger.info(f"Matchmaking process started with the following queue:\n{queue}")
 
-    best_game = None
-    for players_threshold in range(10, len(queue) + 1):
-        # The queue_players are already ordered the right way to take age into account in matchmaking
-        #   We first try with the 10 first players, then 11, ...
-        best_game = find_best_game_for_queue_players(queue.queue_players[:players_threshold])
+    # Ratings are packed in arrays only once for the whole queue
+    packed_queue = PackedQueue.from_queue_players(
+        queue.queue_players, get_rating_engine(queue.server_id).game_base_variance
+    )
 
-        # We stop when we beat the game quality threshold (below 60% winrate for one side)
-        if best_game and best_game.matchmaking_score < game_quality_threshold:
-            return best_game
+    deadline = SearchDeadline(time_budget) if time_budget is not None else None
+
+    result = find_best_queue_composition(packed_queue, game_quality_threshold, engine, deadline)
 
-    return best_game
+    if not result.composition:
+        return None
 
+    return result.composition.to_game(queue.queue_players)
 
-def find_best_game_for_queue_players(queue_players: List[QueuePlayer]) -> Game:
+
+def find_best_queue_composition(
+    packed_queue: PackedQueue,
+    game_quality_threshold=0.1,
+    engine: Optional[str] = None,
+    deadline: Optional[SearchDeadline] = None,
+    candidates_count: int = 1,
+) -> MatchmakingResult:
     """
-    A sub function to allow us to iterate on QueuePlayers from oldest to newest
+    Finds the best composition by adding players to the search from oldest to newest
+
+    When we go from the n to n+1 oldest players, only the compositions including the new player are scored, as
+    all the other ones were already scored for the previous threshold. Heuristic engines cannot do that, and the
+    number of players they consider doubles instead
+
+    If no engine is given, it is chosen based on the number of compositions to score
+    The candidates_count best distinct compositions found along the way are also returned
+
+    If a deadline is given, the best composition found when it expires is returned, or None if none was found yet.
+    As older players are added first and engines try the most balanced pairs first, it is the most promising one
+    found in the time budget
     """
-    inhouse_logger.info(f"Trying to find the best game for: {' | '.join(f'{qp}' for qp in queue_players)}")
-
-    # Currently simply testing all permutations because it should be pretty lightweight
-    # TODO LOW PRIO Spot mirrored team compositions (full blue/red -> red/blue) to not calculate them twice
-
-    # This creates a list of possible 2-players permutations per role
-    # We keep it as a list to make it easier to make a product on the values afterwards
-    role_permutations = []  # list of tuples of 2-players permutations in the role
-
-    # We iterate on each role (which will have 2 players or more) and create one list of permutations per role
-    for role in roles_list:
-        role_permutations.append(
-            [
-                queue_player
-                for queue_player in itertools.permutations([qp for qp in queue_players if qp.role == role], 2)
-            ]
+    candidates = CandidateHeap(candidates_count)
+    players_considered = 0
+    heuristic = False
+
+    players_threshold = 10
+
+    while players_threshold <= len(packed_queue):
+        # The queue is already ordered the right way to take age into account in matchmaking
+        #   We first try with the 10 first players, then add the 11th, ...
+        new_row = players_threshold - 1 if players_threshold > 10 else None
+        threshold_queue = packed_queue[:players_threshold]
+
+        # The deadline bounds the whole search, even if no game was found yet
+        if deadline and deadline.expired():
+            break
+
+        # Engines push the compositions that beat the worst kept candidate and return the best one
+        threshold_engine = engine or choose_engine(threshold_queue, new_row)
+        heuristic = threshold_engine in HEURISTIC_ENGINES
+
+        # Heuristic engines do not reuse previous thresholds, so they search the whole threshold queue every time
+        if heuristic:
+            new_row = None
+
+        best_composition = matchmaking_engines[threshold_engine](
+            threshold_queue, required_row=new_row, candidates=candidates, deadline=deadline,
         )
+        players_considered = players_threshold
 
-    # We do a very simple maximum search
-    best_score = 1
-    best_game = None
-
-    # This generates all possible team compositions
-    # The format is a list of 5 tuples with the blue and red player objects in the tuple
-    for team_composition in itertools.product(*role_permutations):
-        # We already shuffle blue/red as otherwise the first best composition is always chosen
-        shuffle = bool(random.getrandbits(1))
-
-        # bool(tuple_idx) == shuffle explanation:
-        #   tuple_idx = 0 (BLUE) &  shuffle = False -> False == False   -> True     -> BLUE
-        #   tuple_idx = 1 (RED)  &  shuffle = False -> False == True    -> False    -> RED
-        #   tuple_idx = 0 (BLUE) &  shuffle = True  -> False == True    -> False    -> RED
-        #   tuple_idx = 1 (RED)  &  shuffle = True  -> True == True     -> True     -> BLUE
-
-        # We transform it to a more manageable dictionary of QueuePlayers
-        # {(team, role)} = QueuePlayer
-        queue_players_dict = {
-            ("BLUE" if bool(tuple_idx) == shuffle else "RED", roles_list[role_idx]): queue_players_tuple[
-                tuple_idx
-            ]
-            for role_idx, queue_players_tuple in enumerate(team_composition)
-            for tuple_idx in (0, 1)
-        }
-
-        # We check that all 10 QueuePlayers are in the same team as their duos
-
-        # TODO LOW PRIO This is super stupid *but* works well enough for easy situations
-        #   This is very much in need of a rewrite
-        duos_not_in_same_team = False
-        for team_tuple, qp in queue_players_dict.items():
-            if qp.duo_id is not None:
-                try:
-                    next(
-                        duo_qp
-                        for duo_team_tuple, duo_qp in queue_players_dict.items()
-                        if duo_team_tuple[0] == team_tuple[0] and duo_qp.player_id == qp.duo_id
-                    )
-                except StopIteration:
-                    duos_not_in_same_team = True
-                    continue
+        # We stop when we beat the game quality threshold (below 60% winrate for one side)
+        if best_composition and best_composition.matchmaking_score < game_quality_threshold:
+            break
 
-        if duos_not_in_same_team:
-            continue
+        # Running annealing again for each new player would be too slow, so heuristic engines double the number of
+        #   players instead. They only move between the oldest players, which keeps the seniority order
+        if heuristic and players_threshold < len(packed_queue):
+            players_threshold = min(2 * players_threshold, len(packed_queue))
+        else:
+            players_threshold += 1
 
-        # We take the players from the queue players and make it a new dict to create our games objects
-        players = {k: qp.player for k, qp in queue_players_dict.items()}
+    return MatchmakingResult(
+        composition=candidates.best(),
+        candidates=candidates.sorted(),
+        players_considered=players_considered,
+        exhaustive=not (deadline and deadline.reached) and not heuristic,
+        compositions_evaluated=candidates.compositions_evaluated,
+    )
 
-        # We check to make sure all 10 players are different
-        if set(players.values()).__len__() != 10:
-            continue
 
-        # We create a Game object for easier handling, and it will compute the matchmaking score
-        game = Game(players)
+def find_best_queue_split(
+    packed_queue: PackedQueue,
+    game_quality_threshold=0.1,
+    engine: Optional[str] = None,
+    deadline: Optional[SearchDeadline] = None,
+    max_games: Optional[int] = None,
+    first_composition: Optional[CandidateGame] = None,
+) -> List[CandidateGame]:
+    """
+    Splits the queue into as many disjoint games as possible, oldest players first
+
+    The first game is the one find_best_queue_composition returns, then players of each game found are removed
+    from the queue until no game below game_quality_threshold can be made with the remaining players
+    Players are finally swapped between the other games to lower the matchmaking score of the worst one, the first
+    game staying the one a single game search would start
+
+    If first_composition is given, it is used as the first game instead of searching it again
+    """
+    compositions = []
+    remaining_rows = list(range(len(packed_queue)))
 
-        # Importantly, we do *not* add the game to the session, as that will be handled by the bot logic itself
+    while max_games is None or len(compositions) < max_games:
+        if first_composition and not compositions:
+            composition = first_composition
+        else:
+            composition = find_best_queue_composition(
+                packed_queue[remaining_rows], game_quality_threshold, engine, deadline
+            ).composition
 
-        if game.matchmaking_score < best_score:
-            inhouse_logger.info(
-                f"New best game found with {game.blue_expected_winrate*100:.2f} blue side expected winrate"
+        # The first game is always returned, like for a single game search, but others have to be good enough
+        if not composition or (compositions and composition.matchmaking_score >= game_quality_threshold):
+            break
+
+        # Rows of the remaining queue are mapped back to rows of the full queue
+        compositions.append(
+            CandidateGame(
+                [remaining_rows[row] for row in composition.blue_rows],
+                [remaining_rows[row] for row in composition.red_rows],
+                composition.balance,
             )
+        )
+
+        # Players in a game are removed from the queue for all their roles
+        player_ids = {packed_queue.player_ids[row] for row in compositions[-1].rows}
+        remaining_rows = [row for row in remaining_rows if packed_queue.player_ids[row] not in player_ids]
+
+    return compositions[:1] + rebalance_compositions(packed_queue, compositions[1:])
+
+
+def rebalance_compositions(
+    packed_queue: PackedQueue, compositions: List[CandidateGame]
+) -> List[CandidateGame]:
+    """
+    Swaps players with the same role between two games as long as it lowers the worst balance of the two
+
+    Players in a duo are never swapped, so duos stay together. The games are made of the same players afterwards,
+    which keeps the seniority order the games were found with
+    """
+    compositions = [[list(c.blue_rows), list(c.red_rows), c.balance] for c in compositions]
+
+    improved = True
+    while improved:
+        improved = False
+
+        for first, second in itertools.combinations(compositions, 2):
+            for role_idx, first_side, second_side in itertools.product(
+                range(len(roles_list)), (0, 1), (0, 1)
+            ):
+                first_row, second_row = first[first_side][role_idx], second[second_side][role_idx]
+
+                if packed_queue.duo_ids[first_row] != NO_DUO or packed_queue.duo_ids[second_row] != NO_DUO:
+                    continue
+
+                first[first_side][role_idx], second[second_side][role_idx] = second_row, first_row
+
+                first_balance = packed_queue.balance(first[0], first[1])
+                second_balance = packed_queue.balance(second[0], second[1])
 
-            best_game = game
-            best_score = game.matchmaking_score
-            # If the game is seen as being below 51% winrate for one side, we simply stop there (helps with big lists)
-            if best_score < 0.01:
-                break
+                # Every swap lowers the worst balance of the pair, so this always ends
+                if max(first_balance, second_balance) < max(first[2], second[2]):
+                    first[2], second[2] = first_balance, second_balance
+                    improved = True
+                else:
+                    first[first_side][role_idx], second[second_side][role_idx] = first_row, second_row
 
-    return best_game
+    return [CandidateGame(blue_rows, red_rows, balance) for blue_rows, red_rows, balance in compositions]
@@ -0,0 +1,176 @@
+import math
+import random
+from typing import List, Optional, Tuple
+
+from inhouse_bot.common_utils.fields import roles_list
+from inhouse_bot.matchmaking_logic.candidate_game import CandidateGame, CandidateHeap
+from inhouse_bot.matchmaking_logic.packed_queue import PackedQueue, NO_DUO
+from inhouse_bot.matchmaking_logic.search_deadline import SearchDeadline
+from inhouse_bot.matchmaking_logic.vectorized_search import GOOD_ENOUGH_SCORE
+
+# Number of moves tried by a search, which bounds its running time whatever the queue size
+ITERATIONS = 20000
+
+# The search is restarted a few times from different compositions to not get stuck in a local minimum
+RESTARTS = 4
+
+# Annealing temperatures, in balance units
+START_TEMPERATURE = 0.3
+END_TEMPERATURE = 0.001
+
+# Added to the balance of a composition for each broken unicity or duo constraint
+CONSTRAINT_PENALTY = 1.0
+
+BLUE, RED = 0, 1
+
+
+def find_best_composition(
+    packed_queue: PackedQueue,
+    required_row: Optional[int] = None,
+    candidates: Optional[CandidateHeap] = None,
+    deadline: Optional[SearchDeadline] = None,
+    seed: int = 0,
+) -> Optional[CandidateGame]:
+    """
+    Simulated annealing over role assignments, for queues too big to be searched exhaustively
+
+    Each move replaces a player by another one queuing for the same role, or swaps the sides of a role. Broken duo
+    and unicity constraints are penalized instead of forbidden, so the search can go through them to place a duo,
+    but only valid compositions are pushed to candidates
+
+    The first composition is made of the oldest players in queue, and the result is not guaranteed to be optimal
+    If required_row is given, it is part of every composition considered
+    """
+    if candidates is None:
+        candidates = CandidateHeap()
+
+    rows_by_role = [packed_queue.role_rows(role_idx).tolist() for role_idx in range(len(roles_list))]
+
+    if any(len(rows) < 2 for rows in rows_by_role):
+        return candidates.best()
+
+    rng = random.Random(seed)
+
+    player_ids = packed_queue.player_ids.tolist()
+    duo_ids = packed_queue.duo_ids.tolist()
+    mu = packed_queue.mu.tolist()
+    sigma_squared = (packed_queue.sigma ** 2).tolist()
+    game_base_variance = packed_queue.game_base_variance
+
+    required_role = int(packed_queue.roles[required_row]) if required_row is not None else None
+
+    # player_id -> rows, used to bring a duo in the composition
+    rows_by_player = {}
+    for row, player_id in enumerate(player_ids):
+        rows_by_player.setdefault(player_id, []).append(row)
+
+    def energy(slots: List[List[int]]) -> Tuple[float, int]:
+        """
+        Returns the balance of the composition and its number of broken constraints
+        """
+        delta = sum_sigma_squared = 0.0
+        side_by_player = {}
+        violations = 0
+
+        for blue, red in slots:
+            delta += mu[blue] - mu[red]
+            sum_sigma_squared += sigma_squared[blue] + sigma_squared[red]
+
+            for row, side in ((blue, BLUE), (red, RED)):
+                if player_ids[row] in side_by_player:
+                    violations += 1
+                side_by_player[player_ids[row]] = side
+
+        for blue, red in slots:
+            for row, side in ((blue, BLUE), (red, RED)):
+                if duo_ids[row] != NO_DUO and side_by_player.get(duo_ids[row]) != side:
+                    violations += 1
+
+        return abs(delta) / math.sqrt(game_base_variance + sum_sigma_squared), violations
+
+    def starting_slots(restart: int) -> List[List[int]]:
+        """
+        The oldest players for the first run, and random players afterwards
+        """
+        slots = []
+        for role_idx, rows in enumerate(rows_by_role):
+            role_rows = rows if restart == 0 else rng.sample(rows, len(rows))
+
+            if role_idx == required_role:
+                role_rows = [required_row] + [row for row in role_rows if row != required_row]
+
+            slots.append(role_rows[:2])
+
+        return slots
+
+    def move(slots: List[List[int]]) -> List[List[int]]:
+        new_slots = [list(pair) for pair in slots]
+        role_idx = rng.randrange(len(roles_list))
+        side = rng.randrange(2)
+
+        if rng.random() < 0.2 or new_slots[role_idx][side] == required_row:
+            new_slots[role_idx].reverse()
+            return new_slots
+
+        row = rng.choice(rows_by_role[role_idx])
+
+        if row == new_slots[role_idx][1 - side]:
+            new_slots[role_idx].reverse()
+            return new_slots
+
+        new_slots[role_idx][side] = row
+
+        # If the new player is in a duo, we try to bring his duo on the same side
+        if duo_ids[row] != NO_DUO and duo_ids[row] in rows_by_player:
+            duo_row = rng.choice(rows_by_player[duo_ids[row]])
+            duo_role = int(packed_queue.roles[duo_row])
+
+            if duo_role != role_idx and required_row not in new_slots[duo_role]:
+                if new_slots[duo_role][1 - side] == duo_row:
+                    new_slots[duo_role].reverse()
+                else:
+                    new_slots[duo_role][side] = duo_row
+
+        return new_slots
+
+    iterations_per_restart = ITERATIONS // RESTARTS
+    cooling = (END_TEMPERATURE / START_TEMPERATURE) ** (1 / iterations_per_restart)
+
+    for restart in range(RESTARTS):
+        slots = starting_slots(restart)
+        balance, violations = energy(slots)
+        current_energy = balance + CONSTRAINT_PENALTY * violations
+        temperature = START_TEMPERATURE
+
+        for iteration in range(iterations_per_restart):
+            candidates.compositions_evaluated += 1
+
+            if not violations and balance < candidates.balance_to_beat:
+                candidates.push(
+                    CandidateGame(
+                        blue_rows=[pair[BLUE] for pair in slots],
+                        red_rows=[pair[RED] for pair in slots],
+                        balance=balance,
+                    )
+                )
+
+                if candidates.is_good_enough(GOOD_ENOUGH_SCORE):
+                    return candidates.best()
+
+            if iteration % 256 == 0 and deadline and deadline.expired():
+                return candidates.best()
+
+            new_slots = move(slots)
+            new_balance, new_violations = energy(new_slots)
+            new_energy = new_balance + CONSTRAINT_PENALTY * new_violations
+
+            # Worse compositions are accepted with a probability that goes down as the temperature does
+            acceptance = math.exp(min(0.0, current_energy - new_energy) / temperature)
+
+            if rng.random() < acceptance:
+                slots, balance, violations = new_slots, new_balance, new_violations
+                current_energy = new_energy
+
+            temperature *= cooling
+
+    return candidates.best()
@@ -0,0 +1,87 @@
+import logging
+from typing import Optional
+
+from inhouse_bot.matchmaking_logic.find_best_game import MatchmakingResult
+from inhouse_bot.matchmaking_logic.packed_queue import PackedQueue
+
+cache_logger = logging.getLogger("matchmaking_cache")
+
+
+class MatchmakingCache:
+    """
+    Last matchmaking result of each channel, reused as long as the part of the queue it depends on does not change
+
+    If the search stopped because it found a good enough game, only the players it considered matter, so players
+    joining the end of the queue do not invalidate it. Otherwise, the whole queue is part of the fingerprint
+    """
+
+    def __init__(self):
+        # channel_id -> (game_quality_threshold, prefix length, whole queue flag, prefix fingerprint, result)
+        self._entries = {}
+
+        self.hits = 0
+        self.misses = 0
+
+    def get(
+        self, channel_id: int, packed_queue: PackedQueue, game_quality_threshold: float
+    ) -> Optional[MatchmakingResult]:
+        """
+        Returns the cached result for this queue, or None if it needs to be searched
+        """
+        entry = self._entries.get(channel_id)
+
+        if entry:
+            threshold, prefix_length, whole_queue, fingerprint, result = entry
+
+            if (
+                threshold == game_quality_threshold
+                and (
+                    prefix_length == len(packed_queue) if whole_queue else prefix_length <= len(packed_queue)
+                )
+                and packed_queue[:prefix_length].fingerprint() == fingerprint
+            ):
+                self.hits += 1
+                return result
+
+        self.misses += 1
+        return None
+
+    def set(
+        self,
+        channel_id: int,
+        packed_queue: PackedQueue,
+        game_quality_threshold: float,
+        result: MatchmakingResult,
+    ):
+        # If the deadline was reached, running the search again could give a better game
+        if not result.exhaustive:
+            self._entries.pop(channel_id, None)
+            return
+
+        # The search only stops before the end of the queue when it beat the quality threshold
+        whole_queue = not (
+            result.composition and result.composition.matchmaking_score < game_quality_threshold
+        )
+        prefix_length = len(packed_queue) if whole_queue else result.players_considered
+
+        self._entries[channel_id] = (
+            game_quality_threshold,
+            prefix_length,
+            whole_queue,
+            packed_queue[:prefix_length].fingerprint(),
+            result,
+        )
+
+    def invalidate(self, channel_id: Optional[int] = None):
+        """
+        Drops the cached result of the channel, or of every channel if no channel_id is given
+        """
+        if channel_id is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(channel_id, None)
+
+        cache_logger.info(f"Matchmaking cache invalidated, {self.hits} hits and {self.misses} misses so far")
+
+
+matchmaking_cache = MatchmakingCache()
@@ -0,0 +1,313 @@
+import asyncio
+import ctypes
+import logging
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, List, Optional
+
+from inhouse_bot.common_utils.constants import (
+    MATCHMAKING_WORKERS,
+    MATCHMAKING_TIMEOUT,
+    MATCHMAKING_TIME_BUDGET,
+)
+from inhouse_bot.database_orm import Game
+from inhouse_bot.game_queue import GameQueue, preload_server
+from inhouse_bot.matchmaking_logic.find_best_game import (
+    MatchmakingResult,
+    has_enough_players,
+    find_best_queue_composition,
+    find_best_queue_split,
+)
+from inhouse_bot.matchmaking_logic.matchmaking_cache import matchmaking_cache
+from inhouse_bot.matchmaking_logic.packed_queue import PackedQueue
+from inhouse_bot.matchmaking_logic.rating_engines import get_rating_engine
+from inhouse_bot.matchmaking_logic.search_deadline import SearchDeadline, set_cancel_flags
+
+executor_logger = logging.getLogger("matchmaking_executor")
+
+# Number of searches that can be cancelled while running at the same time, including the ones still stopping
+CANCEL_SLOTS = 256
+
+
+class MatchmakingExecutor:
+    """
+    Runs matchmaking searches in a process pool so they do not block the bot’s event loop
+
+    Only the PackedQueue snapshot (ids, roles, duo ids, mu/sigma) is sent to the worker, and the Game object is
+    created back in the bot’s process from the composition it returns
+    """
+
+    def __init__(
+        self,
+        max_workers: Optional[int] = MATCHMAKING_WORKERS,
+        timeout: float = MATCHMAKING_TIMEOUT,
+        candidates_count: int = 5,
+    ):
+        self.max_workers = max_workers
+        self.timeout = timeout
+
+        # Number of distinct games kept by each search, so another one can be offered if a ready check is cancelled
+        self.candidates_count = candidates_count
+
+        self._pool = None
+
+        # Read by workers through the deadline of their search, as a running process pool task cannot be cancelled
+        self._cancel_flags = None
+        self._free_cancel_slots = list(range(CANCEL_SLOTS))
+
+        # Slots are given back from the pool’s thread once the worker stopped
+        self._cancel_slots_lock = threading.Lock()
+
+        # queue_id -> (future, cancel slot) of the ongoing search in this queue
+        self._ongoing_searches = {}
+
+        # queue_id -> (PackedQueue, candidates not offered yet) for the last search in this queue
+        self._alternatives = {}
+
+    @property
+    def pool(self) -> ProcessPoolExecutor:
+        # Spawning makes sure workers do not inherit the bot’s threads and database connections
+        if not self._pool:
+            mp_context = multiprocessing.get_context("spawn")
+
+            # Shared memory is only given to workers when they start, so flags are allocated once for the pool
+            self._cancel_flags = mp_context.RawArray(ctypes.c_bool, CANCEL_SLOTS)
+
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=mp_context,
+                initializer=set_cancel_flags,
+                initargs=(self._cancel_flags,),
+            )
+        return self._pool
+
+    async def find_best_game(
+        self, queue: GameQueue, game_quality_threshold=0.1, time_budget: float = MATCHMAKING_TIME_BUDGET
+    ) -> Optional[Game]:
+        """
+        Awaitable version of matchmaking_logic.find_best_game
+
+        After time_budget seconds, the search returns the best game found so far, which bounds the time it takes
+        for a ready check to pop
+        Returns None if no game was found, if the search timed out, or if it got cancelled because the queue changed
+        """
+        if not has_enough_players(queue):
+            return None
+
+        # Ratings and the rating engine are read from memory after that, so building the game does not block
+        await preload_server(queue.server_id)
+
+        packed_queue = PackedQueue.from_queue_players(
+            queue.queue_players, get_rating_engine(queue.server_id).game_base_variance
+        )
+
+        result = await self._find_best_result(
+            queue.queue_id, packed_queue, game_quality_threshold, time_budget
+        )
+
+        if not result:
+            return None
+
+        self._alternatives[queue.queue_id] = (packed_queue, result.candidates[1:])
+
+        if not result.composition:
+            return None
+
+        return result.composition.to_game(queue.queue_players)
+
+    async def find_best_games(
+        self, queue: GameQueue, game_quality_threshold=0.1, time_budget: float = MATCHMAKING_TIME_BUDGET
+    ) -> List[Game]:
+        """
+        Splits the queue into as many disjoint games as possible, which can then be started at the same time
+
+        The first game is the one find_best_game would return, and comes from the same cache. The other ones are
+        below game_quality_threshold
+        Returns an empty list if no game was found, if the search timed out, or if it got cancelled
+        """
+        if not has_enough_players(queue):
+            return []
+
+        await preload_server(queue.server_id)
+
+        packed_queue = PackedQueue.from_queue_players(
+            queue.queue_players, get_rating_engine(queue.server_id).game_base_variance
+        )
+
+        start = time.monotonic()
+
+        result = await self._find_best_result(
+            queue.queue_id, packed_queue, game_quality_threshold, time_budget
+        )
+
+        # Alternatives of a previous search would share players with those games
+        self._alternatives.pop(queue.queue_id, None)
+
+        if not result or not result.composition:
+            return []
+
+        # The first game is already known, so the split only searches the other ones, in what is left of the budget
+        compositions = await self._search(
+            queue.queue_id,
+            max(time_budget - (time.monotonic() - start), 0),
+            find_best_queue_split,
+            packed_queue,
+            game_quality_threshold,
+            first_composition=result.composition,
+        )
+
+        return [composition.to_game(queue.queue_players) for composition in compositions or []]
+
+    async def _find_best_result(
+        self, queue_id: int, packed_queue: PackedQueue, game_quality_threshold: float, time_budget: float
+    ) -> Optional[MatchmakingResult]:
+        """
+        Returns the cached result of the queue if it is still valid, and searches it otherwise
+
+        Returns None if the search timed out or got cancelled
+        """
+        # If a search was already running in this queue, its queue is outdated
+        self.cancel(queue_id)
+
+        result = matchmaking_cache.get(queue_id, packed_queue, game_quality_threshold)
+
+        if result:
+            return result
+
+        result = await self._search(
+            queue_id,
+            time_budget,
+            find_best_queue_composition,
+            packed_queue,
+            game_quality_threshold,
+            candidates_count=self.candidates_count,
+        )
+
+        if not result:
+            return None
+
+        if not result.exhaustive:
+            executor_logger.info(
+                f"Matchmaking in {queue_id} reached its {time_budget}s budget after considering "
+                f"{result.players_considered} players out of {len(packed_queue)}"
+            )
+
+        matchmaking_cache.set(queue_id, packed_queue, game_quality_threshold, result)
+
+        return result
+
+    async def find_alternative_game(self, queue: GameQueue) -> Optional[Game]:
+        """
+        Returns the next best game of the last search in the queue that is still possible with the current queue
+
+        This is used after a ready check got cancelled, and returns None if players from every remaining candidate
+        left the queue
+        """
+        packed_queue, alternatives = self._alternatives.pop(queue.queue_id, (None, []))
+
+        if not alternatives:
+            return None
+
+        await preload_server(queue.server_id)
+
+        current_packed_queue = PackedQueue.from_queue_players(
+            queue.queue_players, get_rating_engine(queue.server_id).game_base_variance
+        )
+
+        for idx, candidate in enumerate(alternatives):
+            moved_candidate = candidate.moved_to(packed_queue, current_packed_queue)
+
+            if moved_candidate:
+                self._alternatives[queue.queue_id] = (packed_queue, alternatives[idx + 1 :])
+
+                return moved_candidate.to_game(queue.queue_players)
+
+        return None
+
+    async def _search(self, queue_id: int, time_budget: float, search_function: Callable, *args, **kwargs):
+        """
+        Runs search_function in the pool with a deadline, returning None if it timed out or got cancelled
+        """
+        pool = self.pool
+        cancel_slot = self._take_cancel_slot()
+
+        # The deadline is created here so the time spent waiting for a free worker is part of the budget
+        deadline = SearchDeadline(time_budget, cancel_slot)
+
+        pool_future = pool.submit(search_function, *args, deadline=deadline, **kwargs)
+
+        # The slot is reused once the worker stopped, which can be after we stopped waiting for it
+        if cancel_slot is not None:
+            pool_future.add_done_callback(lambda _: self._give_back_cancel_slot(cancel_slot))
+
+        search = asyncio.wrap_future(pool_future)
+        self._ongoing_searches[queue_id] = (search, cancel_slot)
+
+        try:
+            result = await asyncio.wait_for(asyncio.shield(search), self.timeout)
+
+        except asyncio.TimeoutError:
+            executor_logger.warning(f"Matchmaking timed out after {self.timeout}s in {queue_id}")
+            self._stop(search, cancel_slot)
+            return None
+
+        except asyncio.CancelledError:
+            # If our own search got cancelled, it was replaced by a newer one and we simply exit
+            if search.cancelled():
+                executor_logger.info(f"Matchmaking in {queue_id} was cancelled by a queue change")
+                return None
+
+            self._stop(search, cancel_slot)
+            raise
+
+        finally:
+            if self._ongoing_searches.get(queue_id, (None,))[0] is search:
+                del self._ongoing_searches[queue_id]
+
+        return result
+
+    def cancel(self, queue_id: int):
+        """
+        Cancels the ongoing search of the queue, which should be called whenever it changes
+        """
+        search, cancel_slot = self._ongoing_searches.pop(queue_id, (None, None))
+
+        if search:
+            self._stop(search, cancel_slot)
+
+    def _stop(self, search: asyncio.Future, cancel_slot: Optional[int]):
+        # Cancelling the future only works if the search did not start, so we also tell the worker to stop
+        search.cancel()
+
+        if cancel_slot is not None:
+            self._cancel_flags[cancel_slot] = True
+
+    def _take_cancel_slot(self) -> Optional[int]:
+        with self._cancel_slots_lock:
+            if not self._free_cancel_slots:
+                executor_logger.warning("No cancel slot left, the search will run until its deadline")
+                return None
+
+            cancel_slot = self._free_cancel_slots.pop()
+
+        self._cancel_flags[cancel_slot] = False
+
+        return cancel_slot
+
+    def _give_back_cancel_slot(self, cancel_slot: int):
+        with self._cancel_slots_lock:
+            self._free_cancel_slots.append(cancel_slot)
+
+    def shutdown(self):
+        if self._pool:
+            # Running searches are stopped too, instead of keeping their worker until their deadline
+            for search, cancel_slot in list(self._ongoing_searches.values()):
+                self._stop(search, cancel_slot)
+
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+matchmaking_executor = MatchmakingExecutor()
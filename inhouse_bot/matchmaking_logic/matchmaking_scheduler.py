@@ -0,0 +1,85 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Optional, Set
+
+from inhouse_bot.common_utils.constants import MATCHMAKING_CONCURRENCY, MATCHMAKING_DEBOUNCE
+
+scheduler_logger = logging.getLogger("matchmaking_scheduler")
+
+
+class MatchmakingScheduler:
+    """
+    Makes sure each queue has at most one matchmaking run at a time
+
+    Triggers arriving during the debounce window or while a run is in flight are coalesced, so a burst of !queue in a
+    channel gives one run plus at most one rerun with the latest queue. Different queues run in parallel, up to
+    max_concurrent at the same time
+    """
+
+    def __init__(self, debounce: float = MATCHMAKING_DEBOUNCE, max_concurrent: int = MATCHMAKING_CONCURRENCY):
+        self.debounce = debounce
+        self.max_concurrent = max_concurrent
+
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+        # queue_id -> task running the matchmaking of this queue, until no rerun is pending
+        self._tasks: Dict[int, asyncio.Task] = {}
+
+        # queue_id -> latest run function given for this queue
+        self._runs: Dict[int, Callable[[], Awaitable]] = {}
+
+        # Queues that got triggered while their run was in flight
+        self._pending: Set[int] = set()
+
+    def trigger(self, queue_id: int, run: Callable[[], Awaitable]) -> asyncio.Task:
+        """
+        Schedules run() for the queue, replacing any run function that did not start yet
+
+        Returns the task handling the queue, which finishes once no rerun is pending
+        """
+        self._runs[queue_id] = run
+
+        if queue_id in self._tasks:
+            self._pending.add(queue_id)
+        else:
+            self._tasks[queue_id] = asyncio.get_event_loop().create_task(self._run_queue(queue_id))
+
+        return self._tasks[queue_id]
+
+    def is_scheduled(self, queue_id: int) -> bool:
+        return queue_id in self._tasks
+
+    async def _run_queue(self, queue_id: int):
+        # Created here as it needs to belong to the bot’s event loop
+        if not self._semaphore:
+            self._semaphore = asyncio.Semaphore(self.max_concurrent)
+
+        try:
+            while True:
+                # Players joining right after each other are all part of the same run
+                await asyncio.sleep(self.debounce)
+
+                # Triggers received until now are covered by this run, as it reads the latest queue
+                self._pending.discard(queue_id)
+                run = self._runs.pop(queue_id)
+
+                async with self._semaphore:
+                    try:
+                        await run()
+
+                    # A failed run should not stop the queue’s future runs
+                    except Exception:
+                        scheduler_logger.exception(f"Matchmaking failed in {queue_id}")
+
+                if queue_id not in self._pending:
+                    break
+
+                scheduler_logger.info(f"Matchmaking in {queue_id} changed during its run, running it again")
+
+        finally:
+            del self._tasks[queue_id]
+            self._pending.discard(queue_id)
+            self._runs.pop(queue_id, None)
+
+
+matchmaking_scheduler = MatchmakingScheduler()
@@ -0,0 +1,124 @@
+import hashlib
+import itertools
+import math
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+from inhouse_bot.common_utils.fields import roles_list
+from inhouse_bot.game_queue.rating_cache import rating_cache
+from inhouse_bot.matchmaking_logic.evaluate_game import GAME_BASE_VARIANCE
+
+# Used in the duo_ids array for players who are not in a duo
+NO_DUO = -1
+
+
+class PackedQueue:
+    """
+    Array representation of a list of QueuePlayer objects, used to score team compositions in batches
+
+    Rows are in the same order as the queue players they were created from, so a row index can always be used
+    to get back to the original QueuePlayer object
+    """
+
+    def __init__(
+        self,
+        player_ids: Sequence[int],
+        roles: Sequence[int],
+        duo_ids: Sequence[int],
+        mu: Sequence[float],
+        sigma: Sequence[float],
+        game_base_variance: float = GAME_BASE_VARIANCE,
+    ):
+        self.player_ids = np.asarray(player_ids, dtype=np.int64)
+
+        # Roles are stored as their index in roles_list
+        self.roles = np.asarray(roles, dtype=np.int8)
+
+        # NO_DUO for players without a duo
+        self.duo_ids = np.asarray(duo_ids, dtype=np.int64)
+
+        self.mu = np.asarray(mu, dtype=np.float64)
+        self.sigma = np.asarray(sigma, dtype=np.float64)
+
+        # Depends on the rating engine of the server the players are from
+        self.game_base_variance = game_base_variance
+
+    @classmethod
+    def from_queue_players(
+        cls, queue_players: list, game_base_variance: float = GAME_BASE_VARIANCE
+    ) -> "PackedQueue":
+        """
+        Packs the QueuePlayer objects once, with ratings from the rating cache
+
+        game_base_variance comes from the rating engine of the players’ server
+        """
+        ratings = rating_cache.server_ratings(queue_players[0].player_server_id) if queue_players else {}
+        queue_ratings = [ratings[qp.player_id, qp.role] for qp in queue_players]
+
+        return cls(
+            player_ids=[qp.player_id for qp in queue_players],
+            roles=[roles_list.index(qp.role) for qp in queue_players],
+            duo_ids=[qp.duo_id if qp.duo_id is not None else NO_DUO for qp in queue_players],
+            mu=[mu for mu, sigma in queue_ratings],
+            sigma=[sigma for mu, sigma in queue_ratings],
+            game_base_variance=game_base_variance,
+        )
+
+    def __len__(self):
+        return len(self.player_ids)
+
+    def __getitem__(self, item) -> "PackedQueue":
+        """
+        Slicing returns a PackedQueue made of the given rows, which is how we get the oldest players in queue
+        """
+        return PackedQueue(
+            player_ids=self.player_ids[item],
+            roles=self.roles[item],
+            duo_ids=self.duo_ids[item],
+            mu=self.mu[item],
+            sigma=self.sigma[item],
+            game_base_variance=self.game_base_variance,
+        )
+
+    def fingerprint(self) -> bytes:
+        """
+        Digest of every row in order, two queues with the same fingerprint always give the same matchmaking result
+        """
+        digest = hashlib.blake2b(digest_size=16)
+
+        for values in (self.player_ids, self.roles, self.duo_ids, self.mu, self.sigma):
+            digest.update(np.ascontiguousarray(values).tobytes())
+
+        digest.update(np.float64(self.game_base_variance).tobytes())
+
+        return digest.digest()
+
+    def role_rows(self, role_idx: int) -> np.ndarray:
+        """
+        Rows of the players queuing for the given role, from oldest to newest
+        """
+        return np.flatnonzero(self.roles == role_idx)
+
+    def role_pairs(self, role_idx: int, required_row: Optional[int] = None) -> np.ndarray:
+        """
+        Every (blue, red) ordered pair of rows for the role, as a (n, 2) array
+
+        The order is the one of itertools.permutations, which means older players are tried first
+        If required_row is in this role, only the pairs including it are returned
+        """
+        pairs: List[tuple] = list(itertools.permutations(self.role_rows(role_idx).tolist(), 2))
+
+        if required_row is not None and self.roles[required_row] == role_idx:
+            pairs = [pair for pair in pairs if required_row in pair]
+
+        return np.array(pairs, dtype=np.int64).reshape(-1, 2)
+
+    def balance(self, blue_rows: List[int], red_rows: List[int]) -> float:
+        """
+        |delta_mu| / denominator of the composition, which is the value all matchmaking engines minimize
+        """
+        delta_mu = self.mu[blue_rows].sum() - self.mu[red_rows].sum()
+        sum_sigma_squared = (self.sigma[blue_rows] ** 2).sum() + (self.sigma[red_rows] ** 2).sum()
+
+        return abs(delta_mu) / math.sqrt(self.game_base_variance + sum_sigma_squared)
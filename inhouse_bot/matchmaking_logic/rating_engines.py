@@ -0,0 +1,296 @@
+import abc
+import math
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import trueskill
+
+from inhouse_bot.common_utils.fields import roles_list
+from inhouse_bot.common_utils.get_server_config import get_server_config, invalidate_server_config
+from inhouse_bot.database_orm import session_scope, run_in_session, ServerConfig
+from inhouse_bot.matchmaking_logic.evaluate_game import BETA_SQUARED, cdf_array
+
+# Every engine stores ratings on the TrueSkill scale, so MMR and matchmaking work the same whatever the engine
+MU = 25.0
+SIGMA = MU / 3
+
+# Games are rated as rows of 10 participants, blue side then red side, both in roles_list order
+PARTICIPANTS_PER_GAME = 2 * len(roles_list)
+
+# (side, role) of each column of a game row
+GAME_COLUMNS = [(side, role) for side in ("BLUE", "RED") for role in roles_list]
+
+# +1 for blue side participants and -1 for red side ones
+_SIDE_SIGNS = np.repeat([1.0, -1.0], len(roles_list))
+
+# Key of the engine settings in the server config
+RATING_ENGINE_CONFIG_KEY = "rating_engine"
+
+
+def rating_to_mmr(mu, sigma):
+    """
+    Conservative rating for MMR display, which also works on columns in SQL queries
+    """
+    return 20 * (mu - 3 * sigma + MU)
+
+
+class RatingEngine(abc.ABC):
+    """
+    Rates games and predicts their outcome, with all values depending on its parameters precomputed once
+
+    All engines share TrueSkill’s gaussian model of a game’s outcome, parametrized by beta, so matchmaking only needs
+    game_base_variance and stays the same whatever engine a server uses. They differ in how they update ratings
+    """
+
+    name = None
+
+    def __init__(self, beta: float = math.sqrt(BETA_SQUARED)):
+        self.beta = beta
+        self.beta_squared = beta * beta
+
+        # Part of the balance denominator coming from the performance variance of the 10 players of a game
+        self.game_base_variance = PARTICIPANTS_PER_GAME * self.beta_squared
+
+    @property
+    @abc.abstractmethod
+    def settings(self) -> dict:
+        """
+        Parameters of the engine, as saved in the server config
+        """
+
+    @abc.abstractmethod
+    def rate(self, mu: np.ndarray, sigma: np.ndarray, blue_won: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Updates ratings of many independent games at once, with one game per row in GAME_COLUMNS order
+        """
+
+    def __repr__(self):
+        parameters = ", ".join(f"{key}={value:g}" for key, value in self.settings.items() if key != "name")
+        return f"{self.__class__.__name__}({parameters})"
+
+
+class TrueSkillEngine(RatingEngine):
+    """
+    TrueSkill, with the closed form of the factor graph trueskill.rate() uses for two teams
+
+    It gives the same ratings as trueskill.rate() with an environment of the same parameters
+    """
+
+    name = "trueskill"
+
+    def __init__(
+        self,
+        beta: float = math.sqrt(BETA_SQUARED),
+        tau: float = SIGMA / 100,
+        draw_probability: float = trueskill.DRAW_PROBABILITY,
+    ):
+        super().__init__(beta)
+
+        self.tau = tau
+        self.draw_probability = draw_probability
+
+        self.env = trueskill.TrueSkill(
+            mu=MU, sigma=SIGMA, beta=beta, tau=tau, draw_probability=draw_probability
+        )
+
+        self.tau_squared = tau * tau
+        self.draw_margin = trueskill.calc_draw_margin(draw_probability, PARTICIPANTS_PER_GAME, self.env)
+
+    @property
+    def settings(self) -> dict:
+        return {
+            "name": self.name,
+            "beta": self.beta,
+            "tau": self.tau,
+            "draw_probability": self.draw_probability,
+        }
+
+    def rate(self, mu: np.ndarray, sigma: np.ndarray, blue_won: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        # +1 for participants of the winning team and -1 for the losing one
+        signs = _SIDE_SIGNS * np.where(blue_won, 1.0, -1.0)[:, np.newaxis]
+
+        # Ratings get a bit more uncertain before every game
+        sigma_squared = sigma ** 2 + self.tau_squared
+
+        c = np.sqrt((sigma_squared + self.beta_squared).sum(axis=1, keepdims=True))
+
+        x = (signs * mu).sum(axis=1, keepdims=True) / c - self.draw_margin / c
+
+        # Same V and W functions as TrueSkill.v_win and TrueSkill.w_win
+        denominator = cdf_array(x)
+        pdf = np.exp(-(x ** 2) / 2) / math.sqrt(2 * math.pi)
+        v = np.where(denominator > 0, pdf / np.where(denominator > 0, denominator, 1), -x)
+        w = v * (v + x)
+
+        new_mu = mu + signs * sigma_squared / c * v
+        new_sigma = np.sqrt(sigma_squared * (1 - sigma_squared / c ** 2 * w))
+
+        return new_mu, new_sigma
+
+
+class EloEngine(RatingEngine):
+    """
+    Team Elo with a Glicko-like uncertainty, a lot cheaper than TrueSkill and easier to explain to players
+
+    Each player moves by k_factor * (result - expected result), scaled by their relative uncertainty, and their
+    sigma shrinks by sigma_decay after every game until it reaches min_sigma
+    """
+
+    name = "elo"
+
+    def __init__(
+        self,
+        beta: float = math.sqrt(BETA_SQUARED),
+        k_factor: float = 4.0,
+        sigma_decay: float = 0.95,
+        min_sigma: float = 2.0,
+    ):
+        super().__init__(beta)
+
+        self.k_factor = k_factor
+        self.sigma_decay = sigma_decay
+        self.min_sigma = min_sigma
+
+    @property
+    def settings(self) -> dict:
+        return {
+            "name": self.name,
+            "beta": self.beta,
+            "k_factor": self.k_factor,
+            "sigma_decay": self.sigma_decay,
+            "min_sigma": self.min_sigma,
+        }
+
+    def rate(self, mu: np.ndarray, sigma: np.ndarray, blue_won: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        delta_mu = (_SIDE_SIGNS * mu).sum(axis=1, keepdims=True)
+        variance = self.game_base_variance + (sigma ** 2).sum(axis=1, keepdims=True)
+
+        blue_surprise = np.where(blue_won, 1.0, 0.0)[:, np.newaxis] - cdf_array(delta_mu / np.sqrt(variance))
+
+        new_mu = mu + _SIDE_SIGNS * self.k_factor * sigma / SIGMA * blue_surprise
+        new_sigma = np.maximum(sigma * self.sigma_decay, np.minimum(sigma, self.min_sigma))
+
+        return new_mu, new_sigma
+
+
+rating_engine_classes = {engine.name: engine for engine in (TrueSkillEngine, EloEngine)}
+
+# Used by servers that never chose an engine, which gives the ratings the bot always had
+DEFAULT_RATING_ENGINE = TrueSkillEngine()
+
+# Engines are only created once per distinct settings, and servers only look their settings up once
+_engines_by_settings: Dict[tuple, RatingEngine] = {}
+_server_engines: Dict[int, RatingEngine] = {}
+
+
+def make_rating_engine(settings: Optional[dict]) -> RatingEngine:
+    """
+    Returns the engine for the given settings, as saved in the server config
+
+    Raises ValueError for an unknown engine and TypeError for unknown parameters
+    """
+    if not settings:
+        return DEFAULT_RATING_ENGINE
+
+    key = tuple(sorted(settings.items()))
+
+    if key not in _engines_by_settings:
+        parameters = dict(settings)
+        name = parameters.pop("name", TrueSkillEngine.name)
+
+        if name not in rating_engine_classes:
+            raise ValueError(f"Unknown rating engine {name}")
+
+        engine = rating_engine_classes[name](**parameters)
+
+        # Saved settings include default parameters, and should give back the same engine
+        saved_key = tuple(sorted(engine.settings.items()))
+        _engines_by_settings[key] = _engines_by_settings.setdefault(saved_key, engine)
+
+    return _engines_by_settings[key]
+
+
+def get_rating_engine(server_id: Optional[int], session=None) -> RatingEngine:
+    """
+    Returns the rating engine of the server, the database only being queried the first time
+
+    Functions already in a session can give it, so no other session is opened. Coroutines should await
+    preload_rating_engine first, so this only reads memory
+    """
+    if server_id is None:
+        return DEFAULT_RATING_ENGINE
+
+    if server_id not in _server_engines:
+        if session is None:
+            with session_scope() as session:
+                return get_rating_engine(server_id, session)
+
+        _server_engines[server_id] = make_rating_engine(query_rating_engine_settings(session, server_id))
+
+    return _server_engines[server_id]
+
+
+async def preload_rating_engine(server_id: Optional[int]):
+    """
+    Loads the rating engine of the server through the async engine if needed
+    """
+    if server_id is not None and server_id not in _server_engines:
+        settings = await run_in_session(query_rating_engine_settings, server_id)
+
+        # set_rating_engine could have been called while we were waiting
+        _server_engines.setdefault(server_id, make_rating_engine(settings))
+
+
+def query_rating_engine_settings(session, server_id: int) -> Optional[dict]:
+    config = session.query(ServerConfig.config).filter(ServerConfig.server_id == server_id).scalar() or {}
+
+    return config.get(RATING_ENGINE_CONFIG_KEY)
+
+
+def set_rating_engine(server_id: int, settings: Optional[dict]) -> RatingEngine:
+    """
+    Saves the engine settings in the server config, None going back to the default engine
+
+    Existing ratings are not changed, which is done by recomputing the server’s ratings
+    """
+    # We create the engine first to not save invalid settings
+    engine = make_rating_engine(settings)
+
+    with session_scope() as session:
+        save_rating_engine_settings(session, server_id, engine.settings if settings else None)
+
+    _use_rating_engine(server_id, engine)
+
+    return engine
+
+
+async def set_rating_engine_async(server_id: int, settings: Optional[dict]) -> RatingEngine:
+    """
+    Same as set_rating_engine, through the async engine
+    """
+    engine = make_rating_engine(settings)
+
+    await run_in_session(save_rating_engine_settings, server_id, engine.settings if settings else None)
+
+    _use_rating_engine(server_id, engine)
+
+    return engine
+
+
+def save_rating_engine_settings(session, server_id: int, settings: Optional[dict]):
+    server_config = get_server_config(server_id=server_id, session=session)
+
+    if settings:
+        server_config.config[RATING_ENGINE_CONFIG_KEY] = settings
+    else:
+        server_config.config.pop(RATING_ENGINE_CONFIG_KEY, None)
+
+
+def _use_rating_engine(server_id: int, engine: RatingEngine):
+    _server_engines[server_id] = engine
+    invalidate_server_config(server_id)
+
+    # Cached matchmaking results used the previous engine, and the cache needs this module to be imported first
+    from inhouse_bot.matchmaking_logic.matchmaking_cache import matchmaking_cache
+
+    matchmaking_cache.invalidate()
@@ -0,0 +1,407 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import func
+
+from inhouse_bot.common_utils.constants import MATCHMAKING_WORKERS
+from inhouse_bot.common_utils.fields import roles_list
+from inhouse_bot.database_orm import session_scope, Game, GameParticipant, PlayerRating
+from inhouse_bot.game_queue.rating_cache import rating_cache
+from inhouse_bot.matchmaking_logic.evaluate_game import evaluate_ratings_array
+from inhouse_bot.matchmaking_logic.matchmaking_cache import matchmaking_cache
+from inhouse_bot.matchmaking_logic.rating_engines import (
+    MU,
+    SIGMA,
+    GAME_COLUMNS,
+    PARTICIPANTS_PER_GAME,
+    RatingEngine,
+    DEFAULT_RATING_ENGINE,
+    get_rating_engine,
+)
+
+
+def schedule_games(rating_indices: np.ndarray, ratings_count: int) -> np.ndarray:
+    """
+    Returns the wave of each game, games of the same wave having no rating in common
+
+    Every game comes in a later wave than the previous games of its participants, so replaying waves in order gives
+    the same result as replaying games one by one
+    """
+    ratings_wave = [0] * ratings_count
+    waves = []
+
+    for row in rating_indices.tolist():
+        wave = max(ratings_wave[rating_index] for rating_index in row) + 1
+
+        for rating_index in row:
+            ratings_wave[rating_index] = wave
+
+        waves.append(wave)
+
+    return np.array(waves, dtype=np.int64)
+
+
+def replay_ratings(
+    rating_indices: np.ndarray,
+    blue_won: np.ndarray,
+    ratings_count: int,
+    scored: Optional[np.ndarray] = None,
+    engine: RatingEngine = DEFAULT_RATING_ENGINE,
+    initial_mu: Optional[np.ndarray] = None,
+    initial_sigma: Optional[np.ndarray] = None,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Replays games and returns (pre_game_mu, pre_game_sigma, mu, sigma)
+
+    Args:
+        rating_indices: (games, 10) array of the index of each participant’s rating, games in chronological order
+        blue_won: (games,) boolean array
+        ratings_count: size of the ratings arrays
+        scored: (games,) boolean array, games without a winner get pre-game ratings but do not change them
+        engine: rating engine used to update ratings after each game
+        initial_mu: (ratings_count,) ratings before the first game, defaults to MU
+        initial_sigma: (ratings_count,) ratings before the first game, defaults to SIGMA
+    """
+    if scored is None:
+        scored = np.ones(len(rating_indices), dtype=bool)
+
+    mu = np.full(ratings_count, MU) if initial_mu is None else np.array(initial_mu, dtype=float)
+    sigma = np.full(ratings_count, SIGMA) if initial_sigma is None else np.array(initial_sigma, dtype=float)
+
+    pre_game_mu = np.empty(rating_indices.shape)
+    pre_game_sigma = np.empty(rating_indices.shape)
+
+    waves = schedule_games(rating_indices, ratings_count)
+
+    # Games sorted by wave, each wave being a contiguous block of independent games
+    games_order = np.argsort(waves, kind="stable")
+    wave_starts = np.flatnonzero(np.diff(waves[games_order], prepend=0))
+
+    for games in np.split(games_order, wave_starts[1:]):
+        indices = rating_indices[games]
+
+        pre_game_mu[games] = mu[indices]
+        pre_game_sigma[games] = sigma[indices]
+
+        new_mu, new_sigma = engine.rate(pre_game_mu[games], pre_game_sigma[games], blue_won[games])
+
+        # A rating only appears once per wave, so we can scatter the new values directly
+        scored_games = scored[games]
+        mu[indices[scored_games]] = new_mu[scored_games]
+        sigma[indices[scored_games]] = new_sigma[scored_games]
+
+    return pre_game_mu, pre_game_sigma, mu, sigma
+
+
+@dataclass
+class ServerReplay:
+    """
+    New ratings of a server, in a columnar form that is cheap to send back from a worker process
+    """
+
+    server_id: int
+
+    # Ratings, as (player_id, role) with their new mu and sigma
+    player_ids: np.ndarray
+    roles: List[str]
+    mu: np.ndarray
+    sigma: np.ndarray
+
+    # Games in chronological order, with pre-game ratings in GAME_COLUMNS order
+    game_ids: np.ndarray
+    pre_game_mu: np.ndarray
+    pre_game_sigma: np.ndarray
+    blue_expected_winrates: np.ndarray
+
+    scored_games_count: int
+
+    @property
+    def games_state(self) -> Optional[Tuple[int, int, int]]:
+        """
+        (games count, scored games count, last game id) of the replayed games, None if there were no games
+        """
+        if not len(self.game_ids):
+            return None
+
+        return len(self.game_ids), self.scored_games_count, int(self.game_ids.max())
+
+    @property
+    def ratings(self) -> Dict[Tuple[int, str], Tuple[float, float]]:
+        """
+        (player_id, role) -> new (mu, sigma), as stored in the rating cache
+        """
+        keys = zip(self.player_ids.tolist(), self.roles)
+        return dict(zip(keys, zip(self.mu.tolist(), self.sigma.tolist())))
+
+
+def replay_server(server_id: int) -> ServerReplay:
+    """
+    Loads all games of the server and replays them in chronological order, without writing anything
+
+    This only needs the server id so it can run in a worker process
+    """
+    with session_scope() as session:
+        return load_server_replay(session, server_id)
+
+
+def load_server_replay(session, server_id: int) -> ServerReplay:
+    """
+    Same as replay_server, in the given session
+    """
+    # We only load the columns we need, in the order games were played
+    participants_query = (
+        session.query(
+            GameParticipant.game_id,
+            GameParticipant.side,
+            GameParticipant.role,
+            GameParticipant.player_id,
+            Game.winner,
+        )
+        .join(Game)
+        .filter(Game.server_id == server_id)
+        .order_by(Game.start, Game.id)
+        .yield_per(10000)
+    )
+
+    # (player_id, role) -> index in the ratings arrays
+    ratings_index = {}
+
+    game_ids: List[int] = []
+    winners: List[Optional[str]] = []
+    rows: List[List[int]] = []
+
+    for game_id, side, role, player_id, winner in participants_query:
+        if not game_ids or game_ids[-1] != game_id:
+            game_ids.append(game_id)
+            winners.append(winner)
+            rows.append([0] * PARTICIPANTS_PER_GAME)
+
+        rating_index = ratings_index.setdefault((player_id, role), len(ratings_index))
+        rows[-1][GAME_COLUMNS.index((side, role))] = rating_index
+
+    return replay_games(server_id, ratings_index, game_ids, rows, winners)
+
+
+def replay_games(
+    server_id: int,
+    ratings_index: Dict[Tuple[int, str], int],
+    game_ids: List[int],
+    rows: List[List[int]],
+    winners: List[Optional[str]],
+    initial_mu: Optional[List[float]] = None,
+    initial_sigma: Optional[List[float]] = None,
+) -> ServerReplay:
+    """
+    Replays the games of a server given as rows of indices in ratings_index, in GAME_COLUMNS order
+
+    Ratings start from initial_mu and initial_sigma if given, and from default values otherwise
+    They are updated with the rating engine of the server
+    """
+    engine = get_rating_engine(server_id)
+
+    rating_indices = np.array(rows, dtype=np.int64).reshape(-1, PARTICIPANTS_PER_GAME)
+    scored = np.array([winner is not None for winner in winners], dtype=bool)
+
+    pre_game_mu, pre_game_sigma, mu, sigma = replay_ratings(
+        rating_indices,
+        blue_won=np.array([winner == "BLUE" for winner in winners], dtype=bool),
+        ratings_count=len(ratings_index),
+        scored=scored,
+        engine=engine,
+        initial_mu=initial_mu,
+        initial_sigma=initial_sigma,
+    )
+
+    return ServerReplay(
+        server_id=server_id,
+        player_ids=np.array([player_id for player_id, role in ratings_index], dtype=np.int64),
+        roles=[role for player_id, role in ratings_index],
+        mu=mu,
+        sigma=sigma,
+        game_ids=np.array(game_ids, dtype=np.int64),
+        pre_game_mu=pre_game_mu,
+        pre_game_sigma=pre_game_sigma,
+        blue_expected_winrates=evaluate_ratings_array(
+            pre_game_mu[:, : len(roles_list)],
+            pre_game_sigma[:, : len(roles_list)],
+            pre_game_mu[:, len(roles_list) :],
+            pre_game_sigma[:, len(roles_list) :],
+            engine.beta_squared,
+        ),
+        scored_games_count=int(scored.sum()),
+    )
+
+
+def lock_server_ratings(session, server_ids: List[int]):
+    """
+    Locks the ratings of the servers until the end of the session’s transaction
+
+    Everything that writes ratings takes this lock first, so a replay can read games and write their results without
+    a game getting scored in between. Servers are locked in order to avoid deadlocks
+    """
+    for server_id in sorted(server_ids):
+        session.execute("SELECT pg_advisory_xact_lock(:server_id)", {"server_id": server_id})
+
+
+def query_games_state(session, server_ids: List[int]) -> Dict[int, Tuple[int, int, int]]:
+    """
+    Returns server_id -> (games count, scored games count, last game id), like ServerReplay.games_state
+
+    Servers without games are not part of the result
+    """
+    query = (
+        session.query(Game.server_id, func.count(Game.id), func.count(Game.winner), func.max(Game.id))
+        .filter(Game.server_id.in_(server_ids))
+        .group_by(Game.server_id)
+    )
+
+    return {server_id: tuple(games_state) for server_id, *games_state in query}
+
+
+def write_replays(session, replays: List[ServerReplay], reset_ratings: bool = True):
+    """
+    Writes the new ratings of all servers with a single UPDATE statement per table
+
+    If reset_ratings is True, ratings of the servers’ players that are not part of the replays go back to their
+    default values, which is what we want when all the games of the servers were replayed
+    """
+    if not replays:
+        return
+
+    if reset_ratings:
+        session.query(PlayerRating).filter(
+            PlayerRating.player_server_id.in_([replay.server_id for replay in replays])
+        ).update({"trueskill_mu": MU, "trueskill_sigma": SIGMA}, synchronize_session=False)
+
+    # Values are sent as arrays, which Postgres then joins to the table, and unchanged games are skipped
+    session.execute(
+        "UPDATE player_rating SET trueskill_mu = v.mu, trueskill_sigma = v.sigma "
+        "FROM unnest(:player_ids, :server_ids, CAST(:roles AS role_enum[]), :mu, :sigma) "
+        "AS v (player_id, server_id, role, mu, sigma) "
+        "WHERE player_rating.player_id = v.player_id AND player_rating.player_server_id = v.server_id "
+        "AND player_rating.role = v.role",
+        {
+            "player_ids": np.concatenate([replay.player_ids for replay in replays]).tolist(),
+            "server_ids": [replay.server_id for replay in replays for _ in replay.roles],
+            "roles": [role for replay in replays for role in replay.roles],
+            "mu": np.concatenate([replay.mu for replay in replays]).tolist(),
+            "sigma": np.concatenate([replay.sigma for replay in replays]).tolist(),
+        },
+    )
+
+    games_count = sum(len(replay.game_ids) for replay in replays)
+
+    session.execute(
+        "UPDATE game_participant SET trueskill_mu = v.mu, trueskill_sigma = v.sigma "
+        "FROM unnest(:game_ids, CAST(:sides AS team_enum[]), CAST(:roles AS role_enum[]), :mu, :sigma) "
+        "AS v (game_id, side, role, mu, sigma) "
+        "WHERE game_participant.game_id = v.game_id AND game_participant.side = v.side "
+        "AND game_participant.role = v.role "
+        "AND (game_participant.trueskill_mu, game_participant.trueskill_sigma) "
+        "IS DISTINCT FROM (v.mu, v.sigma)",
+        {
+            "game_ids": np.repeat(
+                np.concatenate([replay.game_ids for replay in replays]), PARTICIPANTS_PER_GAME
+            ).tolist(),
+            "sides": [side for side, role in GAME_COLUMNS] * games_count,
+            "roles": [role for side, role in GAME_COLUMNS] * games_count,
+            "mu": np.concatenate([replay.pre_game_mu.ravel() for replay in replays]).tolist(),
+            "sigma": np.concatenate([replay.pre_game_sigma.ravel() for replay in replays]).tolist(),
+        },
+    )
+
+    session.execute(
+        "UPDATE game SET blue_expected_winrate = v.winrate "
+        "FROM unnest(:game_ids, :winrates) AS v (id, winrate) "
+        "WHERE game.id = v.id AND game.blue_expected_winrate IS DISTINCT FROM v.winrate",
+        {
+            "game_ids": np.concatenate([replay.game_ids for replay in replays]).tolist(),
+            "winrates": np.concatenate([replay.blue_expected_winrates for replay in replays]).tolist(),
+        },
+    )
+
+
+def recompute_ratings(server_id: int) -> int:
+    """
+    Recomputes all ratings of the server by replaying all its games in chronological order
+
+    Pre-game ratings and expected winrates of past games are updated too, and ratings of players without any scored
+    game go back to default values
+    Returns the number of scored games that were replayed, servers without games being left untouched
+    """
+    with session_scope() as session:
+        # Games cannot get scored between the replay and its write
+        lock_server_ratings(session, [server_id])
+
+        replay = load_server_replay(session, server_id)
+
+        if not len(replay.game_ids):
+            return 0
+
+        write_replays(session, [replay])
+
+    # Players without any game went back to default ratings, so we let the cache reload the whole server
+    rating_cache.invalidate(server_id)
+
+    # Cached matchmaking results used the previous ratings
+    matchmaking_cache.invalidate()
+
+    return replay.scored_games_count
+
+
+def write_latest_replays(replays: List[ServerReplay]) -> List[ServerReplay]:
+    """
+    Writes replays made outside of the writing transaction, in a single transaction
+
+    Servers whose games changed since their replay are replayed again once their ratings are locked, and servers
+    without games are skipped
+    Returns the replays that were written
+    """
+    with session_scope() as session:
+        lock_server_ratings(session, [replay.server_id for replay in replays])
+
+        games_states = query_games_state(session, [replay.server_id for replay in replays])
+
+        replays = [
+            replay
+            if replay.games_state == games_states.get(replay.server_id)
+            else load_server_replay(session, replay.server_id)
+            for replay in replays
+        ]
+
+        replays = [replay for replay in replays if len(replay.game_ids)]
+
+        write_replays(session, replays)
+
+    return replays
+
+
+def recompute_all_ratings(max_workers: Optional[int] = MATCHMAKING_WORKERS) -> Dict[int, int]:
+    """
+    Recomputes the ratings of every server, each server being replayed in its own worker process
+
+    Ratings are partitioned by server, so servers can be replayed in any order. All results are then written in a
+    single transaction
+    Returns the number of scored games replayed per server
+    """
+    with session_scope() as session:
+        server_ids = [server_id for (server_id,) in session.query(Game.server_id).distinct()]
+
+    if not server_ids:
+        return {}
+
+    # Spawning makes sure workers do not inherit the bot’s threads and database connections
+    pool = ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn"))
+
+    with pool:
+        replays = list(pool.map(replay_server, server_ids))
+
+    replays = write_latest_replays(replays)
+
+    rating_cache.invalidate()
+    matchmaking_cache.invalidate()
+
+    return {replay.server_id: replay.scored_games_count for replay in replays}
@@ -1,40 +1,44 @@
-import trueskill
+from typing import Dict, List, Tuple
 
-from inhouse_bot.database_orm import session_scope
+import numpy as np
+from sqlalchemy.orm import joinedload
+
+from inhouse_bot.database_orm import session_scope, run_in_session
 from inhouse_bot.database_orm import Game
 from inhouse_bot.common_utils.get_last_game import get_last_game
+from inhouse_bot.game_queue.rating_cache import rating_cache
+from inhouse_bot.matchmaking_logic.matchmaking_cache import matchmaking_cache
+from inhouse_bot.matchmaking_logic.rating_engines import GAME_COLUMNS, get_rating_engine
+from inhouse_bot.matchmaking_logic.rating_replay import lock_server_ratings, replay_games, write_replays
 
 
-def update_trueskill(game: Game, session):
+def update_ratings(game: Game, session) -> Dict[Tuple[int, str], Tuple[float, float]]:
     """
-    Updates the player’s rating based on the game’s result
+    Updates the players’ ratings based on the game’s result, with the rating engine of the server
+
+    Returns the new (mu, sigma) of each (player_id, role), to be written to the rating cache after the commit
     """
-    blue_team_ratings = {
-        participant.player.ratings[participant.role]: trueskill.Rating(
-            mu=participant.trueskill_mu, sigma=participant.trueskill_sigma
-        )
-        for participant in game.teams.BLUE
-    }
+    participants = [game.participants[side, role] for side, role in GAME_COLUMNS]
 
-    red_team_ratings = {
-        participant.player.ratings[participant.role]: trueskill.Rating(
-            mu=participant.trueskill_mu, sigma=participant.trueskill_sigma
-        )
-        for participant in game.teams.RED
-    }
+    new_mu, new_sigma = get_rating_engine(game.server_id, session).rate(
+        np.array([[participant.trueskill_mu for participant in participants]]),
+        np.array([[participant.trueskill_sigma for participant in participants]]),
+        np.array([game.winner == "BLUE"]),
+    )
+
+    new_ratings = {}
+
+    for participant, mu, sigma in zip(participants, new_mu[0].tolist(), new_sigma[0].tolist()):
+        player_rating = participant.player.ratings[participant.role]
 
-    if game.winner == "BLUE":
-        new_ratings = trueskill.rate([blue_team_ratings, red_team_ratings])
-    else:
-        new_ratings = trueskill.rate([red_team_ratings, blue_team_ratings])
+        player_rating.trueskill_mu = mu
+        player_rating.trueskill_sigma = sigma
 
-    for ratings in new_ratings:
-        for player_rating in ratings:
-            # This is the PlayerRating object
-            player_rating.trueskill_mu = ratings[player_rating].mu
-            player_rating.trueskill_sigma = ratings[player_rating].sigma
+        session.merge(player_rating)
 
-            session.merge(player_rating)
+        new_ratings[participant.player_id, participant.role] = (mu, sigma)
+
+    return new_ratings
 
 
 def score_game_from_winning_player(player_id: int, server_id: int):
@@ -42,10 +46,102 @@ def score_game_from_winning_player(player_id: int, server_id: int):
     Scores the last game of the player on the server as a *win*
     """
     with session_scope() as session:
-        game, participant = get_last_game(player_id, server_id, session)
+        new_ratings = score_last_game(session, player_id, server_id)
 
-        game.winner = participant.side
+        # Commit will happen here
 
-        update_trueskill(game, session)
+    _cache_ratings(server_id, new_ratings)
 
-        # Commit will happen here
+
+async def score_game_from_winning_player_async(player_id: int, server_id: int):
+    """
+    Same as score_game_from_winning_player, through the async engine
+    """
+    new_ratings = await run_in_session(score_last_game, player_id, server_id)
+
+    _cache_ratings(server_id, new_ratings)
+
+
+def score_last_game(session, player_id: int, server_id: int) -> Dict[Tuple[int, str], Tuple[float, float]]:
+    # A replay running at the same time would otherwise overwrite this game’s result
+    lock_server_ratings(session, [server_id])
+
+    game, participant = get_last_game(player_id, server_id, session)
+
+    game.winner = participant.side
+
+    return update_ratings(game, session)
+
+
+def _cache_ratings(server_id: int, new_ratings: Dict[Tuple[int, str], Tuple[float, float]]):
+    rating_cache.update(server_id, new_ratings)
+
+    # Cached matchmaking results used the previous ratings
+    matchmaking_cache.invalidate()
+
+
+def score_games(server_id: int, winners: Dict[int, str]) -> List[int]:
+    """
+    Scores multiple games of the server at once, winners being a game_id -> winning side dictionary
+
+    Games are scored in chronological order in a single session, a player’s rating after a game being used as his
+    pre-game rating in his next one, and ratings are written with one statement at the end
+    Games that do not exist on the server or are already scored are skipped
+    Returns the ids of the scored games
+    """
+    with session_scope() as session:
+        lock_server_ratings(session, [server_id])
+
+        games = (
+            session.query(Game)
+            .options(joinedload(Game.participants))
+            .filter(Game.server_id == server_id)
+            .filter(Game.id.in_(list(winners)))
+            .filter(Game.winner.is_(None))
+            .order_by(Game.start, Game.id)
+            .all()
+        )
+
+        if not games:
+            return []
+
+        # (player_id, role) -> index in the ratings arrays
+        ratings_index = {}
+        initial_mu, initial_sigma = [], []
+        rows = []
+
+        for game in games:
+            game.winner = winners[game.id]
+
+            rows.append([])
+            for side, role in GAME_COLUMNS:
+                participant = game.participants[side, role]
+
+                # Ratings start from the pre-game values of their first game, like when scoring games one by one
+                if (participant.player_id, role) not in ratings_index:
+                    ratings_index[participant.player_id, role] = len(ratings_index)
+                    initial_mu.append(participant.trueskill_mu)
+                    initial_sigma.append(participant.trueskill_sigma)
+
+                rows[-1].append(ratings_index[participant.player_id, role])
+
+        replay = replay_games(
+            server_id,
+            ratings_index,
+            [game.id for game in games],
+            rows,
+            [game.winner for game in games],
+            initial_mu,
+            initial_sigma,
+        )
+
+        write_replays(session, [replay], reset_ratings=False)
+
+        scored_game_ids = [game.id for game in games]
+
+    rating_cache.update(server_id, replay.ratings)
+
+    # Cached matchmaking results used the previous ratings
+    matchmaking_cache.invalidate()
+
+    return scored_game_ids
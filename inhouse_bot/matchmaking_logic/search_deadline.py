@@ -0,0 +1,42 @@
+import time
+from typing import Optional
+
+# Cancel flags shared with the matchmaking worker processes, set by the pool initializer in each of them
+_cancel_flags = None
+
+
+def set_cancel_flags(cancel_flags):
+    """
+    Pool initializer giving the worker process access to the cancel flags of the searches
+    """
+    global _cancel_flags
+    _cancel_flags = cancel_flags
+
+
+class SearchDeadline:
+    """
+    Wall-clock deadline shared by the matchmaking engines, which stop and return their best composition once it
+    is reached
+
+    It is based on time.monotonic(), which is system-wide, so a deadline created in the bot’s process stays valid
+    in matchmaking worker processes
+
+    If cancel_slot is given, the deadline also expires as soon as the bot sets this slot of the cancel flags, which
+    is how a search that got cancelled or timed out frees its worker
+    """
+
+    def __init__(self, time_budget: float, cancel_slot: Optional[int] = None):
+        self.end = time.monotonic() + time_budget
+        self.cancel_slot = cancel_slot
+
+        # Set to True once an engine got stopped by the deadline, which means the search was not exhaustive
+        self.reached = False
+
+    def expired(self) -> bool:
+        if time.monotonic() >= self.end or self.cancelled():
+            self.reached = True
+
+        return self.reached
+
+    def cancelled(self) -> bool:
+        return self.cancel_slot is not None and _cancel_flags is not None and _cancel_flags[self.cancel_slot]
@@ -0,0 +1,200 @@
+import itertools
+from typing import Iterator, List, Optional
+
+import numpy as np
+
+from inhouse_bot.common_utils.fields import roles_list
+from inhouse_bot.matchmaking_logic.candidate_game import CandidateGame, CandidateHeap
+from inhouse_bot.matchmaking_logic.packed_queue import PackedQueue, NO_DUO
+from inhouse_bot.matchmaking_logic.search_deadline import SearchDeadline
+
+# Maximum number of team compositions scored in a single NumPy operation, which bounds memory usage
+BATCH_SIZE = 2 ** 20
+
+# If a game is below 51% winrate for one side, we simply stop there (helps with big lists)
+GOOD_ENOUGH_SCORE = 0.01
+
+
+def _expand(values: np.ndarray, axis: int) -> np.ndarray:
+    """
+    Reshapes a per-role 1D array so it broadcasts along its role axis
+    """
+    shape = [1] * len(roles_list)
+    shape[axis] = -1
+    return values.reshape(shape)
+
+
+def _sides(pair_values: np.ndarray, value: int) -> np.ndarray:
+    """
+    For each (blue, red) pair, returns 1 if value is blue, -1 if it is red, and 0 if it is not in the pair
+    """
+    return (pair_values[:, 0] == value).astype(np.int8) - (pair_values[:, 1] == value).astype(np.int8)
+
+
+class CompositionConstraints:
+    """
+    Player unicity and duo constraints, expressed on the per-role pairs arrays
+
+    A player queuing for multiple roles can only be picked once, and a player with a duo can only be picked if his
+    duo is picked in the same team
+    """
+
+    def __init__(self, packed_queue: PackedQueue, pairs: List[np.ndarray]):
+        pair_player_ids = [packed_queue.player_ids[role_pairs] for role_pairs in pairs]
+
+        # (role_a, role_b, conflict matrix) for roles that share at least one player
+        self.conflicts = []
+
+        for role_a, role_b in itertools.combinations(range(len(roles_list)), 2):
+            if not np.intersect1d(pair_player_ids[role_a], pair_player_ids[role_b]).size:
+                continue
+
+            conflict = (
+                pair_player_ids[role_a][:, :, None, None] == pair_player_ids[role_b][None, None, :, :]
+            ).any(axis=(1, 3))
+
+            self.conflicts.append((role_a, role_b, conflict))
+
+        # (role, row sides, [(role, duo sides)]) for each row that has a duo
+        self.duos = []
+
+        for row in np.flatnonzero(packed_queue.duo_ids != NO_DUO):
+            role = int(packed_queue.roles[row])
+
+            duo_sides = [
+                (duo_role, sides)
+                for duo_role, sides in enumerate(
+                    _sides(role_player_ids, packed_queue.duo_ids[row]) for role_player_ids in pair_player_ids
+                )
+                if sides.any()
+            ]
+
+            self.duos.append((role, _sides(pairs[role], row), duo_sides))
+
+    def valid_mask(self, selection: List[np.ndarray]) -> Optional[np.ndarray]:
+        """
+        Returns a boolean array broadcastable to the block shape, or None if every composition is valid
+        """
+        valid = None
+
+        for role_a, role_b, conflict in self.conflicts:
+            shape = [1] * len(roles_list)
+            shape[role_a], shape[role_b] = len(selection[role_a]), len(selection[role_b])
+
+            block_valid = ~conflict[np.ix_(selection[role_a], selection[role_b])].reshape(shape)
+            valid = block_valid if valid is None else valid & block_valid
+
+        for role, row_sides, duo_sides in self.duos:
+            side = _expand(row_sides[selection[role]], role)
+            duo_side = sum(_expand(sides[selection[duo_role]], duo_role) for duo_role, sides in duo_sides)
+
+            # Either the player is not in the game, or his duo is on the same side
+            block_valid = (side == 0) | (side == duo_side)
+            valid = block_valid if valid is None else valid & block_valid
+
+        return valid
+
+
+def _iter_blocks(sizes: List[int]) -> Iterator[List[np.ndarray]]:
+    """
+    Splits the product of the per-role pairs in blocks of at most BATCH_SIZE compositions
+
+    Blocks are yielded in the same order as itertools.product, so older players are still tried first
+    """
+    # We keep as many roles as possible fully inside a block
+    tail_start, tail_size = len(sizes), 1
+    while tail_start > 0 and tail_size * sizes[tail_start - 1] <= BATCH_SIZE:
+        tail_start -= 1
+        tail_size *= sizes[tail_start]
+
+    tail = [np.arange(size) for size in sizes[tail_start:]]
+
+    if tail_start == 0:
+        yield tail
+        return
+
+    # The last role outside of the tail is cut in chunks that fill the rest of the block
+    chunk_role = tail_start - 1
+    chunk_size = max(1, BATCH_SIZE // tail_size)
+    chunks = [
+        np.arange(start, min(start + chunk_size, sizes[chunk_role]))
+        for start in range(0, sizes[chunk_role], chunk_size)
+    ]
+
+    for head in itertools.product(*(range(size) for size in sizes[:chunk_role])):
+        for chunk in chunks:
+            yield [np.array([idx]) for idx in head] + [chunk] + tail
+
+
+def find_best_composition(
+    packed_queue: PackedQueue,
+    required_row: Optional[int] = None,
+    candidates: Optional[CandidateHeap] = None,
+    deadline: Optional[SearchDeadline] = None,
+) -> Optional[CandidateGame]:
+    """
+    Scores every possible team composition with NumPy and returns the best one
+
+    The best compositions are pushed to candidates, which only keeps the ones beating its worst candidate
+    If required_row is given, only compositions including this row are scored
+    If deadline is given, the search stops after the block during which it expired
+    """
+    if candidates is None:
+        candidates = CandidateHeap()
+
+    pairs = [packed_queue.role_pairs(role_idx, required_row) for role_idx in range(len(roles_list))]
+
+    if any(not len(role_pairs) for role_pairs in pairs):
+        return candidates.best()
+
+    # Those are the only per-composition values needed to get the expected winrate
+    sigma_squared = packed_queue.sigma ** 2
+    delta_mu = [packed_queue.mu[p[:, 0]] - packed_queue.mu[p[:, 1]] for p in pairs]
+    sum_sigma_squared = [sigma_squared[p[:, 0]] + sigma_squared[p[:, 1]] for p in pairs]
+
+    constraints = CompositionConstraints(packed_queue, pairs)
+
+    # Mirrored compositions are both scored here, so we look at twice as many compositions per block as we keep
+    top_count = 2 * candidates.size
+
+    # Same closed form as evaluate_game: the blue side winrate is cdf(delta_mu / sqrt(size * BETA² + sum_sigma))
+    #   As cdf is monotonic and symmetric, the best game is the one with the lowest |delta_mu / denominator|
+    for selection in _iter_blocks([len(role_pairs) for role_pairs in pairs]):
+        delta = sum(_expand(delta_mu[role][idx], role) for role, idx in enumerate(selection))
+        variance = packed_queue.game_base_variance + sum(
+            _expand(sum_sigma_squared[role][idx], role) for role, idx in enumerate(selection)
+        )
+
+        balance = np.abs(delta) / np.sqrt(variance)
+
+        valid = constraints.valid_mask(selection)
+        if valid is not None:
+            balance = np.where(valid, balance, np.inf)
+
+        flat_balance = balance.ravel()
+        candidates.compositions_evaluated += flat_balance.size
+
+        block_top_count = min(top_count, flat_balance.size)
+        top_idx = np.argpartition(flat_balance, block_top_count - 1)[:block_top_count]
+        top_idx = top_idx[flat_balance[top_idx] < candidates.balance_to_beat]
+
+        # Ties are broken by position in the block, which means older players first
+        for flat_idx in top_idx[np.lexsort((top_idx, flat_balance[top_idx]))]:
+            block_idx = np.unravel_index(flat_idx, balance.shape)
+            composition = [pairs[role][idx[block_idx[role]]] for role, idx in enumerate(selection)]
+
+            candidates.push(
+                CandidateGame(
+                    blue_rows=[int(pair[0]) for pair in composition],
+                    red_rows=[int(pair[1]) for pair in composition],
+                    balance=float(flat_balance[flat_idx]),
+                )
+            )
+
+        if candidates.is_good_enough(GOOD_ENOUGH_SCORE):
+            break
+
+        if deadline and deadline.expired():
+            break
+
+    return candidates.best()
@@ -57,15 +57,19 @@ class QueueChannelHandler:
             if self.latest_purge_message_id[msg.channel.id] == msg.id:
                 await msg.channel.purge(check=self.is_not_queue_related_message)
 
-    async def refresh_channel_queue(self, channel: TextChannel, restart: bool):
+    async def refresh_channel_queue(
+        self, channel: TextChannel, restart: bool, queue: Optional[game_queue.GameQueue] = None
+    ):
         """
         Deletes the previous queue message and sends a new one in the channel
 
         If channel is supplied instead of a context (in the case of a bot reboot), send the reboot message instead
+        If the queue of the channel was already loaded, it can be given directly
         """
 
         # Creating the queue visualisation requires getting the Player objects from the DB to have the names
-        queue = game_queue.GameQueue(channel.id)
+        if queue is None:
+            queue = game_queue.GameQueue(channel.id)
 
         # If the new queue is the same as the cache, we simple return
         if queue == self._queue_cache.get(channel.id):
@@ -174,6 +178,13 @@ class QueueChannelHandler:
             restart = False
             channels_to_check = self.get_server_queues(server_id)
 
+        # Queues are built from memory, which is loaded through the async engine first if needed
+        for server in {c.server_id for c in self._queue_channels if c.id in channels_to_check}:
+            await game_queue.preload_server(server)
+
+        # Queues of a server are all loaded at once instead of one channel at a time
+        queues = game_queue.GameQueue.server_queues(server_id, channels_to_check) if server_id else {}
+
         for channel_id in channels_to_check:
             channel = bot.get_channel(channel_id)
 
@@ -181,7 +192,7 @@ class QueueChannelHandler:
                 self.unmark_queue_channel(channel_id)  # We remove it for the future
                 continue
 
-            await self.refresh_channel_queue(channel=channel, restart=restart)
+            await self.refresh_channel_queue(channel=channel, restart=restart, queue=queues.get(channel_id))
 
 
 # This will be an object common to all functions afterwards
@@ -8,6 +8,7 @@ from sqlalchemy import func
 from inhouse_bot.database_orm import (
     ChannelInformation,
     session_scope,
+    run_in_session,
     Player,
     PlayerRating,
     Game,
@@ -68,7 +69,7 @@ class RankingChannelHandler:
             await self.refresh_channel_rankings(channel=channel)
 
     async def refresh_channel_rankings(self, channel: TextChannel):
-        ratings = self.get_server_ratings(channel.guild.id, limit=30)
+        ratings = await self.get_server_ratings(channel.guild.id, limit=30)
 
         # We need 3 messages because of character limits
         source = RankingPagesSource(ratings, embed_name_suffix=f"on {channel.guild.name}")
@@ -85,39 +86,38 @@ class RankingChannelHandler:
         await channel.purge(check=lambda msg: msg.id not in new_msgs_ids)
 
     @staticmethod
-    def get_server_ratings(server_id: int, role: str = None, limit=100):
-        with session_scope() as session:
-            session.expire_on_commit = False
-
-            ratings = (
-                session.query(
-                    Player,
-                    PlayerRating.player_server_id,
-                    PlayerRating.mmr,
-                    PlayerRating.role,
-                    func.count().label("count"),
-                    (
-                        sqlalchemy.func.sum((Game.winner == GameParticipant.side).cast(sqlalchemy.Integer))
-                    ).label(
-                        "wins"
-                    ),  # A bit verbose for sure
-                )
-                .select_from(Player)
-                .join(PlayerRating)
-                .join(GameParticipant)
-                .join(Game)
-                .filter(Player.server_id == server_id)
-                .filter(Game.winner != None)    # No currently running game
-                .group_by(Player, PlayerRating)
-                .order_by(PlayerRating.mmr.desc())
-            )
-
-            if role:
-                ratings = ratings.filter(PlayerRating.role == role)
-
-            ratings = ratings.limit(limit).all()
-
-        return ratings
+    async def get_server_ratings(server_id: int, role: str = None, limit=100):
+        return await run_in_session(query_server_ratings, server_id, role, limit)
+
+
+def query_server_ratings(session, server_id: int, role: str = None, limit=100):
+    ratings = (
+        session.query(
+            Player,
+            PlayerRating.player_server_id,
+            PlayerRating.mmr,
+            PlayerRating.role,
+            func.count().label("count"),
+            (
+                sqlalchemy.func.sum((Game.winner == GameParticipant.side).cast(sqlalchemy.Integer))
+            ).label(
+                "wins"
+            ),  # A bit verbose for sure
+        )
+        .select_from(Player)
+        .join(PlayerRating)
+        .join(GameParticipant)
+        .join(Game)
+        .filter(Player.server_id == server_id)
+        .filter(Game.winner != None)    # No currently running game
+        .group_by(Player, PlayerRating)
+        .order_by(PlayerRating.mmr.desc())
+    )
+
+    if role:
+        ratings = ratings.filter(PlayerRating.role == role)
+
+    return ratings.limit(limit).all()
 
 
 ranking_channel_handler = RankingChannelHandler()
@@ -3,7 +3,7 @@ import discord
 from string import Template
 from discord.ext import commands
 
-from inhouse_bot.common_utils.get_server_config import get_server_config_by_key
+from inhouse_bot.common_utils.get_server_config import get_server_config_by_key_async
 from inhouse_bot.database_orm import Game
 
 VOICE_CATEGORY = os.getenv('VOICE_CATEGORY', '▬▬ Team Voice Chat ▬▬')
@@ -17,7 +17,7 @@ async def create_voice_channels(ctx: commands.Context, game: Game):
     voice channel for all to join
     """
 
-    if not get_server_config_by_key(server_id=ctx.guild.id, key="voice"):
+    if not await get_server_config_by_key_async(server_id=ctx.guild.id, key="voice"):
         return
 
     category = discord.utils.get(ctx.guild.categories, name=VOICE_CATEGORY)
@@ -55,7 +55,7 @@ async def remove_voice_channels(ctx: commands.Context, game: Game):
     Removes all voice channels associated with a game
     """
 
-    if not get_server_config_by_key(server_id=ctx.guild.id, key="voice"):
+    if not await get_server_config_by_key_async(server_id=ctx.guild.id, key="voice"):
         return
 
     for channel in [
@@ -8,6 +8,8 @@ root.setLevel(logging.INFO)
 # For some reason, logging does not pick up the logs without that line
 logging.info("Starting root logger")
 
-bot = InhouseBot()
+# Matchmaking worker processes import this file again, so the bot should only be started from the main process
+if __name__ == "__main__":
+    bot = InhouseBot()
 
-bot.run()
+    bot.run()
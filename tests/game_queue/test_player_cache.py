@@ -0,0 +1,58 @@
+import pytest
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from inhouse_bot.common_utils.fields import roles_list
+from inhouse_bot import game_queue
+from inhouse_bot.game_queue import GameQueue
+from inhouse_bot.game_queue.queue_store import queue_store
+from inhouse_bot.database_orm import session_scope
+from inhouse_bot.matchmaking_logic import find_best_game, score_game_from_winning_player
+
+from inhouse_bot.queue_channel_handler import queue_channel_handler
+
+
+queue_channel_handler.mark_queue_channel(0, 0)
+
+
+def test_player_status():
+    game_queue.reset_queue()
+
+    for player_id in range(0, 10):
+        game_queue.add_player(player_id, roles_list[player_id % 5], 0, 0, name=str(player_id))
+
+    game = find_best_game(GameQueue(0))
+
+    with session_scope() as session:
+        session.add(game)
+
+    game_queue.reset_queue()
+
+    # Creating the game puts its players in game, without any call to the queue functions
+    with pytest.raises(game_queue.PlayerInGame):
+        game_queue.add_player(0, roles_list[0], 0, 0, name="0")
+
+    game_queue.add_player(10, roles_list[0], 0, 0, name="10")
+    queue_store.flush()
+
+    statements = []
+
+    def log_statement(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(Engine, "before_cursor_execute", log_statement)
+
+    try:
+        # Known players queuing again under the same name do not query the database
+        game_queue.add_player(10, roles_list[0], 0, 0, name="10")
+        game_queue.remove_player(10, 0)
+    finally:
+        event.remove(Engine, "before_cursor_execute", log_statement)
+
+    assert not statements
+
+    # Scoring the game lets its players queue again
+    score_game_from_winning_player(0, 0)
+    game_queue.add_player(0, roles_list[0], 0, 0, name="0")
+
+    assert len(GameQueue(0)) == 1
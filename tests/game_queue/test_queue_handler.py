@@ -1,8 +1,11 @@
+import asyncio
+
 import pytest
 
 from inhouse_bot.common_utils.fields import roles_list
 from inhouse_bot import game_queue
 from inhouse_bot.game_queue import GameQueue
+from inhouse_bot.database_orm import session_scope, Player, PlayerRating
 
 # Ideally, that should not be hardcoded
 # This needs to be called after the first part is it creates a session
@@ -77,6 +80,38 @@ def test_queue_remove():
     assert len(GameQueue(0)) == 0
 
 
+def test_server_pool():
+    game_queue.reset_queue()
+
+    # Players 0 to 4 queue in channel 0 and players 5 to 9 in channel 1
+    for player_id in range(0, 10):
+        game_queue.add_player(player_id, roles_list[player_id % 5], player_id // 5, 0, name=str(player_id))
+
+    # Player 0 also queues in channel 1 for the same role, and should only be considered once
+    game_queue.add_player(0, roles_list[0], 1, 0, name="0")
+
+    server_pool = GameQueue(None, server_id=0)
+
+    assert len(server_pool) == 10
+    assert server_pool.queue_id == 0
+
+    # Loading all queues of the server at once gives the same queues as loading them one by one
+    server_queues = GameQueue.server_queues(0, [0, 1])
+    assert server_queues[0] == GameQueue(0)
+    assert server_queues[1] == GameQueue(1)
+    assert len(server_queues[1]) == 6
+
+    # A ready check on the pool marks players in all channels
+    game_queue.start_ready_check(list(range(0, 10)), None, 0, server_id=0)
+
+    assert len(GameQueue(0)) == 0
+    assert len(GameQueue(1)) == 0
+
+    game_queue.cancel_ready_check(ready_check_id=0, ids_to_drop=[0], server_id=0)
+
+    assert len(GameQueue(None, server_id=0)) == 9
+
+
 def test_multiple_queues():
     game_queue.reset_queue()
     game_queue.add_player(0, roles_list[0], 0, 0, name="0")
@@ -112,8 +147,97 @@ def test_duo_queue():
     assert len(GameQueue(0)) == 10
     assert len(GameQueue(0).duos) == 1
 
+    # Rows are indexed by player and role, and duos in the starting queue are the queue’s own rows
+    queue = GameQueue(0)
+    assert queue.queue_players_index[9, "SUP"].duo is queue.queue_players_index[0, "TOP"]
+    assert any(qp is queue.queue_players_index[9, "SUP"] for qp in queue.queue_players[:10])
+
     # Removing their duo status with 0 calling !solo
     game_queue.remove_duo(0, 0)
 
     assert len(GameQueue(0)) == 10
     assert len(GameQueue(0).duos) == 0
+
+
+def test_duo_queue_in_ready_check():
+    game_queue.reset_queue()
+
+    for player_id in range(0, 10):
+        game_queue.add_player(player_id, roles_list[player_id % 5], 0, 0, name=str(player_id))
+
+    game_queue.start_ready_check(list(range(0, 10)), 0, 0)
+
+    # Player 0 is in a ready check, so neither player gets queued
+    with pytest.raises(game_queue.PlayerInReadyCheck):
+        game_queue.add_duo(10, "TOP", 0, "SUP", 1, 0, first_player_name="10", second_player_name="0")
+
+    assert len(GameQueue(1)) == 0
+
+    game_queue.cancel_ready_check(ready_check_id=0, ids_to_drop=None)
+
+    # Once the ready check is cancelled, the duo can queue
+    game_queue.add_duo(10, "TOP", 0, "SUP", 1, 0, first_player_name="10", second_player_name="0")
+
+    assert len(GameQueue(0)) == 10
+    assert len(GameQueue(1)) == 2
+    assert len(GameQueue(1).duos) == 1
+
+
+def test_async_queue():
+    game_queue.reset_queue()
+
+    async def queue_players():
+        # New players are written through the async engine
+        for player_id in range(20, 28):
+            await game_queue.add_player_async(player_id, roles_list[player_id % 5], 2, 0, name=str(player_id))
+
+        await game_queue.add_duo_async(
+            28, "BOT", 29, "SUP", 2, 0, first_player_name="28", second_player_name="renamed"
+        )
+
+        # Players in queue cannot be in a ready check and queue again
+        game_queue.start_ready_check(list(range(20, 30)), 2, 2)
+
+        with pytest.raises(game_queue.PlayerInReadyCheck):
+            await game_queue.add_player_async(20, "TOP", 1, 0, name="20")
+
+    # A single event loop, as the async engine is tied to the loop that created it
+    asyncio.run(queue_players())
+
+    game_queue.cancel_ready_check(ready_check_id=2, ids_to_drop=None)
+
+    assert len(GameQueue(2)) == 10
+    assert len(GameQueue(2).duos) == 1
+
+    with session_scope() as session:
+        assert session.query(Player).get((29, 0)).name == "renamed"
+        assert session.query(PlayerRating).get((28, 0, "BOT")) is not None
+
+
+def test_server_config_cache():
+    from inhouse_bot.common_utils.get_server_config import (
+        get_server_config,
+        get_server_config_by_key,
+        get_server_config_by_key_async,
+        invalidate_server_config,
+    )
+
+    assert not get_server_config_by_key(0, "server_pool")
+
+    with session_scope() as session:
+        server_config = get_server_config(0, session)
+        server_config.config["server_pool"] = True
+
+    # The config is cached until it gets invalidated, like the admin config command does after a change
+    assert not get_server_config_by_key(0, "server_pool")
+
+    invalidate_server_config(0)
+    assert asyncio.run(get_server_config_by_key_async(0, "server_pool"))
+    assert get_server_config_by_key(0, "server_pool")
+
+    with session_scope() as session:
+        server_config = get_server_config(0, session)
+        server_config.config["server_pool"] = False
+
+    invalidate_server_config(0)
+    assert not get_server_config_by_key(0, "server_pool")
@@ -0,0 +1,132 @@
+from inhouse_bot.common_utils.fields import roles_list
+from inhouse_bot import game_queue
+from inhouse_bot.game_queue import GameQueue
+from inhouse_bot.game_queue.queue_store import queue_store, QueueStore
+
+from inhouse_bot.queue_channel_handler import queue_channel_handler
+
+
+queue_channel_handler.mark_queue_channel(0, 0)
+queue_channel_handler.mark_queue_channel(1, 0)
+
+
+def reloaded_rows(channel_id: int):
+    """
+    Rows of the channel in a new store rebuilt from the queue_player table, like after a restart
+    """
+    store = QueueStore()
+    store.load()
+
+    return sorted(store.rows(channel_id=channel_id))
+
+
+def test_queue_store_persistence():
+    game_queue.reset_queue()
+
+    for player_id in range(0, 9):
+        game_queue.add_player(player_id, roles_list[player_id % 5], 0, 0, name=str(player_id))
+
+    game_queue.add_duo(4, "SUP", 9, "MID", 0, 0, first_player_name="4", second_player_name="9")
+    game_queue.add_player(0, roles_list[0], 1, 0, name="0")
+    game_queue.start_ready_check(list(range(0, 10)), 0, 0)
+
+    # Every change is written in the background, which we wait for
+    queue_store.flush()
+
+    for channel_id in (0, 1):
+        assert reloaded_rows(channel_id) == sorted(queue_store.rows(channel_id=channel_id))
+
+    game_queue.cancel_ready_check(ready_check_id=0, ids_to_drop=[0], server_id=0)
+    game_queue.remove_duo(9, 0)
+    queue_store.flush()
+
+    assert reloaded_rows(0) == sorted(queue_store.rows(channel_id=0))
+    assert reloaded_rows(1) == []
+
+    # A rebuilt store gives the same queues
+    store = QueueStore()
+    assert GameQueue(0, queue_players=store.queue_players(channel_id=0)) == GameQueue(0)
+
+
+def test_queue_store_bad_row():
+    from datetime import datetime
+
+    from inhouse_bot.game_queue.queue_store import MAX_WRITE_ATTEMPTS, QueueRow
+
+    # The writer thread waits long enough for us to flush ourselves
+    store = QueueStore(write_delay=60)
+
+    valid_row = QueueRow(channel_id=1, player_id=1, player_server_id=0, role="JGL", queue_time=datetime.now())
+    store.put(valid_row)
+
+    # This player does not exist, so the row breaks the foreign key
+    bad_row = valid_row._replace(player_id=-1)
+    store.put(bad_row)
+
+    # The valid row is written even though the batch failed
+    assert not store.flush()
+    assert valid_row in reloaded_rows(1)
+
+    # The bad row is retried until it gets dropped
+    for _ in range(MAX_WRITE_ATTEMPTS - 2):
+        assert not store.flush()
+
+    assert store.flush()
+    assert store.flush()
+
+    store.discard(valid_row)
+    store.discard(bad_row)
+    assert store.flush()
+
+    assert reloaded_rows(1) == []
+
+
+def test_queue_store_server_index():
+    from datetime import datetime, timedelta
+
+    from inhouse_bot.game_queue.queue_store import QueueRow
+
+    # The store also loads the rows left by other tests, so we use servers nobody queued in
+    first_server, second_server = 8, 9
+
+    store = QueueStore(write_delay=60)
+    start = datetime.now()
+
+    def queue_row(channel_id: int, player_id: int, server_id: int, role: str, **kwargs) -> QueueRow:
+        queue_time = start + timedelta(seconds=player_id)
+
+        return QueueRow(channel_id, player_id, server_id, role, queue_time, **kwargs)
+
+    def server_pool(server_id: int) -> list:
+        return [(qp.player_id, qp.role) for qp in store.queue_players(server_id=server_id)]
+
+    rows = [queue_row(5, player_id, first_server, roles_list[player_id]) for player_id in range(4)]
+    rows += [
+        queue_row(6, 0, first_server, "SUP"),
+        queue_row(7, 0, second_server, "TOP"),
+        queue_row(7, 1, second_server, "JGL"),
+    ]
+
+    for row in rows:
+        store.put(row)
+
+    assert server_pool(first_server) == [(0, "TOP"), (0, "SUP"), (1, "JGL"), (2, "MID"), (3, "BOT")]
+    assert server_pool(second_server) == [(0, "TOP"), (1, "JGL")]
+
+    # A player in a ready check is left out of every channel of the same server, and only of that server
+    store.put(rows[0]._replace(ready_check_id=1))
+
+    assert store.queue_players(channel_id=6) == []
+    assert server_pool(first_server) == [(1, "JGL"), (2, "MID"), (3, "BOT")]
+    assert server_pool(second_server) == [(0, "TOP"), (1, "JGL")]
+
+    # Both rows of the player have the same queue time, so their order can change
+    store.put(rows[0])
+    assert sorted(server_pool(first_server)) == [(0, "SUP"), (0, "TOP"), (1, "JGL"), (2, "MID"), (3, "BOT")]
+
+    # Nothing is left once rows are removed, and nothing was written for them
+    for row in rows:
+        store.discard(row)
+
+    assert server_pool(first_server) == server_pool(second_server) == []
+    assert store.flush()
@@ -0,0 +1,91 @@
+import pytest
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from inhouse_bot.common_utils.fields import roles_list
+from inhouse_bot import game_queue
+from inhouse_bot.game_queue import GameQueue
+from inhouse_bot.game_queue.queue_store import queue_store
+from inhouse_bot.game_queue.rating_cache import rating_cache
+from inhouse_bot.database_orm import session_scope, Game, Player, PlayerRating
+from inhouse_bot.matchmaking_logic.packed_queue import PackedQueue
+
+from inhouse_bot.queue_channel_handler import queue_channel_handler
+
+
+queue_channel_handler.mark_queue_channel(0, 0)
+
+
+def test_rating_cache():
+    game_queue.reset_queue()
+
+    for player_id in range(0, 10):
+        game_queue.add_player(player_id, roles_list[player_id % 5], 0, 0, name=str(player_id))
+
+    # Ratings written by the scoring functions are the ones in the database
+    with session_scope() as session:
+        for rating in session.query(PlayerRating).filter(PlayerRating.player_server_id == 0):
+            assert rating_cache.get(0, rating.player_id, rating.role) == pytest.approx(
+                (rating.trueskill_mu, rating.trueskill_sigma)
+            )
+
+    # Queue changes written in the background would be logged too
+    queue_store.flush()
+
+    statements = []
+
+    def log_statement(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(Engine, "before_cursor_execute", log_statement)
+
+    try:
+        queue = GameQueue(0)
+        packed_queue = PackedQueue.from_queue_players(queue.queue_players)
+    finally:
+        event.remove(Engine, "before_cursor_execute", log_statement)
+
+    # Once the cache is loaded, queues come from the queue store and building them does not query the database
+    assert not statements
+    assert packed_queue.mu.tolist() == [
+        rating_cache.get(0, qp.player_id, qp.role)[0] for qp in queue.queue_players
+    ]
+
+
+def test_rating_cache_miss():
+    # Server only used by this test, so its ratings are only the ones written here
+    server_id = 6
+
+    assert rating_cache.server_ratings(server_id) == {}
+
+    # Ratings written without going through the cache, which already loaded the server
+    with session_scope() as session:
+        players = [Player(id=player_id, server_id=server_id, name=str(player_id)) for player_id in range(10)]
+        session.add_all(players)
+        session.flush()
+
+        for player in players:
+            for role in roles_list:
+                rating = PlayerRating(player, role)
+                rating.trueskill_mu, rating.trueskill_sigma = 30 + player.id, 5
+                session.add(rating)
+
+    with session_scope() as session:
+        players = session.query(Player).filter(Player.server_id == server_id).order_by(Player.id).all()
+
+        game = Game(
+            {
+                (side, role): players[role_idx + 5 * side_idx]
+                for side_idx, side in enumerate(("BLUE", "RED"))
+                for role_idx, role in enumerate(roles_list)
+            }
+        )
+        session.add(game)
+
+        # Pre-game ratings are the real ones and not the default rating
+        for participant in game.participants.values():
+            assert (participant.trueskill_mu, participant.trueskill_sigma) == (30 + participant.player_id, 5)
+
+    # They were added to the cache along the way
+    for player_id in range(10):
+        assert rating_cache.get(server_id, player_id, roles_list[player_id % 5]) == (30 + player_id, 5)
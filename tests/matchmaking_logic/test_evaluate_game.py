@@ -0,0 +1,43 @@
+import itertools
+import math
+import random
+
+import numpy as np
+import trueskill
+
+from inhouse_bot.matchmaking_logic.evaluate_game import evaluate_ratings, evaluate_ratings_array
+
+
+def trueskill_evaluation(blue_ratings, red_ratings) -> float:
+    """
+    The original evaluation, going through trueskill.Rating objects and the global environment
+    """
+    blue_team_ratings = [trueskill.Rating(mu=mu, sigma=sigma) for mu, sigma in blue_ratings]
+    red_team_ratings = [trueskill.Rating(mu=mu, sigma=sigma) for mu, sigma in red_ratings]
+
+    delta_mu = sum(r.mu for r in blue_team_ratings) - sum(r.mu for r in red_team_ratings)
+    sum_sigma = sum(r.sigma ** 2 for r in itertools.chain(blue_team_ratings, red_team_ratings))
+    denominator = math.sqrt(10 * (trueskill.BETA * trueskill.BETA) + sum_sigma)
+
+    return trueskill.global_env().cdf(delta_mu / denominator)
+
+
+def test_evaluate_ratings():
+    rng = random.Random(0)
+
+    games = [
+        [[(rng.gauss(25, 10), rng.uniform(0.5, 25 / 3)) for _ in range(5)] for _ in range(2)]
+        for _ in range(1000)
+    ]
+
+    expected = [trueskill_evaluation(blue, red) for blue, red in games]
+
+    # trueskill.Rating stores ratings as precision and precision mean, so results only differ by rounding errors
+    assert np.allclose([evaluate_ratings(blue, red) for blue, red in games], expected, rtol=0, atol=1e-12)
+
+    ratings = np.array(games)  # game, side, player, (mu, sigma)
+    win_probabilities = evaluate_ratings_array(
+        ratings[:, 0, :, 0], ratings[:, 0, :, 1], ratings[:, 1, :, 0], ratings[:, 1, :, 1]
+    )
+
+    assert np.allclose(win_probabilities, expected, rtol=0, atol=1e-12)
@@ -0,0 +1,421 @@
+import itertools
+import math
+import random
+
+import numpy as np
+import pytest
+import trueskill
+
+from inhouse_bot.common_utils.fields import roles_list
+from inhouse_bot.matchmaking_logic.candidate_game import CandidateHeap
+from inhouse_bot.matchmaking_logic.evaluate_game import balance_to_score
+from inhouse_bot.matchmaking_logic.packed_queue import PackedQueue, NO_DUO
+from inhouse_bot.matchmaking_logic import vectorized_search, branch_and_bound, local_search
+from inhouse_bot.matchmaking_logic.find_best_game import (
+    find_best_queue_composition,
+    find_best_queue_split,
+    choose_engine,
+    matchmaking_engines,
+)
+from inhouse_bot.matchmaking_logic.matchmaking_cache import MatchmakingCache
+from inhouse_bot.matchmaking_logic.search_deadline import SearchDeadline
+from inhouse_bot.matchmaking_logic.vectorized_search import find_best_composition
+
+
+def make_packed_queue(players_per_role, duos=0, multi_role_players=0, seed=0) -> PackedQueue:
+    """
+    Creates a random in-memory queue, without touching the database
+    """
+    rng = random.Random(seed)
+
+    rows = []  # [player_id, role_idx, duo_id]
+    player_id = 0
+    for role_idx in range(len(roles_list)):
+        for _ in range(players_per_role):
+            rows.append([player_id, role_idx, NO_DUO])
+            player_id += 1
+
+    # Some players queue for a second role
+    for row in rng.sample(list(rows), multi_role_players):
+        other_role = rng.choice([r for r in range(len(roles_list)) if r != row[1]])
+        rows.append([row[0], other_role, NO_DUO])
+
+    # Duos are made of two single-role players in different roles
+    solo_rows = [row for row in rows if sum(r[0] == row[0] for r in rows) == 1]
+    for _ in range(duos):
+        first = rng.choice(solo_rows)
+        second = rng.choice([r for r in solo_rows if r[1] != first[1] and r is not first])
+        first[2], second[2] = second[0], first[0]
+        solo_rows = [r for r in solo_rows if r is not first and r is not second]
+
+    rng.shuffle(rows)
+
+    return PackedQueue(
+        player_ids=[r[0] for r in rows],
+        roles=[r[1] for r in rows],
+        duo_ids=[r[2] for r in rows],
+        mu=[rng.gauss(25, 5) for _ in rows],
+        sigma=[rng.uniform(1, 25 / 3) for _ in rows],
+    )
+
+
+def balance(packed_queue: PackedQueue, blue_rows, red_rows) -> float:
+    delta_mu = packed_queue.mu[list(blue_rows)].sum() - packed_queue.mu[list(red_rows)].sum()
+    sum_sigma = (packed_queue.sigma[list(blue_rows) + list(red_rows)] ** 2).sum()
+
+    return abs(delta_mu) / math.sqrt(10 * trueskill.BETA ** 2 + sum_sigma)
+
+
+def is_valid(packed_queue: PackedQueue, blue_rows, red_rows) -> bool:
+    player_ids = packed_queue.player_ids[list(blue_rows) + list(red_rows)]
+
+    if len(set(player_ids)) != 10:
+        return False
+
+    for team_rows in (blue_rows, red_rows):
+        team_player_ids = set(packed_queue.player_ids[list(team_rows)])
+        for row in team_rows:
+            if packed_queue.duo_ids[row] != NO_DUO and packed_queue.duo_ids[row] not in team_player_ids:
+                return False
+
+    return True
+
+
+def brute_force_balances(packed_queue: PackedQueue) -> list:
+    """
+    The original matchmaking logic, testing every permutation one by one
+
+    Returns the balance of every valid composition, sorted and counting mirrored compositions once
+    """
+    balances = []
+
+    role_permutations = [
+        itertools.permutations(packed_queue.role_rows(role_idx).tolist(), 2)
+        for role_idx in range(len(roles_list))
+    ]
+
+    for composition in itertools.product(*role_permutations):
+        blue_rows, red_rows = [p[0] for p in composition], [p[1] for p in composition]
+
+        if blue_rows < red_rows and is_valid(packed_queue, blue_rows, red_rows):
+            balances.append(balance(packed_queue, blue_rows, red_rows))
+
+    return sorted(balances)
+
+
+def brute_force_balance(packed_queue: PackedQueue) -> float:
+    return min(brute_force_balances(packed_queue), default=math.inf)
+
+
+@pytest.mark.parametrize("engine", [vectorized_search, branch_and_bound])
+def test_engine_matches_brute_force(monkeypatch, engine):
+    # We do not want the search to stop on the first good enough game here
+    monkeypatch.setattr(engine, "GOOD_ENOUGH_SCORE", 0)
+
+    for seed in range(5):
+        packed_queue = make_packed_queue(3, duos=2, multi_role_players=2, seed=seed)
+
+        candidate = engine.find_best_composition(packed_queue)
+        assert candidate
+
+        assert is_valid(packed_queue, candidate.blue_rows, candidate.red_rows)
+
+        # The best composition found in batches should be exactly as good as the brute force one
+        assert np.isclose(balance(packed_queue, candidate.blue_rows, candidate.red_rows), candidate.balance)
+        assert np.isclose(candidate.balance, brute_force_balance(packed_queue))
+
+
+def test_vectorized_search_batches(monkeypatch):
+    monkeypatch.setattr(vectorized_search, "GOOD_ENOUGH_SCORE", 0)
+
+    packed_queue = make_packed_queue(3, duos=1, multi_role_players=1, seed=42)
+    composition = find_best_composition(packed_queue)
+
+    # Very small batches should give the exact same result as a single big batch
+    monkeypatch.setattr(vectorized_search, "BATCH_SIZE", 50)
+    assert find_best_composition(packed_queue) == composition
+
+
+@pytest.mark.parametrize("engine", [vectorized_search, branch_and_bound, local_search])
+def test_engine_impossible_duo(engine):
+    packed_queue = PackedQueue(
+        player_ids=list(range(10)),
+        roles=[i % 5 for i in range(10)],
+        duo_ids=[11] + [NO_DUO] * 9,  # Player 0’s duo is not in queue
+        mu=[25] * 10,
+        sigma=[25 / 3] * 10,
+    )
+
+    assert engine.find_best_composition(packed_queue) is None
+
+
+def test_branch_and_bound_large_queue():
+    # 10 players per role is way too much for an exhaustive search
+    packed_queue = make_packed_queue(10, duos=4, multi_role_players=5, seed=0)
+
+    candidate = branch_and_bound.find_best_composition(packed_queue)
+
+    assert is_valid(packed_queue, candidate.blue_rows, candidate.red_rows)
+    assert np.isclose(balance(packed_queue, candidate.blue_rows, candidate.red_rows), candidate.balance)
+    assert trueskill.global_env().cdf(candidate.balance) - 0.5 < 0.01
+
+
+def test_local_search_near_optimal(monkeypatch):
+    monkeypatch.setattr(local_search, "GOOD_ENOUGH_SCORE", 0)
+
+    for seed in range(5):
+        packed_queue = make_packed_queue(3, duos=2, multi_role_players=2, seed=seed)
+
+        candidate = local_search.find_best_composition(packed_queue)
+
+        assert is_valid(packed_queue, candidate.blue_rows, candidate.red_rows)
+        assert np.isclose(balance(packed_queue, candidate.blue_rows, candidate.red_rows), candidate.balance)
+
+        # Local search is not exact, but it should be less than a percent of winrate away from the best game
+        assert candidate.matchmaking_score - balance_to_score(brute_force_balance(packed_queue)) < 0.01
+
+
+def test_local_search_large_queue(monkeypatch):
+    packed_queue = make_packed_queue(16, duos=6, multi_role_players=6, seed=0)
+
+    candidate = local_search.find_best_composition(packed_queue, required_row=len(packed_queue) - 1)
+
+    assert is_valid(packed_queue, candidate.blue_rows, candidate.red_rows)
+    assert len(packed_queue) - 1 in candidate.rows
+    assert candidate.matchmaking_score < 0.01
+
+    assert choose_engine(packed_queue) == "local_search"
+    assert choose_engine(packed_queue[:10]) == "vectorized"
+
+    # Queues of up to 50 players stay on the exact search
+    assert choose_engine(make_packed_queue(12, duos=6, multi_role_players=6, seed=0)) == "branch_and_bound"
+
+    # Annealing runs once per doubling of the number of players, and not once per players threshold
+    calls = []
+
+    def counted_local_search(threshold_queue, **kwargs):
+        calls.append((len(threshold_queue), kwargs.get("required_row")))
+        return local_search.find_best_composition(threshold_queue, **kwargs)
+
+    monkeypatch.setitem(matchmaking_engines, "local_search", counted_local_search)
+
+    result = find_best_queue_composition(packed_queue, game_quality_threshold=0, engine="local_search")
+
+    assert calls == [(10, None), (20, None), (40, None), (80, None), (len(packed_queue), None)]
+    assert result.players_considered == len(packed_queue)
+    assert not result.exhaustive
+
+
+def test_local_search_seniority():
+    # 20 players per role, the oldest ones first. The 10 oldest cannot make a balanced game, but the 20 oldest and
+    #   all the newer players can
+    rows = range(100)
+    packed_queue = PackedQueue(
+        player_ids=list(rows),
+        roles=[row % 5 for row in rows],
+        duo_ids=[NO_DUO for _ in rows],
+        mu=[(30 if row < 5 else 20 if row < 10 else 25) for row in rows],
+        sigma=[1 for _ in rows],
+    )
+
+    result = find_best_queue_composition(packed_queue, game_quality_threshold=0.1, engine="local_search")
+
+    # Newer players make games just as balanced, but older players are picked first
+    assert result.composition.matchmaking_score < 0.01
+    assert result.players_considered == 20
+    assert max(result.composition.rows) < 20
+@pytest.mark.parametrize("engine", ["vectorized", "branch_and_bound"])
+def test_incremental_matchmaking(monkeypatch, engine):
+    monkeypatch.setattr(vectorized_search, "GOOD_ENOUGH_SCORE", 0)
+    monkeypatch.setattr(branch_and_bound, "GOOD_ENOUGH_SCORE", 0)
+
+    for seed in range(3):
+        packed_queue = make_packed_queue(3, duos=2, multi_role_players=2, seed=seed)
+
+        # Without a quality threshold, the incremental search has to find the best game of the full queue
+        composition = find_best_queue_composition(
+            packed_queue, game_quality_threshold=0, engine=engine
+        ).composition
+
+        assert np.isclose(composition.balance, brute_force_balance(packed_queue))
+
+        # With a threshold, it has to stop at the same number of players as a search from scratch would
+        composition = find_best_queue_composition(
+            packed_queue, game_quality_threshold=0.05, engine=engine
+        ).composition
+
+        for players_threshold in range(10, len(packed_queue) + 1):
+            scratch_balance = brute_force_balance(packed_queue[:players_threshold])
+
+            if balance_to_score(scratch_balance) < 0.05:
+                break
+
+        assert np.isclose(composition.balance, scratch_balance)
+
+
+@pytest.mark.parametrize("engine", ["vectorized", "branch_and_bound"])
+def test_matchmaking_deadline(monkeypatch, engine):
+    monkeypatch.setattr(vectorized_search, "GOOD_ENOUGH_SCORE", 0)
+    monkeypatch.setattr(branch_and_bound, "GOOD_ENOUGH_SCORE", 0)
+
+    packed_queue = make_packed_queue(10, duos=4, multi_role_players=5, seed=0)
+
+    # An expired deadline stops the search before it found anything, even if there are possible games
+    result = find_best_queue_composition(
+        packed_queue, game_quality_threshold=0, engine=engine, deadline=SearchDeadline(0)
+    )
+
+    assert not result.exhaustive
+    assert result.composition is None
+    assert branch_and_bound.find_best_composition(packed_queue) is not None
+
+    # A deadline expiring during the search gives the best game found so far
+    deadline = SearchDeadline(60)
+    engine_function = matchmaking_engines[engine]
+
+    def expiring_engine(*args, **kwargs):
+        composition = engine_function(*args, **kwargs)
+
+        # The deadline expires as soon as a first game was found
+        if composition:
+            deadline.end = 0
+
+        return composition
+
+    monkeypatch.setitem(matchmaking_engines, engine, expiring_engine)
+
+    result = find_best_queue_composition(packed_queue, game_quality_threshold=0, engine=engine, deadline=deadline)
+
+    assert not result.exhaustive
+    assert result.composition
+    assert result.players_considered < len(packed_queue)
+
+    matchmaking_engines[engine] = engine_function
+
+    # With enough time, the search considers the whole queue
+    result = find_best_queue_composition(
+        packed_queue[:20], game_quality_threshold=0, engine=engine, deadline=SearchDeadline(60)
+    )
+
+    assert result.exhaustive
+    assert result.players_considered == 20
+
+
+@pytest.mark.parametrize("engine", [vectorized_search, branch_and_bound])
+def test_engine_candidates(monkeypatch, engine):
+    monkeypatch.setattr(engine, "GOOD_ENOUGH_SCORE", 0)
+
+    for seed in range(3):
+        packed_queue = make_packed_queue(3, duos=2, multi_role_players=2, seed=seed)
+
+        candidates = CandidateHeap(10)
+        engine.find_best_composition(packed_queue, candidates=candidates)
+
+        # We get the 10 best distinct compositions, without their mirrors
+        assert len(set(candidates.sorted())) == 10
+        assert np.allclose([c.balance for c in candidates.sorted()], brute_force_balances(packed_queue)[:10])
+
+
+def test_find_best_queue_split():
+    packed_queue = make_packed_queue(7, duos=4, multi_role_players=4, seed=0)
+
+    compositions = find_best_queue_split(packed_queue, game_quality_threshold=0.1)
+
+    # 35 players are enough for 3 games
+    assert len(compositions) == 3
+
+    players_in_games = [int(packed_queue.player_ids[row]) for c in compositions for row in c.rows]
+    assert len(players_in_games) == len(set(players_in_games))
+
+    for composition in compositions:
+        assert is_valid(packed_queue, composition.blue_rows, composition.red_rows)
+        assert np.isclose(
+            balance(packed_queue, composition.blue_rows, composition.red_rows), composition.balance
+        )
+        assert composition.matchmaking_score < 0.1
+
+    # The first game is the one of a single game search, which is not rebalanced
+    single_composition = find_best_queue_composition(packed_queue, game_quality_threshold=0.1).composition
+    assert (compositions[0].blue_rows, compositions[0].red_rows) == (
+        single_composition.blue_rows,
+        single_composition.red_rows,
+    )
+
+    # Giving the first game gives the same split
+    assert [c.rows for c in compositions] == [
+        c.rows
+        for c in find_best_queue_split(
+            packed_queue, game_quality_threshold=0.1, first_composition=single_composition
+        )
+    ]
+
+    assert len(find_best_queue_split(packed_queue, game_quality_threshold=0.1, max_games=2)) == 2
+
+
+def test_candidate_moved_to():
+    packed_queue = make_packed_queue(3, seed=0)
+
+    candidates = find_best_queue_composition(
+        packed_queue, game_quality_threshold=0, candidates_count=5
+    ).candidates
+    assert len(candidates) == 5
+
+    # A player of the best game leaves the queue and the others are shuffled
+    dropped_row = next(row for row in candidates[0].rows if row not in candidates[-1].rows)
+
+    remaining_rows = [row for row in range(len(packed_queue)) if row != dropped_row]
+    random.Random(0).shuffle(remaining_rows)
+    current_queue = packed_queue[remaining_rows]
+
+    moved_candidates = [candidate.moved_to(packed_queue, current_queue) for candidate in candidates]
+
+    assert moved_candidates[0] is None
+    assert moved_candidates[-1]
+
+    for candidate, moved_candidate in zip(candidates, moved_candidates):
+        if moved_candidate:
+            assert current_queue.player_ids[list(moved_candidate.rows)].tolist() == [
+                packed_queue.player_ids[row] for row in candidate.rows
+            ]
+            assert np.isclose(moved_candidate.balance, candidate.balance)
+        else:
+            assert dropped_row in candidate.rows
+
+
+def test_matchmaking_cache():
+    cache = MatchmakingCache()
+
+    packed_queue = make_packed_queue(3, duos=1, seed=0)
+    result = find_best_queue_composition(packed_queue, game_quality_threshold=1)
+
+    # With a threshold of 1 the search stops at the first composition, so later players do not matter
+    cache.set(0, packed_queue, 1, result)
+
+    assert cache.get(0, packed_queue, 1) is result
+    assert cache.get(0, packed_queue[: result.players_considered], 1) is result
+    assert cache.get(0, packed_queue, 0.1) is None
+    assert cache.get(1, packed_queue, 1) is None
+
+    # A rating change in the considered players invalidates the result
+    # Slicing gives views on the same arrays, so the changed queue is built from copies
+    changed_mu = np.copy(packed_queue.mu)
+    changed_mu[0] += 1
+    changed_queue = PackedQueue(
+        packed_queue.player_ids, packed_queue.roles, packed_queue.duo_ids, changed_mu, packed_queue.sigma
+    )
+    assert cache.get(0, changed_queue, 1) is None
+
+    # The original queue was left untouched
+    assert cache.get(0, packed_queue, 1) is result
+
+    # Without reaching the threshold, the whole queue is part of the fingerprint
+    result = find_best_queue_composition(packed_queue[:-1], game_quality_threshold=0)
+    cache.set(0, packed_queue[:-1], 0, result)
+
+    assert cache.get(0, packed_queue[:-1], 0) is result
+    assert cache.get(0, packed_queue, 0) is None
+
+    cache.invalidate()
+    assert cache.get(0, packed_queue[:-1], 0) is None
+
+    assert (cache.hits, cache.misses) == (4, 5)
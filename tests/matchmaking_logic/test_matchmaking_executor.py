@@ -0,0 +1,161 @@
+import asyncio
+import time
+
+import pytest
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from inhouse_bot.common_utils.fields import roles_list
+from inhouse_bot import game_queue
+from inhouse_bot.game_queue import GameQueue
+from inhouse_bot.game_queue.player_cache import player_cache
+from inhouse_bot.game_queue.queue_store import queue_store
+from inhouse_bot.game_queue.rating_cache import rating_cache
+from inhouse_bot.matchmaking_logic import find_best_game, rating_engines
+from inhouse_bot.matchmaking_logic.matchmaking_cache import matchmaking_cache
+from inhouse_bot.matchmaking_logic.matchmaking_executor import MatchmakingExecutor
+
+from inhouse_bot.queue_channel_handler import queue_channel_handler
+
+
+queue_channel_handler.mark_queue_channel(0, 0)
+
+
+def test_matchmaking_executor():
+    game_queue.reset_queue()
+
+    for player_id in range(0, 10):
+        game_queue.add_player(player_id, roles_list[player_id % 5], 0, 0, name=str(player_id))
+
+    executor = MatchmakingExecutor(max_workers=1)
+
+    async def run_searches():
+        # The second search is started before the first one finishes, which cancels it
+        return await asyncio.gather(
+            executor.find_best_game(GameQueue(0)), executor.find_best_game(GameQueue(0))
+        )
+
+    try:
+        outdated_game, game = asyncio.run(run_searches())
+    finally:
+        executor.shutdown()
+
+    assert outdated_game is None
+    assert game
+    assert set(game.player_ids_list) == set(range(10))
+
+
+def test_matchmaking_executor_preload(monkeypatch):
+    game_queue.reset_queue()
+
+    for player_id in range(0, 10):
+        game_queue.add_player(player_id, roles_list[player_id % 5], 0, 0, name=str(player_id))
+
+    # Everything matchmaking reads about the server has to be loaded again
+    rating_cache.invalidate(0)
+    player_cache.invalidate(0)
+    monkeypatch.delitem(rating_engines._server_engines, 0, raising=False)
+
+    # Queue changes written in the background would be logged too
+    queue_store.flush()
+
+    statements = []
+
+    def log_statement(conn, cursor, statement, *args):
+        # The async engine goes through asyncpg, and only the synchronous one blocks the event loop
+        if conn.dialect.driver != "asyncpg":
+            statements.append(statement)
+
+    async def run_matchmaking():
+        # Queues need player names, which the cog loads first like this
+        await game_queue.preload_server(0)
+
+        return await executor.find_best_game(GameQueue(0))
+
+    executor = MatchmakingExecutor(max_workers=1)
+    event.listen(Engine, "before_cursor_execute", log_statement)
+
+    try:
+        game = asyncio.run(run_matchmaking())
+    finally:
+        event.remove(Engine, "before_cursor_execute", log_statement)
+        executor.shutdown()
+
+    assert game
+    assert not statements
+
+
+def test_matchmaking_executor_games():
+    game_queue.reset_queue()
+
+    for player_id in range(0, 25):
+        game_queue.add_player(player_id, roles_list[player_id % 5], 0, 0, name=str(player_id))
+
+    executor = MatchmakingExecutor(max_workers=1)
+
+    async def run_searches():
+        first_game = await executor.find_best_game(GameQueue(0))
+        hits = matchmaking_cache.hits
+
+        # The first game comes from the cached result of the single game search
+        games = await executor.find_best_games(GameQueue(0))
+        assert matchmaking_cache.hits == hits + 1
+
+        return first_game, games
+
+    try:
+        first_game, games = asyncio.run(run_searches())
+    finally:
+        executor.shutdown()
+
+    def teams(game):
+        # Sides are picked at random when creating games, so we only compare teams
+        return {
+            frozenset((role, game.participants[side, role].player_id) for role in roles_list)
+            for side in ("BLUE", "RED")
+        }
+
+    assert len(games) == 2
+    assert teams(games[0]) == teams(first_game)
+
+    # New players all have the same rating, so searches in other processes can pick another game of the same score
+    assert games[0].matchmaking_score == pytest.approx(find_best_game(GameQueue(0)).matchmaking_score)
+    assert not set(games[0].player_ids_list) & set(games[1].player_ids_list)
+
+
+def wait_for_deadline(deadline) -> bool:
+    """
+    Search function that only stops at its deadline, returning whether it got cancelled
+    """
+    while not deadline.expired():
+        time.sleep(0.01)
+
+    return deadline.cancelled()
+
+
+def test_matchmaking_executor_cancel():
+    executor = MatchmakingExecutor(max_workers=1, timeout=60)
+
+    async def run_searches():
+        # A first search starts the worker, so the next one runs right away instead of waiting in the pool
+        await executor._search(0, 0, wait_for_deadline)
+
+        long_search = asyncio.ensure_future(executor._search(0, 60, wait_for_deadline))
+        await asyncio.sleep(0.5)
+
+        executor.cancel(0)
+
+        # The only worker is free again long before the 60s deadline of the cancelled search
+        start = time.monotonic()
+        cancelled = await executor._search(1, 0, wait_for_deadline)
+
+        return await long_search, cancelled, time.monotonic() - start
+
+    try:
+        long_search_result, cancelled, duration = asyncio.run(run_searches())
+    finally:
+        executor.shutdown()
+
+    assert long_search_result is None
+    assert cancelled is False
+    assert duration < 10
@@ -67,8 +67,14 @@ def test_matchmaking_logic_priority():
 
 def test_trueskill_draw():
     import trueskill
+    from inhouse_bot.matchmaking_logic.rating_engines import DEFAULT_RATING_ENGINE
 
-    assert trueskill.DRAW_PROBABILITY == 0.0
+    # Setting trueskill.DRAW_PROBABILITY never reached the global environment, so existing ratings were computed
+    #   with TrueSkill’s default draw probability, which the default engine keeps
+    env = trueskill.global_env()
+
+    assert DEFAULT_RATING_ENGINE.draw_probability == env.draw_probability
+    assert (DEFAULT_RATING_ENGINE.beta, DEFAULT_RATING_ENGINE.tau) == (env.beta, env.tau)
 
 
 def test_duo_matchmaking():
@@ -0,0 +1,48 @@
+import asyncio
+
+from inhouse_bot.matchmaking_logic.matchmaking_scheduler import MatchmakingScheduler
+
+
+def test_matchmaking_scheduler():
+    scheduler = MatchmakingScheduler(debounce=0.05, max_concurrent=1)
+
+    runs = []
+    running = set()
+    max_running = []
+
+    def run_function(queue_id: int, trigger_idx: int):
+        async def run():
+            running.add(queue_id)
+            max_running.append(len(running))
+
+            runs.append((queue_id, trigger_idx))
+            await asyncio.sleep(0.2)
+
+            running.discard(queue_id)
+
+        return run
+
+    async def trigger_runs():
+        # A burst of triggers is handled by a single run, with the latest run function
+        for trigger_idx in range(5):
+            scheduler.trigger(0, run_function(0, trigger_idx))
+
+        # Another queue waits for the first one, as only one queue can run at a time here
+        scheduler.trigger(1, run_function(1, 0))
+
+        # Triggers during the run are coalesced into a single rerun
+        await asyncio.sleep(0.15)
+        assert runs == [(0, 4)]
+
+        task = scheduler.trigger(0, run_function(0, 5))
+        scheduler.trigger(0, run_function(0, 6))
+
+        await task
+
+        assert not scheduler.is_scheduled(0)
+
+    asyncio.run(trigger_runs())
+
+    assert runs[0] == (0, 4)
+    assert sorted(runs[1:]) == [(0, 6), (1, 0)]
+    assert max(max_running) == 1
@@ -0,0 +1,97 @@
+import random
+
+import numpy as np
+import pytest
+import trueskill
+
+from inhouse_bot.matchmaking_logic.rating_engines import (
+    RatingEngine,
+    EloEngine,
+    TrueSkillEngine,
+    DEFAULT_RATING_ENGINE,
+    make_rating_engine,
+)
+
+
+def random_games(games_count: int):
+    rng = random.Random(0)
+
+    mu = np.array([[rng.gauss(25, 5) for _ in range(10)] for _ in range(games_count)])
+    sigma = np.array([[rng.uniform(1, 25 / 3) for _ in range(10)] for _ in range(games_count)])
+    blue_won = np.array([rng.random() < 0.5 for _ in range(games_count)])
+
+    return mu, sigma, blue_won
+
+
+def test_trueskill_engine():
+    engine = TrueSkillEngine(beta=5, tau=0.2)
+    env = trueskill.TrueSkill(beta=5, tau=0.2)
+
+    mu, sigma, blue_won = random_games(50)
+    new_mu, new_sigma = engine.rate(mu, sigma, blue_won)
+
+    for game_idx in range(len(mu)):
+        teams = [
+            [env.create_rating(m, s) for m, s in zip(mu[game_idx][side], sigma[game_idx][side])]
+            for side in (slice(0, 5), slice(5, 10))
+        ]
+
+        ranked_teams = env.rate(teams if blue_won[game_idx] else teams[::-1])
+        blue_team, red_team = ranked_teams if blue_won[game_idx] else ranked_teams[::-1]
+
+        assert np.allclose(new_mu[game_idx], [r.mu for r in blue_team + red_team], atol=1e-9)
+        assert np.allclose(new_sigma[game_idx], [r.sigma for r in blue_team + red_team], atol=1e-9)
+
+
+def test_elo_engine():
+    engine = EloEngine(k_factor=4, min_sigma=2)
+
+    mu, sigma, blue_won = random_games(50)
+    new_mu, new_sigma = engine.rate(mu, sigma, blue_won)
+
+    winners = np.where(blue_won[:, np.newaxis], np.arange(10) < 5, np.arange(10) >= 5)
+
+    # Winners go up and losers go down, more uncertain players moving more
+    assert (new_mu[winners] > mu[winners]).all()
+    assert (new_mu[~winners] < mu[~winners]).all()
+    assert np.allclose(np.abs(new_mu - mu)[:, 0] / np.abs(new_mu - mu)[:, 1], sigma[:, 0] / sigma[:, 1])
+
+    assert (new_sigma <= sigma).all() and (new_sigma >= np.minimum(sigma, 2)).all()
+
+
+def test_make_rating_engine():
+    assert make_rating_engine(None) is DEFAULT_RATING_ENGINE
+
+    # Engines are created once per settings
+    engine = make_rating_engine({"name": "elo", "k_factor": 3.0})
+    assert isinstance(engine, EloEngine) and engine.k_factor == 3
+    assert make_rating_engine({"k_factor": 3.0, "name": "elo"}) is engine
+
+    # Saved settings give back the same engine
+    assert make_rating_engine(engine.settings).settings == engine.settings
+
+
+def test_incomplete_rating_engine():
+    class SettingsOnlyEngine(RatingEngine):
+        name = "settings_only"
+
+        @property
+        def settings(self) -> dict:
+            return {"name": self.name}
+
+    # Engines that cannot rate games fail when they are created, and not during a replay
+    with pytest.raises(TypeError):
+        SettingsOnlyEngine()
+
+
+def test_server_rating_engine():
+    from inhouse_bot.matchmaking_logic import rating_engines
+
+    engine = rating_engines.set_rating_engine(1, {"name": "trueskill", "beta": 5.0, "tau": 0.1})
+
+    # The engine is loaded back from the server config
+    rating_engines._server_engines.clear()
+    assert rating_engines.get_rating_engine(1) is engine
+
+    assert rating_engines.set_rating_engine(1, None) is DEFAULT_RATING_ENGINE
+    assert rating_engines.get_rating_engine(0) is DEFAULT_RATING_ENGINE
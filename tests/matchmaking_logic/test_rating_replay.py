@@ -0,0 +1,217 @@
+import random
+
+import numpy as np
+import pytest
+import trueskill
+
+from inhouse_bot.common_utils.fields import roles_list
+from inhouse_bot.database_orm import session_scope, Game, Player, PlayerRating
+from inhouse_bot.matchmaking_logic import score_game_from_winning_player, score_games
+from inhouse_bot.matchmaking_logic.rating_replay import (
+    replay_ratings,
+    schedule_games,
+    recompute_ratings,
+    recompute_all_ratings,
+    replay_server,
+    write_latest_replays,
+)
+
+# Servers only used by the database tests of this module, so they do not depend on games of other tests
+SERVER_ID = 3
+STALE_REPLAY_SERVER_ID = 4
+SCORE_GAMES_SERVER_ID = 5
+
+# Server without any player or game
+EMPTY_SERVER_ID = 7
+
+
+def add_players(server_id: int, players_count: int):
+    """
+    Adds players with default ratings for every role to the server
+    """
+    with session_scope() as session:
+        players = [
+            Player(id=player_id, server_id=server_id, name=str(player_id)) for player_id in range(players_count)
+        ]
+        session.add_all(players)
+        session.flush()
+
+        session.add_all(PlayerRating(player, role) for player in players for role in roles_list)
+
+
+def add_game(session, players: list) -> Game:
+    """
+    Adds a game between the 10 players, the first 5 being blue
+    """
+    game = Game(
+        {
+            (side, role): players[role_idx + 5 * side_idx]
+            for side_idx, side in enumerate(("BLUE", "RED"))
+            for role_idx, role in enumerate(roles_list)
+        }
+    )
+    session.add(game)
+    session.flush()
+
+    return game
+
+
+def play_games(server_id: int, games_count: int) -> int:
+    """
+    Plays games between 20 players of the server and scores them one by one, like the bot does
+
+    Returns the number of games
+    """
+    rng = random.Random(0)
+    add_players(server_id, 20)
+
+    for _ in range(games_count):
+        with session_scope() as session:
+            players = rng.sample(session.query(Player).filter(Player.server_id == server_id).all(), 10)
+            add_game(session, players)
+
+            winner_id = rng.choice(players).id
+
+        score_game_from_winning_player(player_id=winner_id, server_id=server_id)
+
+    return games_count
+
+
+@pytest.fixture
+def scored_games():
+    """
+    30 games of SERVER_ID scored one by one, returning the number of games
+    """
+    return play_games(SERVER_ID, 30)
+
+
+@pytest.fixture
+def stale_replay_games():
+    """
+    5 games of STALE_REPLAY_SERVER_ID scored one by one, returning the number of games
+    """
+    return play_games(STALE_REPLAY_SERVER_ID, 5)
+
+
+@pytest.fixture
+def unscored_games():
+    """
+    3 games played by the same 10 players of SCORE_GAMES_SERVER_ID that nobody scored yet, returning their ids
+    """
+    add_players(SCORE_GAMES_SERVER_ID, 10)
+
+    with session_scope() as session:
+        players = (
+            session.query(Player).filter(Player.server_id == SCORE_GAMES_SERVER_ID).order_by(Player.id).all()
+        )
+
+        return [add_game(session, players).id for _ in range(3)]
+
+
+def get_ratings(server_id: int) -> dict:
+    with session_scope() as session:
+        return {
+            (r.player_id, r.role): (r.trueskill_mu, r.trueskill_sigma)
+            for r in session.query(PlayerRating).filter(PlayerRating.player_server_id == server_id)
+        }
+
+
+def test_replay_matches_trueskill():
+    rng = random.Random(0)
+
+    ratings_count = 50
+    rating_indices = np.array([rng.sample(range(ratings_count), 10) for _ in range(300)])
+    blue_won = np.array([rng.random() < 0.5 for _ in range(300)])
+    scored = np.array([rng.random() < 0.9 for _ in range(300)])
+
+    pre_game_mu, pre_game_sigma, mu, sigma = replay_ratings(rating_indices, blue_won, ratings_count, scored)
+
+    # Reference ratings, computed one game at a time with trueskill itself
+    ratings = {rating_index: trueskill.Rating() for rating_index in range(ratings_count)}
+
+    for game_idx, row in enumerate(rating_indices.tolist()):
+        assert np.allclose(pre_game_mu[game_idx], [ratings[r].mu for r in row], atol=1e-9)
+        assert np.allclose(pre_game_sigma[game_idx], [ratings[r].sigma for r in row], atol=1e-9)
+
+        if not scored[game_idx]:
+            continue
+
+        blue_team = {r: ratings[r] for r in row[:5]}
+        red_team = {r: ratings[r] for r in row[5:]}
+
+        for team in trueskill.rate([blue_team, red_team] if blue_won[game_idx] else [red_team, blue_team]):
+            ratings.update(team)
+
+    assert np.allclose(mu, [ratings[r].mu for r in range(ratings_count)], atol=1e-9)
+    assert np.allclose(sigma, [ratings[r].sigma for r in range(ratings_count)], atol=1e-9)
+
+
+def test_schedule_games():
+    rating_indices = np.array([range(0, 10), range(10, 20), range(5, 15), range(20, 30)])
+
+    # The third game has to wait for both first games, the others can be replayed at the same time
+    assert schedule_games(rating_indices, 30).tolist() == [1, 1, 2, 1]
+
+
+def test_recompute_ratings(scored_games):
+    # Games were scored one by one, and replaying them should give the same ratings
+    ratings = get_ratings(SERVER_ID)
+
+    assert recompute_ratings(server_id=SERVER_ID) == scored_games
+
+    recomputed_ratings = get_ratings(SERVER_ID)
+
+    assert ratings.keys() == recomputed_ratings.keys()
+    for key in ratings:
+        assert ratings[key] == pytest.approx(recomputed_ratings[key])
+
+    # Servers replayed in worker processes give the same ratings
+    assert recompute_all_ratings(max_workers=1)[SERVER_ID] == scored_games
+    assert get_ratings(SERVER_ID) == pytest.approx(recomputed_ratings)
+
+
+def test_recompute_stale_replay(stale_replay_games):
+    # Servers without games are left untouched
+    assert recompute_ratings(server_id=EMPTY_SERVER_ID) == 0
+    assert write_latest_replays([replay_server(EMPTY_SERVER_ID)]) == []
+
+    # A game gets scored after the server was replayed
+    stale_replay = replay_server(STALE_REPLAY_SERVER_ID)
+    assert stale_replay.scored_games_count == stale_replay_games
+
+    with session_scope() as session:
+        players = (
+            session.query(Player)
+            .filter(Player.server_id == STALE_REPLAY_SERVER_ID)
+            .filter(Player.id < 10)
+            .order_by(Player.id)
+            .all()
+        )
+        game_id = add_game(session, players).id
+
+    score_games(STALE_REPLAY_SERVER_ID, {game_id: "RED"})
+
+    # The stale replay is not written, the server being replayed again with the new game
+    (replay,) = write_latest_replays([stale_replay])
+
+    assert replay.scored_games_count == stale_replay_games + 1
+
+    ratings = get_ratings(STALE_REPLAY_SERVER_ID)
+    recompute_ratings(server_id=STALE_REPLAY_SERVER_ID)
+
+    assert get_ratings(STALE_REPLAY_SERVER_ID) == pytest.approx(ratings)
+
+
+def test_score_games(unscored_games):
+    # Three games are played by the same players before anybody scores them
+    winners = {unscored_games[0]: "BLUE", unscored_games[1]: "RED", unscored_games[2]: "BLUE", -1: "RED"}
+    assert score_games(SCORE_GAMES_SERVER_ID, winners) == unscored_games
+
+    # Games are already scored
+    assert score_games(SCORE_GAMES_SERVER_ID, {unscored_games[0]: "RED"}) == []
+
+    # Scoring games in order with the previous game’s ratings gives the same ratings as a full replay
+    ratings = get_ratings(SCORE_GAMES_SERVER_ID)
+    recompute_ratings(server_id=SCORE_GAMES_SERVER_ID)
+
+    assert get_ratings(SCORE_GAMES_SERVER_ID) == pytest.approx(ratings)